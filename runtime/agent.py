@@ -4,10 +4,29 @@
 
 import os
 import argparse
-import time
-import re
+import asyncio
+import concurrent.futures
+import errno
+import fnmatch
+import glob
+import random
+import signal
 import datetime
 
+import cgroupfs
+from cgroupfs import CgroupProbe, fs_path
+from events import EventWatcher
+from metrics import Metrics
+from forecast import WorkingSetForecaster
+from page_age import PageAgeHistogram, parse_page_age
+from ring import RingReader, ring_path
+from psi import PsiThresholdController, parse_pressure
+from reclaim import cg_reclaim, paced_reclaim
+from refaults import RefaultBackoff, parse_memory_stat, refaulted_pages
+from swapbudget import SwapWriteAccount, SwapWriteBudget, parse_io_stat, swap_devices
+from throttle import HighClamps, MemoryHighThrottle
+from tiers import TIERS, SwapInLatencyEstimator, tier_bytes
+
 
 def now():
     return datetime.datetime.now().strftime("%H-%M-%S-%f")
@@ -34,75 +53,1143 @@ def write(path, value, append=False):
         return 0
 
 
-def cg_read(path):
-    return read(os.path.join(_FLAGS.cgroup, path))
+def cg_read(cgroup, path):
+    return read(os.path.join(cgroup, path))
 
 
-def cg_write(path, value, append=False):
-    return write(os.path.join(_FLAGS.cgroup, path), value, append=append)
+def cg_write(cgroup, path, value, append=False):
+    return write(os.path.join(cgroup, path), value, append=append)
 
 
-def cg_procs():
-    procs = cg_read("cgroup.procs")
+def cg_procs(cgroup):
+    procs = cg_read(cgroup, "cgroup.procs")
     if procs is None:
         return []
     return list(map(int, list(filter(None, procs.split("\n")))))
 
 
-def probe_workingset_information():
+def parse_numa_stat(buf):
+    """Returns {key: {nid: value}} from the content of memory.numa_stat."""
     ret = {}
-    rr = re.compile("(\d+) anon=(\d+) file=(\d+)")
-    wss = cg_read("memory.workingset.page_age")
-    lines = list(filter(None, re.split("N(\d+)\n", wss)))
-    lines.reverse()
-
-    while lines:
-        nid = int(lines.pop())
-        ret[nid] = []
-        page_age = lines.pop()
-        for t, anon, file in rr.findall(page_age):
-            ret[nid].append((t, anon, file))
+    if buf is None:
+        return ret
+    for line in bytes(buf).splitlines():
+        key, *nodes = line.split()
+        ret[key.decode()] = {
+            int(nid[1:]): int(value)
+            for nid, value in (node.split(b"=") for node in nodes)
+        }
     return ret
 
 
-def start_proactive_reclaim_agent():
-    while True:
-        time.sleep(_FLAGS.reclaim_freq_seconds)
+# Phases of a reclaim cycle timed by the agent. "reclaim" is the latency of a
+# single write to memory.reclaim, "cycle" the whole cycle including pacing.
+PHASES = ("probe", "parse", "decide", "measure", "reclaim", "cycle")
+
+
+def describe_metrics():
+    for name, type, help in [
+        ("wmo_agent_phase_seconds", "histogram", "Time spent in each phase of a reclaim cycle."),
+        ("wmo_agent_cycles_total", "counter", "Reclaim cycles run."),
+        ("wmo_agent_missed_deadlines_total", "counter", "Reclaim cycles that overran their period."),
+        ("wmo_agent_cold_bytes", "gauge", "Cold memory detected by the last cycle."),
+        ("wmo_agent_requested_bytes_total", "counter", "Bytes requested from memory.reclaim."),
+        ("wmo_agent_reclaimed_bytes_total", "counter", "Bytes memory.reclaim succeeded in reclaiming."),
+        ("wmo_agent_saved_bytes", "gauge", "Decrease of resident memory over the last cycle."),
+        ("wmo_agent_reclaim_errors_total", "counter", "Reclaim requests stopped early by a failed write."),
+        ("wmo_agent_reclaim_interruptions_total", "counter", "Reclaim requests interrupted by memory pressure."),
+        ("wmo_agent_refault_ratio", "gauge", "Refaulted over reclaimed bytes over the refault window."),
+        ("wmo_agent_refault_threshold_scale", "gauge", "Factor applied to the cold age threshold because of refaults."),
+        ("wmo_agent_skipped_cycles_total", "counter", "Reclaim cycles skipped because of refaults, a forecast working set growth or too many memory.high clamps."),
+        ("wmo_agent_tier_reclaimed_bytes_total", "counter", "Bytes reclaimed into each tier."),
+        ("wmo_agent_tier_bytes", "gauge", "Uncompressed bytes held in each tier."),
+        ("wmo_agent_tier_swapin_latency_seconds", "gauge", "Estimated stall per page swapped in from each tier."),
+        ("wmo_agent_forecast_bytes", "gauge", "Cold and hot memory forecast for the next cycle."),
+        ("wmo_agent_forecast_error_bytes", "gauge", "Forecast minus actual cold and hot memory of the last cycle."),
+        ("wmo_agent_page_age_reads_total", "counter", "Page age histograms read from the monitor's shared memory or directly."),
+        ("wmo_agent_type_target_bytes", "gauge", "Cold anon and file memory the last cycle set out to reclaim."),
+        ("wmo_agent_type_saved_bytes", "gauge", "Decrease of resident anon and file memory over the last cycle."),
+        ("wmo_agent_swap_written_bytes_total", "counter", "Bytes reclaim wrote to the swap device, charged to the swap write budget."),
+        ("wmo_agent_swap_budget_share", "gauge", "Fraction of the host's swap write budget used by each cgroup lately."),
+        ("wmo_agent_swap_budget_wait_seconds_total", "counter", "Time reclaim requests waited for the swap write budget."),
+    ]:
+        _METRICS.describe(name, type, help)
+
+
+async def export_metrics():
+    loop = asyncio.get_running_loop()
+    if _FLAGS.metrics_address:
+        await _METRICS.serve(_FLAGS.metrics_address)
+        log(f"Serving metrics on {_FLAGS.metrics_address}.")
+    while _FLAGS.metrics_file:
+        try:
+            await loop.run_in_executor(None, _METRICS.write_file, _FLAGS.metrics_file)
+        except OSError as e:
+            log(f"Failed to write metrics to '{_FLAGS.metrics_file}': {e}")
+        await asyncio.sleep(_FLAGS.metrics_freq_seconds)
+
+
+def node_resident_bytes(probe):
+    """Returns {nid: (anon, file)} resident bytes."""
+    numa_stat = parse_numa_stat(probe.read("memory.numa_stat"))
+    anon, file = numa_stat.get("anon", {}), numa_stat.get("file", {})
+    return {nid: (anon.get(nid, 0), file.get(nid, 0)) for nid in anon.keys() | file.keys()}
+
+
+class ManagedCgroup:
+    """A cgroup driven by the agent, with its own reclaim threshold and period."""
+
+    def __init__(self, path, cold_age_threshold_ms, reclaim_freq_seconds, watcher):
+        self.path = path
+        self.cold_age_threshold_ms = cold_age_threshold_ms
+        self.reclaim_freq_seconds = reclaim_freq_seconds
+        self.probe = CgroupProbe(path)
+        self.task = None
+        self.watcher = watcher
+        self.watched_fds = []
+        self.populated = asyncio.Event()
+        self.populated.set()
+        self.pressure_spike = asyncio.Event()
+        # Whether memory.reclaim accepts the "nodes=" argument, unknown until
+        # the first per node request.
+        self.supports_nodes = None
+        # Histograms are shared by all cgroups, counters are per cgroup.
+        self.phases = {
+            phase: _METRICS.histogram("wmo_agent_phase_seconds", phase=phase)
+            for phase in PHASES
+        }
+        self.controller = None
+        if _FLAGS.policy == "psi":
+            self.controller = PsiThresholdController(
+                stall_budget=_FLAGS.psi_stall_budget,
+                increase=_FLAGS.psi_threshold_increase,
+                decrease=_FLAGS.psi_threshold_decrease,
+                min_scale=_FLAGS.psi_min_threshold_ms / cold_age_threshold_ms,
+                max_scale=_FLAGS.psi_max_threshold_ms / cold_age_threshold_ms,
+            )
+        self.backoff = None
+        if _FLAGS.refault_budget > 0:
+            self.backoff = RefaultBackoff(
+                budget=_FLAGS.refault_budget,
+                window=_FLAGS.refault_window_cycles,
+                increase=_FLAGS.refault_threshold_increase,
+                decrease=_FLAGS.refault_threshold_decrease,
+                max_scale=_FLAGS.refault_max_threshold_scale,
+                max_skip=_FLAGS.refault_max_skip_cycles,
+            )
+        self.throttle = None
+        if _FLAGS.reclaim_interface == "memory.high":
+            self.throttle = MemoryHighThrottle(
+                path,
+                _CLAMPS,
+                steps=_FLAGS.memory_high_steps,
+                step_seconds=_FLAGS.memory_high_step_seconds,
+                hold_seconds=_FLAGS.memory_high_hold_seconds,
+                max_events_per_second=_FLAGS.memory_high_max_events_per_second,
+            )
+        # Anon and file memory have their own thresholds and are reclaimed
+        # separately, steered with the "swappiness=" argument of
+        # memory.reclaim. Unknown until probed whether the kernel takes it.
+        # memory.high can't steer reclaim to a type.
+        self.typed = (
+            _FLAGS.anon_cold_age_threshold_ms is not None or _FLAGS.file_cold_age_threshold_ms is not None
+        ) and self.throttle is None
+        self.supports_swappiness = None
+        self.anon_swappiness = "max"
+        self.type_targets = None
+        # Lukewarm memory goes to zswap, colder memory to the SSD. memory.high
+        # can't steer reclaim to a tier either.
+        self.tiered = _FLAGS.ssd_age_threshold_ms is not None and self.throttle is None
+        self.zswap_defaults = None
+        self.latency = None
+        if self.tiered:
+            self.latency = SwapInLatencyEstimator(_FLAGS.swapin_latency_window_cycles)
+        self.forecaster = None
+        if _FLAGS.policy == "predictive":
+            self.forecaster = WorkingSetForecaster(_FLAGS.forecast_window_cycles)
+        # {nid: (threshold, cold bytes, hot bytes)} forecast by the last cycle.
+        self.forecast = None
+        self.period_scale = 1.0
+        self.swap_account = None
+        if _SWAP_BUDGET is not None:
+            self.swap_account = SwapWriteAccount(_SWAP_BUDGET, self.swap_written)
+        self.shared = None
+        if _FLAGS.shared_samples_dir:
+            self.shared = RingReader(ring_path(_FLAGS.shared_samples_dir, path))
+
+    def next_period(self):
+        jitter = _FLAGS.reclaim_jitter
+        return self.reclaim_freq_seconds * self.period_scale * random.uniform(1 - jitter, 1 + jitter)
+
+    def on_cgroup_events(self, events):
+        populated = events.get("populated", 1)
+        if populated and not self.populated.is_set():
+            log(f"[{self.path}] Populated again, resuming reclaim.")
+            self.populated.set()
+        elif not populated and self.populated.is_set():
+            log(f"[{self.path}] Empty, pausing reclaim.")
+            self.populated.clear()
+
+    def on_pressure_spike(self):
+        log(f"[{self.path}] Memory pressure trigger '{_FLAGS.psi_trigger}' fired.")
+        self.pressure_spike.set()
+        if self.throttle is not None:
+            self.throttle.restore("memory pressure")
+        if self.controller is not None:
+            self.controller.on_pressure_spike()
+
+    def watch(self):
+        try:
+            self.watched_fds.append(
+                self.watcher.watch_cgroup_events(
+                    os.path.join(self.path, "cgroup.events"), self.on_cgroup_events
+                )
+            )
+        except OSError as e:
+            log(f"[{self.path}] Failed to watch cgroup.events: {e}")
+
+        if not _FLAGS.psi_trigger:
+            return
+        try:
+            self.watched_fds.append(
+                self.watcher.watch_psi_trigger(
+                    os.path.join(self.path, "memory.pressure"),
+                    _FLAGS.psi_trigger,
+                    self.on_pressure_spike,
+                )
+            )
+        except OSError as e:
+            log(f"[{self.path}] Failed to arm memory pressure trigger: {e}")
+
+    def unwatch(self):
+        for fd in self.watched_fds:
+            self.watcher.unwatch(fd)
+        self.watched_fds = []
+
+    def node_threshold(self, nid):
+        threshold = _NODE_THRESHOLDS.get(nid, self.cold_age_threshold_ms)
+        if self.backoff is not None:
+            threshold *= self.backoff.scale
+        if self.controller is None:
+            return threshold
+        return min(
+            _FLAGS.psi_max_threshold_ms,
+            max(_FLAGS.psi_min_threshold_ms, threshold * self.controller.scale),
+        )
+
+    def ssd_threshold(self, nid):
+        # Scaled along with the cold age threshold, to keep the zswap band.
+        return self.node_threshold(nid) * _FLAGS.ssd_age_threshold_ms / self.cold_age_threshold_ms
+
+    def type_threshold(self, nid, kind):
+        # Scaled along with the cold age threshold of the cgroup.
+        flag = _FLAGS.anon_cold_age_threshold_ms if kind == "anon" else _FLAGS.file_cold_age_threshold_ms
+        if flag is None:
+            return self.node_threshold(nid)
+        return self.node_threshold(nid) * flag / self.cold_age_threshold_ms
+
+    def probe_swappiness(self):
+        """Finds out which "swappiness=" values memory.reclaim takes, with requests of 0 bytes."""
+        if cg_reclaim(self.path, "0 swappiness=0"):
+            self.supports_swappiness = False
+            self.typed = False
+            log(
+                f"[{self.path}] memory.reclaim doesn't support the 'swappiness=' argument, reclaiming anon and file memory together instead."
+            )
+            return
+        self.supports_swappiness = True
+        if cg_reclaim(self.path, "0 swappiness=max"):
+            # Favors anon memory without restricting reclaim to it.
+            self.anon_swappiness = "200"
+            log(f"[{self.path}] memory.reclaim doesn't support 'swappiness=max', reclaiming anon memory with 'swappiness=200'.")
+
+    def reclaim_args(self, tier):
+        """Returns the "swappiness=" argument of the requests of a tier."""
+        if not self.typed:
+            return ""
+        return " swappiness=0" if tier == "file" else f" swappiness={self.anon_swappiness}"
+
+    def configure_tier(self, tier):
+        """Steers reclaim to a tier through memory.zswap.max and memory.zswap.writeback."""
+        if self.zswap_defaults is None:
+            self.zswap_defaults = (
+                cg_read(self.path, "memory.zswap.max"),
+                cg_read(self.path, "memory.zswap.writeback"),
+            )
+            if None in self.zswap_defaults:
+                self.tiered = False
+                log(f"[{self.path}] No per cgroup zswap controls, reclaiming into a single tier instead.")
+                return
+        zswap_max, writeback = self.zswap_defaults
+        if tier == "ssd":
+            # Past memory.zswap.max, pages are written to the swap device
+            # directly, as long as writeback is allowed.
+            settings = [("memory.zswap.writeback", "1"), ("memory.zswap.max", "0")]
+        else:
+            # Without writeback, pages zswap can't take stay in memory rather
+            # than going to the SSD.
+            settings = [("memory.zswap.max", zswap_max), ("memory.zswap.writeback", "0")]
+        for name, value in settings:
+            cg_write(self.path, name, value)
+
+    def restore_tiers(self):
+        if self.zswap_defaults is None or None in self.zswap_defaults:
+            return
+        zswap_max, writeback = self.zswap_defaults
+        cg_write(self.path, "memory.zswap.max", zswap_max)
+        cg_write(self.path, "memory.zswap.writeback", writeback)
+
+    def update_tiers(self):
+        stat = parse_memory_stat(self.probe.read("memory.stat"))
+        pressure = parse_pressure(self.probe.read("memory.pressure"))
+        swap_current = self.probe.read_int("memory.swap.current") or 0
+        if "some" in pressure:
+            self.latency.update(
+                pressure["some"]["total"], stat.get("zswpin", 0), stat.get("pswpin", 0)
+            )
+        held = tier_bytes(stat, swap_current)
+        report = []
+        for tier in TIERS:
+            latency = self.latency.latency[tier]
+            _METRICS.set("wmo_agent_tier_bytes", held[tier], cgroup=self.path, tier=tier)
+            if latency is not None:
+                _METRICS.set("wmo_agent_tier_swapin_latency_seconds", latency, cgroup=self.path, tier=tier)
+            latency = "n/a" if latency is None else f"{latency * 1e6:.1f} us"
+            report.append(f"{tier}: {held[tier] / (1 << 20):.2f} MiB, swap-in latency <= {latency}")
+        log(f"[{self.path}] Tiers: {'; '.join(report)}.")
+
+    def update_controller(self):
+        pressure = parse_pressure(self.probe.read("memory.pressure"))
+        self.controller.update(pressure, cgroupfs.monotonic())
+        some, full = pressure.get("some", {}), pressure.get("full", {})
+        stall = "n/a" if self.controller.stall is None else f"{self.controller.stall:.2%}"
+        log(
+            f"[{self.path}] PSI: some avg10 = {some.get('avg10')}, full avg10 = {full.get('avg10')}, some total = {some.get('total')}, stall = {stall} (budget = {self.controller.stall_budget:.2%}), threshold scale = {self.controller.scale:.3f}."
+        )
+
+    def update_backoff(self):
+        refaulted = refaulted_pages(parse_memory_stat(self.probe.read("memory.stat")))
+        if refaulted is None:
+            return
+        self.backoff.update(refaulted * _PAGE_SIZE)
+        if self.backoff.ratio is None:
+            return
+        reclaimed, refaulted = self.backoff.window()
+        _METRICS.set("wmo_agent_refault_ratio", self.backoff.ratio, cgroup=self.path)
+        _METRICS.set("wmo_agent_refault_threshold_scale", self.backoff.scale, cgroup=self.path)
+        log(
+            f"[{self.path}] Refaulted {refaulted / (1 << 20):.2f} MiB for {reclaimed / (1 << 20):.2f} MiB reclaimed over the last {len(self.backoff.history)} cycles"
+            f" (ratio = {self.backoff.ratio:.2%}, budget = {self.backoff.budget:.2%}), threshold scale = {self.backoff.scale:.3f}."
+        )
+
+    def swap_written(self):
+        """Returns the bytes the cgroup wrote to the swap device so far, or None if it can't tell.
+
+        pswpout only counts swap writes. io.stat also counts the cgroup's
+        other writes to the same disk, e.g. of the file holding the swapfile.
+        """
+        stat = parse_memory_stat(self.probe.read("memory.stat"))
+        if "pswpout" in stat:
+            return stat["pswpout"] * _PAGE_SIZE
+        if not _SWAP_DEVICES:
+            return None
+        io = parse_io_stat(self.probe.read("io.stat"))
+        return sum(io.get(dev, {}).get("wbytes", 0) for dev in _SWAP_DEVICES)
+
+    def report_swap_budget(self, before):
+        account = self.swap_account
+        share = _SWAP_BUDGET.share(account)
+        written, waited = account.total - before[0], account.waited - before[1]
+        _METRICS.inc("wmo_agent_swap_written_bytes_total", written, cgroup=self.path)
+        _METRICS.inc("wmo_agent_swap_budget_wait_seconds_total", waited, cgroup=self.path)
+        _METRICS.set("wmo_agent_swap_budget_share", share, cgroup=self.path)
+        log(
+            f"[{self.path}] Wrote {written / (1 << 20):.2f} MiB to swap, waited {waited:.3f} s for the swap write budget,"
+            f" using {share:.1%} of it lately."
+        )
+
+    def read_page_age(self):
+        with self.phases["probe"].time():
+            buf = self.probe.read("memory.workingset.page_age")
+        with self.phases["parse"].time():
+            hist = parse_page_age(buf)
+        _METRICS.inc("wmo_agent_page_age_reads_total", cgroup=self.path, source="direct")
+        return hist
+
+    def plan_reclaim(self, hist):
+        """Returns the cold bytes per node and the bytes to reclaim per tier and node."""
+        with self.phases["decide"].time():
+            if self.typed:
+                return self.plan_typed_reclaim(hist)
+            coldmem = {}
+            for n, nid in enumerate(hist.nids):
+                threshold = self.node_threshold(nid)
+                coldmem[nid] = int(hist.colder_than(threshold)[n].sum())
+            # Bytes to reclaim per tier and node, None is the only tier when
+            # tiering is off.
+            plan = {None: coldmem}
+            if self.tiered:
+                ssd = {
+                    nid: int(hist.colder_than(self.ssd_threshold(nid))[n].sum())
+                    for n, nid in enumerate(hist.nids)
+                }
+                plan = {"ssd": ssd, "zswap": {nid: coldmem[nid] - ssd[nid] for nid in coldmem}}
+        return coldmem, plan
+
+    def plan_typed_reclaim(self, hist):
+        """plan_reclaim() with anon and file memory at their own thresholds.
+
+        File memory is a tier of its own, reclaimed first since dropping
+        clean page cache is the cheapest. Only anon memory is split between
+        zswap and the SSD.
+        """
+        anon, file, ssd = {}, {}, {}
+        for n, nid in enumerate(hist.nids):
+            anon_threshold = self.type_threshold(nid, "anon")
+            anon[nid] = int(hist.colder_than(anon_threshold)[n, 0])
+            file[nid] = int(hist.colder_than(self.type_threshold(nid, "file"))[n, 1])
+            if self.tiered:
+                ssd[nid] = int(hist.colder_than(max(anon_threshold, self.ssd_threshold(nid)))[n, 0])
+        self.type_targets = (sum(anon.values()), sum(file.values()))
+        coldmem = {nid: anon[nid] + file[nid] for nid in anon}
+        if self.tiered:
+            return coldmem, {"file": file, "ssd": ssd, "zswap": {nid: anon[nid] - ssd[nid] for nid in anon}}
+        return coldmem, {"file": file, None: anon}
+
+    def check_forecast(self, hist):
+        """Reports the error of the last forecast against the histogram it forecast."""
+        for n, nid in enumerate(hist.nids):
+            if nid not in self.forecast:
+                continue
+            threshold, cold, hot = self.forecast[nid]
+            actual_cold = int(hist.colder_than(threshold)[n].sum())
+            actual_hot = int(hist.pages[n].sum()) - actual_cold
+            errors = []
+            for kind, forecast, actual in [("cold", cold, actual_cold), ("hot", hot, actual_hot)]:
+                _METRICS.set("wmo_agent_forecast_error_bytes", forecast - actual, cgroup=self.path, node=nid, kind=kind)
+                # Relative to nothing, the error only makes sense in bytes.
+                relative = f"{(forecast - actual) / actual:+.1%}" if actual > 0 else "n/a"
+                errors.append(f"{(forecast - actual) / (1 << 20):+.2f} MiB ({relative})")
+            log(
+                f"[{self.path}] N{nid}: Forecast {cold / (1 << 20):.2f} MiB cold and {hot / (1 << 20):.2f} MiB hot,"
+                f" got {actual_cold / (1 << 20):.2f} MiB and {actual_hot / (1 << 20):.2f} MiB"
+                f" (error {errors[0]} and {errors[1]})."
+            )
+
+    def apply_forecast(self, hist, coldmem, plan):
+        """Adjusts the plan to the forecast of the next cycle, returns None to skip this cycle."""
+        if self.forecast is not None:
+            self.check_forecast(hist)
+        thresholds = [self.node_threshold(nid) for nid in hist.nids]
+        self.forecaster.update(cgroupfs.monotonic(), hist, thresholds, self.reclaim_freq_seconds)
+        predicted = self.forecaster.predict()
+        self.forecast = None
+        self.period_scale = 1.0
+        if predicted is None:
+            return plan
 
-        wss = probe_workingset_information()[0]
-        coldmem = sum(
-            int(anon) + int(file)
-            for t, anon, file in wss
-            if int(t) >= _FLAGS.cold_age_threshold_ms
+        totals = {nid: int(hist.pages[n].sum()) for n, nid in enumerate(hist.nids)}
+        total_now = sum(totals.values())
+        cold_now = sum(coldmem.values())
+        turning_cold = sum(turning for turning, _ in predicted.values())
+        # Without reclaim, the new memory is hot and only the band turns cold.
+        hot_growth = sum(growth for _, growth in predicted.values()) - turning_cold
+        if hot_growth > _FLAGS.forecast_expansion_fraction * total_now:
+            self.forecast = {
+                nid: (
+                    threshold,
+                    coldmem[nid] + turning,
+                    totals[nid] + growth - coldmem[nid] - turning,
+                )
+                for threshold, (nid, (turning, growth)) in zip(thresholds, predicted.items())
+            }
+            log(
+                f"[{self.path}] The working set is forecast to grow by {hot_growth / (1 << 20):.2f} MiB by the next cycle, skipping this one."
+            )
+            return None
+
+        # Cold memory builds up faster than it's reclaimed: reclaim ahead of
+        # it, memory.reclaim taking the oldest pages first reaches into the
+        # ones about to turn cold, and come back sooner.
+        ahead = {nid: 0 for nid in predicted}
+        if turning_cold > cold_now:
+            ahead = {nid: int(_FLAGS.forecast_lead * turning) for nid, (turning, _) in predicted.items()}
+            tier = "zswap" if self.tiered else None
+            for nid, nbytes in ahead.items():
+                plan[tier][nid] = plan[tier].get(nid, 0) + nbytes
+            self.period_scale = max(_FLAGS.forecast_min_period_fraction, cold_now / turning_cold)
+            log(
+                f"[{self.path}] {turning_cold / (1 << 20):.2f} MiB are forecast to turn cold by the next cycle, reclaiming"
+                f" {sum(ahead.values()) / (1 << 20):.2f} MiB of it ahead and bringing the next cycle forward to {self.period_scale:.0%} of the period."
+            )
+        self.forecast = {}
+        for threshold, (nid, (turning, growth)) in zip(thresholds, predicted.items()):
+            cold = max(0, turning - ahead[nid])
+            total = max(0, totals[nid] - coldmem[nid] - ahead[nid] + growth)
+            self.forecast[nid] = (threshold, cold, max(0, total - cold))
+            _METRICS.set("wmo_agent_forecast_bytes", cold, cgroup=self.path, node=nid, kind="cold")
+            _METRICS.set("wmo_agent_forecast_bytes", self.forecast[nid][2], cgroup=self.path, node=nid, kind="hot")
+        return plan
+
+    def detect_cold_memory(self):
+        # The monitor's histogram is copied out of its ring, a few hundred
+        # bytes, and only used if the monitor didn't write over it meanwhile:
+        # the plan, the forecast and its check all read it.
+        hist = None
+        if self.shared is not None:
+            with self.phases["probe"].time():
+                sample = self.shared.latest(_FLAGS.shared_samples_max_age_seconds)
+                if sample is not None:
+                    hist = PageAgeHistogram(sample.hist.nids, sample.hist.edges.copy(), sample.hist.pages.copy())
+                    if not sample.intact():
+                        log(f"[{self.path}] The monitor overwrote its sample while in use, reading page age directly.")
+                        hist = None
+        if hist is not None:
+            _METRICS.inc("wmo_agent_page_age_reads_total", cgroup=self.path, source="shared")
+        else:
+            hist = self.read_page_age()
+        if hist is None:
+            log(f"[{self.path}] No working set information available.")
+            return None
+
+        if self.controller is not None:
+            self.update_controller()
+        coldmem, plan = self.plan_reclaim(hist)
+        if self.forecaster is not None:
+            with self.phases["decide"].time():
+                plan = self.apply_forecast(hist, coldmem, plan)
+            if plan is None:
+                _METRICS.inc("wmo_agent_skipped_cycles_total", cgroup=self.path, reason="forecast")
+                return None
+
+        for nid, nbytes in coldmem.items():
+            if self.typed:
+                log(
+                    f"[{self.path}] N{nid}: Detected {(nbytes - plan['file'][nid]) / (1 << 20)} MiB of cold anon memory at age {self.type_threshold(nid, 'anon')}"
+                    f" and {plan['file'][nid] / (1 << 20)} MiB of cold file memory at age {self.type_threshold(nid, 'file')}."
+                )
+            else:
+                log(
+                    f"[{self.path}] N{nid}: Detected {nbytes / (1 << 20)} MiB of cold memory at age {self.node_threshold(nid)}."
+                )
+            if self.tiered:
+                log(
+                    f"[{self.path}] N{nid}: {plan['ssd'][nid] / (1 << 20)} MiB of {'the anon memory' if self.typed else 'it'} is older than {self.ssd_threshold(nid)} and goes to the SSD, the rest to zswap."
+                )
+        return plan
+
+    def measure(self):
+        with self.phases["measure"].time():
+            return self.probe.read_int("memory.swap.current"), node_resident_bytes(
+                self.probe
+            )
+
+    def report_types(self, resident_before, resident_after):
+        """Reports the anon and file memory freed by the cycle, against the targets of a typed plan."""
+        saved = [
+            sum(before[i] - resident_after.get(nid, (0, 0))[i] for nid, before in resident_before.items())
+            for i in range(2)
+        ]
+        for kind, nbytes in zip(("anon", "file"), saved):
+            _METRICS.set("wmo_agent_type_saved_bytes", nbytes, cgroup=self.path, type=kind)
+        freed = max(0, saved[0]) + max(0, saved[1])
+        split = f" ({max(0, saved[0]) / freed:.0%} anon)" if freed else ""
+        targets = ""
+        if self.typed and self.type_targets is not None:
+            for kind, nbytes in zip(("anon", "file"), self.type_targets):
+                _METRICS.set("wmo_agent_type_target_bytes", nbytes, cgroup=self.path, type=kind)
+            targets = f", for targets of {self.type_targets[0] / (1 << 20):.2f} MiB and {self.type_targets[1] / (1 << 20):.2f} MiB"
+        log(
+            f"[{self.path}] Saved {saved[0] / (1 << 20):.2f} MiB of anon memory and {saved[1] / (1 << 20):.2f} MiB of file memory{split}{targets}."
+        )
+
+    async def paced_reclaim(self, nbytes, args, duration, budget):
+        return await paced_reclaim(
+            self.path,
+            nbytes,
+            args,
+            _FLAGS.reclaim_chunk_bytes,
+            duration,
+            stop=self.pressure_spike,
+            budget=budget,
         )
-        memswap_before = int(cg_read("memory.swap.current"))
+
+    async def reclaim_nodes(self, coldmem, duration, budget, args=""):
+        """Issues paced reclaim requests per node, returns None if "nodes=" is unsupported."""
+        total = sum(coldmem.values())
+        results = {}
+        for nid, nbytes in coldmem.items():
+            if nbytes == 0:
+                continue
+            result = await self.paced_reclaim(
+                nbytes, f" nodes={nid}{args}", duration * nbytes / total, budget
+            )
+            if result.error == errno.EINVAL and self.supports_nodes is None:
+                self.supports_nodes = False
+                log(
+                    f"[{self.path}] memory.reclaim doesn't support the 'nodes=' argument, reclaiming the whole cgroup instead."
+                )
+                return None
+            self.supports_nodes = True
+            results[nid] = result
+        return results
+
+    async def reclaim(self):
+        loop = asyncio.get_running_loop()
+
+        # Reading the page age report and writing to memory.reclaim both block
+        # until the kernel is done, keep them off the event loop.
+        if self.backoff is not None:
+            await loop.run_in_executor(None, self.update_backoff)
+            if self.backoff.should_skip():
+                _METRICS.inc("wmo_agent_skipped_cycles_total", cgroup=self.path, reason="refaults")
+                log(
+                    f"[{self.path}] Reclaimed memory keeps refaulting even at the longest threshold, skipping this cycle ({self.backoff.skip} more to skip)."
+                )
+                return
+        if self.throttle is not None and len(_CLAMPS) >= _FLAGS.memory_high_max_concurrent:
+            _METRICS.inc("wmo_agent_skipped_cycles_total", cgroup=self.path, reason="memory.high")
+            log(f"[{self.path}] {len(_CLAMPS)} cgroups already have their memory.high lowered, skipping this cycle.")
+            return
+        if self.typed and self.supports_swappiness is None:
+            await loop.run_in_executor(None, self.probe_swappiness)
+        plan = await loop.run_in_executor(None, self.detect_cold_memory)
+        if plan is None:
+            return
+        coldmem = {}
+        for amounts in plan.values():
+            for nid, nbytes in amounts.items():
+                coldmem[nid] = coldmem.get(nid, 0) + nbytes
+
+        memswap_before, resident_before = await loop.run_in_executor(None, self.measure)
+        _METRICS.set("wmo_agent_cold_bytes", sum(coldmem.values()), cgroup=self.path)
         log(
-            f"Detected {coldmem / (1 << 20)} MiB of cold memory at age {_FLAGS.cold_age_threshold_ms}. memory.swap.current = {memswap_before}."
+            f"[{self.path}] Detected {sum(coldmem.values()) / (1 << 20)} MiB of cold memory. memory.swap.current = {memswap_before}."
         )
-        cg_write("memory.reclaim", str(coldmem))
-        memswap_after = int(cg_read("memory.swap.current"))
+
+        duration = self.reclaim_freq_seconds * _FLAGS.reclaim_pacing
+        total = sum(coldmem.values())
+        results = []
+        if self.swap_account is not None:
+            swap_before = (self.swap_account.total, self.swap_account.waited)
+        self.pressure_spike.clear()
+        if self.throttle is not None:
+            plan = {}
+            results.append(
+                (None, "*", await self.throttle.ramp(total, stop=self.pressure_spike, budget=self.swap_account))
+            )
+        try:
+            for tier, amounts in plan.items():
+                nbytes = sum(amounts.values())
+                if nbytes == 0:
+                    continue
+                if tier in TIERS:
+                    await loop.run_in_executor(None, self.configure_tier, tier)
+                # Without writeback, zswap never writes to the swap device,
+                # and page cache goes back to its files.
+                budget = None if tier in ("zswap", "file") else self.swap_account
+                args = self.reclaim_args(tier)
+                tier_results = None
+                if self.supports_nodes is not False:
+                    tier_results = await self.reclaim_nodes(amounts, duration * nbytes / total, budget, args)
+                if tier_results is None:
+                    tier_results = {
+                        "*": await self.paced_reclaim(nbytes, args, duration * nbytes / total, budget)
+                    }
+                results.extend((tier, nid, r) for nid, r in tier_results.items())
+        finally:
+            if self.tiered:
+                await loop.run_in_executor(None, self.restore_tiers)
+
+        memswap_after, resident_after = await loop.run_in_executor(None, self.measure)
+        if self.tiered:
+            await loop.run_in_executor(None, self.update_tiers)
+        if self.swap_account is not None:
+            self.report_swap_budget(swap_before)
+
+        for tier, nid, result in results:
+            if tier in TIERS:
+                _METRICS.inc("wmo_agent_tier_reclaimed_bytes_total", result.reclaimed, cgroup=self.path, tier=tier)
+            if self.backoff is not None:
+                self.backoff.on_reclaimed(result.reclaimed)
+            if self.forecaster is not None:
+                self.forecaster.on_reclaimed(nid, result.reclaimed)
+            for latency in result.latencies:
+                self.phases["reclaim"].observe(latency)
+            _METRICS.inc("wmo_agent_requested_bytes_total", result.requested, cgroup=self.path)
+            _METRICS.inc("wmo_agent_reclaimed_bytes_total", result.reclaimed, cgroup=self.path)
+            stopped = ""
+            if result.error:
+                _METRICS.inc("wmo_agent_reclaim_errors_total", cgroup=self.path)
+                stopped = f" Stopped early: {os.strerror(result.error)}."
+            elif result.interrupted:
+                _METRICS.inc("wmo_agent_reclaim_interruptions_total", cgroup=self.path)
+                stopped = " Interrupted by memory pressure."
+            tier = "" if tier is None else " file" if tier == "file" else f" into {tier}"
+            log(
+                f"[{self.path}] N{nid}{tier}: Requested {result.requested / (1 << 20)} MiB, reclaimed {result.reclaimed / (1 << 20)} MiB in {result.latency_summary()}.{stopped}"
+            )
+        for nid in coldmem:
+            saved = sum(resident_before.get(nid, (0, 0))) - sum(resident_after.get(nid, (0, 0)))
+            _METRICS.set("wmo_agent_saved_bytes", saved, cgroup=self.path, node=nid)
+            log(f"[{self.path}] N{nid}: Saved {saved / (1 << 20)} MiB.")
+        self.report_types(resident_before, resident_after)
         log(
-            f"Reclaimed completed. memory.swap.current = {memswap_after}. Delta = {(memswap_after - memswap_before) / (1 << 20)} MiB"
+            f"[{self.path}] Reclaimed completed. memory.swap.current = {memswap_after}. Delta = {(memswap_after - memswap_before) / (1 << 20)} MiB"
         )
 
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        # Start somewhere within the first period so that cgroups discovered
+        # together don't all reclaim at the same moment.
+        deadline = loop.time() + random.uniform(0, self.reclaim_freq_seconds)
+        self.watch()
+        try:
+            while True:
+                await asyncio.sleep(max(0, deadline - loop.time()))
+                if not self.populated.is_set():
+                    await self.populated.wait()
+                    deadline = loop.time() + self.next_period()
+                    continue
+                try:
+                    with self.phases["cycle"].time():
+                        await self.reclaim()
+                except Exception as e:
+                    log(f"[{self.path}] Reclaim cycle failed: {e}")
+                _METRICS.inc("wmo_agent_cycles_total", cgroup=self.path)
+                deadline += self.next_period()
+                if loop.time() > deadline:
+                    _METRICS.inc("wmo_agent_missed_deadlines_total", cgroup=self.path)
+                    log(
+                        f"[{self.path}] Reclaim cycle overran its period by {loop.time() - deadline:.3f} s."
+                    )
+                    deadline = loop.time()
+        finally:
+            if self.throttle is not None:
+                self.throttle.restore("stopped")
+            self.unwatch()
+            self.probe.close()
+            if self.shared is not None:
+                self.shared.close()
+
+
+def parse_cgroup_config():
+    config = []
+    if not _FLAGS.cgroup_config:
+        return config
+    for item in _FLAGS.cgroup_config.split(";"):
+        pattern, threshold, freq = item.split(",")
+        config.append((fs_path(pattern), float(threshold), float(freq)))
+    return config
+
+
+def parse_node_thresholds():
+    thresholds = {}
+    if not _FLAGS.node_cold_age_threshold_ms:
+        return thresholds
+    for item in _FLAGS.node_cold_age_threshold_ms.split(";"):
+        nid, threshold = item.split(",")
+        thresholds[int(nid)] = float(threshold)
+    return thresholds
+
+
+def discover_cgroups():
+    paths = set(map(fs_path, _FLAGS.cgroup))
+    for pattern in _FLAGS.cgroup_glob:
+        paths.update(glob.glob(fs_path(pattern)))
+    for parent in _FLAGS.parent_cgroup:
+        try:
+            with os.scandir(fs_path(parent)) as it:
+                paths.update(e.path for e in it if e.is_dir(follow_symlinks=False))
+        except OSError as e:
+            log(f"Failed to list children of '{parent}': {e}")
+    return {
+        os.path.normpath(p)
+        for p in paths
+        if os.path.exists(os.path.join(p, "memory.reclaim"))
+    }
+
+
+def make_managed_cgroup(path, config, watcher):
+    threshold = _FLAGS.cold_age_threshold_ms
+    freq = _FLAGS.reclaim_freq_seconds
+    for pattern, pattern_threshold, pattern_freq in config:
+        if fnmatch.fnmatch(path, pattern):
+            threshold, freq = pattern_threshold, pattern_freq
+            break
+    return ManagedCgroup(path, threshold, freq, watcher)
+
+
+async def start_proactive_reclaim_agent():
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=_FLAGS.reclaim_workers)
+    )
+    # PSI triggers and cgroup.events are waited on from the same loop as the
+    # reclaim timers.
+    watcher = EventWatcher()
+    loop.add_reader(watcher.fileno(), watcher.dispatch)
+    # Stop through cancellation, for every cgroup to restore its memory.high
+    # on the way out.
+    main = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        loop.add_signal_handler(signum, main.cancel)
+    config = parse_cgroup_config()
+    managed = {}
+    describe_metrics()
+    if _FLAGS.metrics_address or _FLAGS.metrics_file:
+        exporter = asyncio.create_task(export_metrics())
+
+    while True:
+        discovered = discover_cgroups()
+
+        for path in discovered - managed.keys():
+            cg = make_managed_cgroup(path, config, watcher)
+            log(
+                f"Managing '{path}' (cold age threshold = {cg.cold_age_threshold_ms} ms, reclaim frequency = {cg.reclaim_freq_seconds} s)."
+            )
+            cg.task = asyncio.create_task(cg.run())
+            managed[path] = cg
+
+        for path in managed.keys() - discovered:
+            log(f"'{path}' is gone, no longer managing it.")
+            managed.pop(path).task.cancel()
+            _METRICS.forget(cgroup=path)
+
+        await asyncio.sleep(_FLAGS.discovery_freq_seconds)
+
 
 def splash():
-    start_proactive_reclaim_agent()
+    cgroupfs.FS_ROOT = _FLAGS.fs_root
+    if _SWAP_BUDGET is not None and not _SWAP_DEVICES:
+        _SWAP_DEVICES.update(swap_devices())
+    _CLAMPS.recover()
+    try:
+        asyncio.run(start_proactive_reclaim_agent())
+    except asyncio.CancelledError:
+        log("Stopped.")
+    finally:
+        # Whatever a cgroup didn't get to restore itself.
+        _CLAMPS.release_all()
 
 
 def parse_cmdline_flags():
     parser = argparse.ArgumentParser()
-    parser.add_argument("cgroup", type=str, help="Cgroup to attach to")
+    parser.add_argument("cgroup", type=str, nargs="*", help="Cgroups to attach to")
+    parser.add_argument(
+        "--fs_root",
+        type=str,
+        default="/",
+        help="Directory under which cgroupfs is looked up, e.g. the tree served by emulator.py",
+    )
+    parser.add_argument(
+        "--cgroup_glob",
+        type=str,
+        action="append",
+        default=[],
+        help="Glob pattern of cgroups to attach to, e.g. '/sys/fs/cgroup/tenants/*'",
+    )
+    parser.add_argument(
+        "--parent_cgroup",
+        type=str,
+        action="append",
+        default=[],
+        help="Attach to every child of this cgroup",
+    )
+    parser.add_argument(
+        "--cgroup_config",
+        type=str,
+        help="Per cgroup reclaim configuration, separated by columns ';'."
+        " Each item is a cgroup path pattern followed by its cold age threshold in"
+        " milliseconds and its reclaim frequency in seconds. The first matching item wins. "
+        "e.g. /sys/fs/cgroup/redis-*,30000,20;/sys/fs/cgroup/build,10000,40",
+    )
     parser.add_argument(
         "--reclaim_freq_seconds", type=float, help="Frequency of memory reclaiming"
     )
     parser.add_argument(
         "--cold_age_threshold_ms", type=float, help="Cold age threshold"
     )
+    parser.add_argument(
+        "--policy",
+        type=str,
+        choices=["static", "psi", "predictive"],
+        default="static",
+        help="'static' reclaims at the configured cold age thresholds. 'psi' scales"
+        " them up and down to keep the memory stall time of each cgroup within --psi_stall_budget."
+        " 'predictive' also forecasts the cold and hot memory of the next cycle to reclaim ahead of growing cold memory"
+        " and to hold off while the working set is growing",
+    )
+    parser.add_argument(
+        "--anon_cold_age_threshold_ms",
+        type=float,
+        help="Cold age threshold of anon memory, scaled along with the cold age threshold of each cgroup."
+        " Setting it or --file_cold_age_threshold_ms reclaims anon and file memory separately, with the"
+        " 'swappiness=' argument of memory.reclaim",
+    )
+    parser.add_argument(
+        "--file_cold_age_threshold_ms",
+        type=float,
+        help="Cold age threshold of file memory, scaled along with the cold age threshold of each cgroup",
+    )
+    parser.add_argument(
+        "--reclaim_interface",
+        type=str,
+        choices=["memory.reclaim", "memory.high"],
+        default="memory.reclaim",
+        help="'memory.reclaim' asks the kernel for the cold memory directly. 'memory.high' lowers memory.high"
+        " of the cgroup by the cold memory in --memory_high_steps, holds it for --memory_high_hold_seconds and"
+        " restores it, into a single swap tier",
+    )
+    parser.add_argument(
+        "--memory_high_steps",
+        type=int,
+        default=4,
+        help="Number of writes memory.high is lowered in, --memory_high_step_seconds apart",
+    )
+    parser.add_argument(
+        "--memory_high_step_seconds",
+        type=float,
+        default=1,
+        help="Time between two steps of lowering memory.high, and between two checks of memory.events while it's held",
+    )
+    parser.add_argument(
+        "--memory_high_hold_seconds",
+        type=float,
+        default=5,
+        help="Time memory.high is held at its lowest before it's restored",
+    )
+    parser.add_argument(
+        "--memory_high_max_events_per_second",
+        type=float,
+        default=100,
+        help="Rate of the high counter of memory.events above which memory.high is restored at once",
+    )
+    parser.add_argument(
+        "--memory_high_max_concurrent",
+        type=int,
+        default=8,
+        help="Maximum number of cgroups with their memory.high lowered at once, further cycles are skipped",
+    )
+    parser.add_argument(
+        "--memory_high_state_file",
+        type=str,
+        default="/run/wmo/memory_high.json",
+        help="File recording the memory.high values lowered by the agent, for the next run to restore them"
+        " should this one die before it does",
+    )
+    parser.add_argument(
+        "--forecast_window_cycles",
+        type=int,
+        default=8,
+        help="Number of past cycles the 'predictive' policy fits the trend of the memory growth on",
+    )
+    parser.add_argument(
+        "--forecast_lead",
+        type=float,
+        default=0.5,
+        help="Fraction of the memory forecast to turn cold by the next cycle that is reclaimed ahead of time,"
+        " when it's more than the cold memory of this cycle",
+    )
+    parser.add_argument(
+        "--forecast_expansion_fraction",
+        type=float,
+        default=0.1,
+        help="Forecast growth of the hot memory by the next cycle, as a fraction of the cgroup's memory,"
+        " above which the cycle is skipped",
+    )
+    parser.add_argument(
+        "--forecast_min_period_fraction",
+        type=float,
+        default=0.5,
+        help="Fraction of the reclaim period the next cycle can be brought forward to when cold memory builds up",
+    )
+    parser.add_argument(
+        "--psi_stall_budget",
+        type=float,
+        default=0.01,
+        help="Fraction of wall time a cgroup may be stalled on memory (PSI some) under the 'psi' policy",
+    )
+    parser.add_argument(
+        "--psi_threshold_increase",
+        type=float,
+        default=1.5,
+        help="Factor applied to the cold age threshold when the stall budget is exceeded",
+    )
+    parser.add_argument(
+        "--psi_threshold_decrease",
+        type=float,
+        default=0.9,
+        help="Factor applied to the cold age threshold when memory pressure is near zero",
+    )
+    parser.add_argument(
+        "--psi_min_threshold_ms",
+        type=float,
+        default=1000,
+        help="Lowest cold age threshold the 'psi' policy may use",
+    )
+    parser.add_argument(
+        "--psi_max_threshold_ms",
+        type=float,
+        default=300000,
+        help="Highest cold age threshold the 'psi' policy may use",
+    )
+    parser.add_argument(
+        "--psi_trigger",
+        type=str,
+        default="some 150000 1000000",
+        help="PSI trigger armed on the memory.pressure file of every cgroup, as"
+        " '<some|full> <stall us> <window us>'. In flight reclaim is interrupted as soon"
+        " as it fires. Empty to disable",
+    )
+    parser.add_argument(
+        "--node_cold_age_threshold_ms",
+        type=str,
+        help="Numa node specific cold age thresholds in milliseconds, separated by columns ';'."
+        " The first element in each item specified the affected numa node. "
+        "e.g. 0,10000;1,30000",
+    )
+    parser.add_argument(
+        "--reclaim_chunk_bytes",
+        type=int,
+        default=64 << 20,
+        help="Maximum number of bytes asked to memory.reclaim in a single write, 0 for no limit",
+    )
+    parser.add_argument(
+        "--reclaim_pacing",
+        type=float,
+        default=0.5,
+        help="Fraction of the reclaim period over which the chunks of a reclaim cycle are spread",
+    )
+    parser.add_argument(
+        "--reclaim_jitter",
+        type=float,
+        default=0.1,
+        help="Fraction by which each reclaim period is randomly stretched or shrunk",
+    )
+    parser.add_argument(
+        "--discovery_freq_seconds",
+        type=float,
+        default=10,
+        help="Frequency of looking for new or removed cgroups",
+    )
+    parser.add_argument(
+        "--reclaim_workers",
+        type=int,
+        default=4,
+        help="Maximum number of memory.reclaim writes in flight at once",
+    )
+    parser.add_argument(
+        "--metrics_address",
+        type=str,
+        help="Serve metrics in the Prometheus text format over HTTP on host:port or unix:/path/to/socket",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        help="Path of a file periodically replaced with the metrics in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--metrics_freq_seconds",
+        type=float,
+        default=15,
+        help="Frequency of writing --metrics_file",
+    )
+    parser.add_argument(
+        "--refault_budget",
+        type=float,
+        default=0.2,
+        help="Refaulted bytes over reclaimed bytes above which reclaim of a cgroup backs off, 0 to never back off",
+    )
+    parser.add_argument(
+        "--refault_window_cycles",
+        type=int,
+        default=10,
+        help="Number of reclaim cycles over which refaults are compared to reclaimed bytes",
+    )
+    parser.add_argument(
+        "--refault_threshold_increase",
+        type=float,
+        default=1.5,
+        help="Factor applied to the cold age threshold when refaults exceed the budget",
+    )
+    parser.add_argument(
+        "--refault_threshold_decrease",
+        type=float,
+        default=0.9,
+        help="Factor applied to the cold age threshold when refaults are well under the budget",
+    )
+    parser.add_argument(
+        "--refault_max_threshold_scale",
+        type=float,
+        default=8,
+        help="Maximum factor applied to the cold age threshold because of refaults, before skipping cycles",
+    )
+    parser.add_argument(
+        "--refault_max_skip_cycles",
+        type=int,
+        default=8,
+        help="Maximum number of consecutive cycles skipped because of refaults",
+    )
+    parser.add_argument(
+        "--ssd_age_threshold_ms",
+        type=float,
+        help="Reclaim memory older than this to the SSD and memory between --cold_age_threshold_ms and this to zswap."
+        " Scaled along with the cold age threshold of each cgroup. Unset, everything goes to the same swap",
+    )
+    parser.add_argument(
+        "--swapin_latency_window_cycles",
+        type=int,
+        default=10,
+        help="Number of reclaim cycles over which the swap-in latency of each tier is estimated",
+    )
+    parser.add_argument(
+        "--swap_write_budget_bytes_per_second",
+        type=int,
+        default=0,
+        help="Bytes per second all cgroups together may reclaim to the swap device, 0 for no limit."
+        " Shared fairly between the cgroups that reclaim at the same time",
+    )
+    parser.add_argument(
+        "--swap_write_burst_bytes",
+        type=int,
+        default=256 << 20,
+        help="Bytes the swap write budget can accumulate while reclaim is idle",
+    )
+    parser.add_argument(
+        "--swap_device",
+        type=str,
+        action="append",
+        default=[],
+        help="MAJ:MIN of a disk holding swap, whose writes in io.stat count against the swap write budget"
+        " on kernels without pswpout in memory.stat. Found from /proc/swaps by default",
+    )
+    parser.add_argument(
+        "--shared_samples_dir",
+        type=str,
+        help="The monitor's --publish_dir: take page age histograms from it rather than reading them, while the monitor runs",
+    )
+    parser.add_argument(
+        "--shared_samples_max_age_seconds",
+        type=float,
+        default=2,
+        help="Age above which a published histogram is too old to use and page age is read directly",
+    )
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     _FLAGS = parse_cmdline_flags()
+    _NODE_THRESHOLDS = parse_node_thresholds()
+    _METRICS = Metrics()
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+    _CLAMPS = HighClamps(_FLAGS.memory_high_state_file)
+    _SWAP_BUDGET = None
+    if _FLAGS.swap_write_budget_bytes_per_second > 0:
+        _SWAP_BUDGET = SwapWriteBudget(
+            _FLAGS.swap_write_budget_bytes_per_second, _FLAGS.swap_write_burst_bytes
+        )
+    _SWAP_DEVICES = set(_FLAGS.swap_device)
     splash()
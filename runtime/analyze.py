@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+"""Headless comparison of control and experimental benchmark traces"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+
+import numpy as np
+
+from samples import MISSING
+from tracefile import TraceReader
+
+
+def now():
+    return datetime.datetime.now().strftime("%H-%M-%S-%f")
+
+
+def log(msg):
+    print(f"{now()} -- INFO: [{__name__}] {msg}")
+
+
+GIB = 1 << 30
+MIB = 1 << 20
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of freedom.
+_T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+class QuantileSketch:
+    """Streaming quantiles with a bounded relative error, in bounded memory.
+
+    Values are counted in logarithmic buckets, so a quantile is off by at
+    most `accuracy` of its value whatever the number of samples.
+    """
+
+    __slots__ = ("gamma", "counts", "zeros", "count")
+
+    def __init__(self, accuracy=0.005):
+        self.gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.counts = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        self.count += len(values)
+        keys, counts = np.unique(
+            np.ceil(np.log(positive) / self.gamma).astype(np.int64), return_counts=True
+        )
+        for k, c in zip(keys.tolist(), counts.tolist()):
+            self.counts[k] = self.counts.get(k, 0) + c
+
+    def quantile(self, q):
+        if self.count == 0:
+            return float("nan")
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.counts):
+            seen += self.counts[k]
+            if rank < seen:
+                # Middle of the bucket, in the relative sense.
+                return 2 * math.exp(k * self.gamma) / (1 + math.exp(self.gamma))
+        return 2 * math.exp(max(self.counts) * self.gamma) / (1 + math.exp(self.gamma))
+
+
+class Downsampler:
+    """Keeps at most 2 * points (t, max value) pairs of a series of unknown length."""
+
+    __slots__ = ("points", "window", "t", "values", "pending")
+
+    def __init__(self, points):
+        self.points = points
+        self.window = 1
+        self.t = []
+        self.values = []
+        self.pending = 0
+
+    def add(self, t, value):
+        if self.pending:
+            self.values[-1] = max(self.values[-1], value)
+        else:
+            self.t.append(t)
+            self.values.append(value)
+        self.pending = (self.pending + 1) % self.window
+
+        if len(self.t) >= 2 * self.points and not self.pending:
+            self.t = self.t[::2]
+            self.values = [max(pair) for pair in zip(self.values[::2], self.values[1::2])]
+            self.window *= 2
+
+
+class RunStats:
+    """Statistics of a single trace, accumulated chunk by chunk."""
+
+    def __init__(self, path):
+        self.path = path
+        self.samples = 0
+        self.first_t = None
+        self.last_t = None
+        self.last_current = None
+        self.last_swap = None
+        self.first_counters = None
+        self.last_counters = None
+        self.peak = 0
+        self.peak_swap = 0
+        self.memory_integral = 0.0
+        self.swap_integral = 0.0
+        self.swap_increase = 0
+        self.swap_decrease = 0
+        self.has_counters = False
+        self.quantiles = QuantileSketch()
+        self.intervals = QuantileSketch()
+        # [(time, seconds)] of the sampling gaps left out of the integrals.
+        self.gaps = []
+        self.series = Downsampler(_FLAGS.plot_points)
+
+    def add_chunk(self, t, current, swap, counters):
+        if self.last_t is not None:
+            # Each sample holds until the next one.
+            t = np.concatenate([[self.last_t], t])
+            current = np.concatenate([[self.last_current], current])
+            swap = np.concatenate([[self.last_swap], swap])
+        else:
+            self.first_t = t[0]
+            self.first_counters = counters[0]
+            self.quantiles.add(current[:1])
+            self.samples += 1
+
+        dt = np.diff(t)
+        # The monitor stopped or stalled: memory in between is unknown, leave
+        # intervals much longer than usual out of the runtime and integrals.
+        self.intervals.add(dt)
+        gaps = np.flatnonzero(dt > _FLAGS.max_gap_intervals * self.intervals.quantile(0.5))
+        for i in gaps.tolist():
+            self.gaps.append((float(t[i]), float(dt[i])))
+        dt[gaps] = 0
+        swap_delta = np.diff(swap)
+        self.swap_increase += int(swap_delta[swap_delta > 0].sum())
+        self.swap_decrease -= int(swap_delta[swap_delta < 0].sum())
+        self.memory_integral += float(np.dot(current[:-1], dt))
+        self.swap_integral += float(np.dot(swap[:-1], dt))
+        self.peak = max(self.peak, int(current.max()))
+        self.peak_swap = max(self.peak_swap, int(swap.max()))
+        self.quantiles.add(current[1:])
+        self.samples += len(current) - 1
+        for ti, ci in zip(t[1:].tolist(), current[1:].tolist()):
+            self.series.add(ti, ci)
+
+        self.last_t, self.last_current, self.last_swap = t[-1], current[-1], swap[-1]
+        self.last_counters = counters[-1]
+
+    def metrics(self):
+        if self.has_counters:
+            swapout, swapin = (self.last_counters - self.first_counters) * _PAGE_SIZE
+        else:
+            # Without pswpout/pswpin, the swap traffic is at least what
+            # memory.swap.current went up and down by.
+            swapout, swapin = self.swap_increase, self.swap_decrease
+        return {
+            "runtime_seconds": float(self.last_t - self.first_t) - sum(s for _, s in self.gaps),
+            "peak_memory_bytes": self.peak,
+            "p50_memory_bytes": self.quantiles.quantile(0.50),
+            "p95_memory_bytes": self.quantiles.quantile(0.95),
+            "p99_memory_bytes": self.quantiles.quantile(0.99),
+            "memory_gib_seconds": self.memory_integral / GIB,
+            "peak_swap_bytes": self.peak_swap,
+            "swap_gib_seconds": self.swap_integral / GIB,
+            "swapout_bytes": int(swapout),
+            "swapin_bytes": int(swapin),
+        }
+
+
+_COLUMNS = [
+    "timestamp",
+    "memory.current",
+    "memory.swap.current",
+    "memory.stat.pswpout",
+    "memory.stat.pswpin",
+]
+
+
+def fill_missing(column, last):
+    """Carries the last known value, starting from last, forward over MISSING."""
+    column = np.concatenate(([last], column))
+    index = np.where(column != MISSING, np.arange(len(column)), 0)
+    np.maximum.accumulate(index, out=index)
+    return column[index][1:]
+
+
+def analyze_binary_trace(path):
+    stats = RunStats(path)
+    reader = TraceReader(path)
+    try:
+        if "timestamp" not in reader.labels or "memory.current" not in reader.labels:
+            raise ValueError(f"'{path}' has no timestamp or memory.current column")
+        labels = [c for c in _COLUMNS if c in reader.labels]
+        stats.has_counters = len(labels) == len(_COLUMNS)
+        last = dict.fromkeys(_COLUMNS, 0)
+        for i in range(len(reader.blocks)):
+            block = reader.read_block(i, labels)
+            nrows = len(block["timestamp"])
+            chunk = {}
+            for label in _COLUMNS:
+                if label in block:
+                    chunk[label] = fill_missing(block[label], last[label])
+                else:
+                    chunk[label] = np.zeros(nrows, dtype=np.int64)
+                if nrows:
+                    last[label] = chunk[label][-1]
+            stats.add_chunk(
+                chunk["timestamp"] / 1000,
+                chunk["memory.current"],
+                chunk["memory.swap.current"],
+                np.stack([chunk["memory.stat.pswpout"], chunk["memory.stat.pswpin"]], axis=1),
+            )
+    finally:
+        reader.close()
+    return stats
+
+
+def analyze_trace(path):
+    if path.endswith(".trace"):
+        return analyze_binary_trace(path)
+    stats = RunStats(path)
+    with open(path, "r") as f:
+        header = f.readline().rstrip("\n").split(",")
+        index = [header.index(c) if c in header else None for c in _COLUMNS]
+        if index[0] is None or index[1] is None:
+            raise ValueError(f"'{path}' has no timestamp or memory.current column")
+        stats.has_counters = index[3] is not None and index[4] is not None
+
+        # Samples written by the streaming monitor can miss some labels, carry
+        # the last known value forward.
+        last = [0] * len(_COLUMNS)
+        while True:
+            lines = f.readlines(_FLAGS.chunk_bytes)
+            if not lines:
+                break
+            chunk = np.empty((len(lines), len(_COLUMNS)), dtype=np.int64)
+            for r, line in enumerate(lines):
+                cells = line.rstrip("\n").split(",")
+                for c, i in enumerate(index):
+                    if i is not None and i < len(cells) and cells[i] != "":
+                        last[c] = int(cells[i])
+                chunk[r] = last
+            stats.add_chunk(
+                chunk[:, 0] / 1000, chunk[:, 1], chunk[:, 2], chunk[:, 3:]
+            )
+    return stats
+
+
+def summarize(values):
+    values = np.asarray(values, dtype=np.float64)
+    mean = float(values.mean())
+    if len(values) < 2:
+        return {"mean": mean, "ci95": None, "runs": len(values)}
+    t = _T95[len(values) - 2] if len(values) - 2 < len(_T95) else 1.96
+    ci = t * float(values.std(ddof=1)) / math.sqrt(len(values))
+    return {"mean": mean, "ci95": ci, "runs": len(values)}
+
+
+def compare(control, experimental):
+    report = {}
+    for metric in control[0]:
+        c = summarize([m[metric] for m in control])
+        e = summarize([m[metric] for m in experimental])
+        change = (e["mean"] - c["mean"]) / c["mean"] if c["mean"] else None
+        report[metric] = {"control": c, "experimental": e, "relative_change": change}
+    return report
+
+
+def plot(control, experimental):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(_FLAGS.plots_dir, exist_ok=True)
+    fig, ax = plt.subplots()
+    for name, runs in [("control", control), ("experimental", experimental)]:
+        for run in runs:
+            t = np.array(run.series.t) - run.first_t
+            ax.plot(t, np.array(run.series.values) / MIB, label=f"{name}: {os.path.basename(run.path)}")
+    ax.set_xlabel("time (s)")
+    ax.set_ylabel("memory.current (MiB)")
+    ax.legend()
+    path = os.path.join(_FLAGS.plots_dir, "memory_current.png")
+    fig.savefig(path)
+    log(f"Saved {path}.")
+
+
+def splash():
+    control = [analyze_trace(p) for p in _FLAGS.control]
+    experimental = [analyze_trace(p) for p in _FLAGS.experimental]
+    for run in control + experimental:
+        if run.gaps:
+            log(
+                f"Left {len(run.gaps)} sampling gaps of {sum(s for _, s in run.gaps):.1f} s in total out of '{run.path}',"
+                f" the longest {max(s for _, s in run.gaps):.1f} s."
+            )
+    report = {
+        name: [
+            {"path": r.path, **r.metrics(), "gaps": [{"time": t, "seconds": s} for t, s in r.gaps]}
+            for r in runs
+        ]
+        for name, runs in [("control", control), ("experimental", experimental)]
+    }
+    report["comparison"] = compare(
+        [r.metrics() for r in control], [r.metrics() for r in experimental]
+    )
+
+    peak = report["comparison"]["peak_memory_bytes"]
+    print(f"peak memory usage (with WMO): {peak['experimental']['mean'] / MIB:.4f} MiB")
+    print(f"peak memory usage (control): {peak['control']['mean'] / MIB:.4f} MiB")
+    print(f"peak memory reduction: {-peak['relative_change']:.1%}")
+    for metric, values in report["comparison"].items():
+        change = values["relative_change"]
+        change = "n/a" if change is None else f"{change:+.1%}"
+        print(
+            f"{metric}: control = {values['control']['mean']:.6g}, experimental = {values['experimental']['mean']:.6g} ({change})"
+        )
+
+    if _FLAGS.output:
+        with open(_FLAGS.output, "w") as f:
+            json.dump(report, f, indent=2)
+        log(f"Report written to {_FLAGS.output}.")
+    if _FLAGS.plots_dir:
+        plot(control, experimental)
+
+
+def parse_cmdline_flags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--control", type=str, nargs="+", required=True, help="Control runs"
+    )
+    parser.add_argument(
+        "--experimental", type=str, nargs="+", required=True, help="Experimental runs"
+    )
+    parser.add_argument("--output", type=str, help="Path to the JSON report")
+    parser.add_argument("--plots_dir", type=str, help="Directory of the PNG plots")
+    parser.add_argument(
+        "--plot_points",
+        type=int,
+        default=2000,
+        help="Maximum number of points kept per plotted series",
+    )
+    parser.add_argument(
+        "--max_gap_intervals",
+        type=float,
+        default=10,
+        help="Intervals between samples longer than this many times the median interval are sampling gaps,"
+        " left out of the runtime and the memory and swap integrals and listed in the report",
+    )
+    parser.add_argument(
+        "--chunk_bytes",
+        type=int,
+        default=16 << 20,
+        help="Number of bytes of a trace processed at once",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    _FLAGS = parse_cmdline_flags()
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+    splash()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark of the memory.workingset.page_age parsers"""
+
+import argparse
+import re
+import timeit
+
+from page_age import parse_page_age
+
+
+def legacy_probe_workingset_information(wss):
+    # Parser formerly duplicated in agent.py and monitoring.py.
+    ret = {}
+    rr = re.compile("(\d+) anon=(\d+) file=(\d+)")
+    lines = list(filter(None, re.split("N(\d+)\n", wss)))
+    lines.reverse()
+
+    while lines:
+        nid = int(lines.pop())
+        ret[nid] = []
+        page_age = lines.pop()
+        for t, anon, file in rr.findall(page_age):
+            ret[nid].append((t, anon, file))
+    return ret
+
+
+def legacy_coldmem(wss, threshold):
+    return sum(
+        int(anon) + int(file)
+        for nid, info in legacy_probe_workingset_information(wss).items()
+        for t, anon, file in info
+        if int(t) >= threshold
+    )
+
+
+def coldmem(wss, threshold):
+    return int(parse_page_age(wss).colder_than(threshold).sum())
+
+
+def synthetic_page_age(nodes, buckets):
+    lines = []
+    for nid in range(nodes):
+        lines.append(f"N{nid}")
+        for b in range(1, buckets):
+            lines.append(f"{b * 1000} anon={b * 123456789} file={b * 987654321}")
+        lines.append(f"18446744073709551615 anon=4096 file=8192")
+    return "\n".join(lines) + "\n"
+
+
+def parse_cmdline_flags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=2, help="Number of numa nodes")
+    parser.add_argument(
+        "--buckets", type=int, default=16, help="Number of page age buckets per node"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=10000, help="Number of parses per run"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    _FLAGS = parse_cmdline_flags()
+    wss = synthetic_page_age(_FLAGS.nodes, _FLAGS.buckets)
+    raw = wss.encode()
+    threshold = _FLAGS.buckets * 1000 // 2
+
+    assert legacy_coldmem(wss, threshold) == coldmem(raw, threshold)
+
+    for name, stmt in [
+        ("legacy regex parser", lambda: legacy_coldmem(wss, threshold)),
+        ("parse_page_age", lambda: coldmem(raw, threshold)),
+    ]:
+        best = min(timeit.repeat(stmt, number=_FLAGS.iterations, repeat=5))
+        print(f"{name}: {best / _FLAGS.iterations * 1e6:.2f} us per parse")
@@ -0,0 +1,127 @@
+"""Persistent cgroupfs probes shared by the agent and the monitor"""
+
+import datetime
+import errno
+import os
+import time
+
+
+def now():
+    return datetime.datetime.now().strftime("%H-%M-%S-%f")
+
+
+def log(msg):
+    print(f"{now()} -- INFO: [{__name__}] {msg}")
+
+
+# Directory under which cgroupfs and sysfs paths are looked up, e.g. the tree
+# served by emulator.py instead of the real /sys.
+FS_ROOT = "/"
+
+# Clock of the agent's and the monitor's measurements, the emulator swaps it
+# for its virtual clock.
+monotonic = time.monotonic
+
+
+def fs_path(path):
+    if FS_ROOT == "/":
+        return path
+    return os.path.join(FS_ROOT, os.path.relpath(path, "/"))
+
+
+# Errors returned when the file (or the cgroup holding it) went away under
+# an open descriptor. The cgroup may have been recreated, so reopen.
+_STALE_ERRNOS = (errno.ENODEV, errno.ENOENT, errno.ESTALE)
+
+
+class CgroupFile:
+    """An open cgroup file re-read in place with positioned reads.
+
+    With dir_fd, path is relative to that open directory.
+    """
+
+    __slots__ = ("path", "fd", "buf", "dir_fd")
+
+    def __init__(self, path, bufsize=4096, dir_fd=None):
+        self.path = path
+        self.fd = None
+        self.buf = bytearray(bufsize)
+        self.dir_fd = dir_fd
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC, dir_fd=self.dir_fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _pread(self):
+        while True:
+            n = os.preadv(self.fd, [self.buf], 0)
+            if n < len(self.buf):
+                return memoryview(self.buf)[:n]
+            # The buffer was filled up, the file might be larger than that.
+            self.buf = bytearray(2 * len(self.buf))
+
+    def read(self):
+        """Returns a view over the file content, valid until the next read."""
+        try:
+            if self.fd is None:
+                self.open()
+            return self._pread()
+        except OSError as e:
+            if e.errno not in _STALE_ERRNOS:
+                raise
+            self.close()
+
+        self.open()
+        return self._pread()
+
+
+class CgroupProbe:
+    """Keeps the files of a cgroup open across samples.
+
+    A file the cgroup doesn't have while the cgroup itself exists, e.g.
+    io.stat with the io controller off, is reported once and not read again
+    until the probe is closed.
+    """
+
+    def __init__(self, cgroup):
+        self.cgroup = cgroup
+        self.files = {}
+        self.missing = set()
+
+    def file(self, name):
+        f = self.files.get(name)
+        if f is None:
+            f = self.files[name] = CgroupFile(os.path.join(self.cgroup, name))
+        return f
+
+    def read(self, name):
+        if name in self.missing:
+            return None
+        try:
+            return self.file(name).read()
+        except FileNotFoundError as e:
+            # Unless the whole cgroup went away, the file won't show up.
+            if os.path.isdir(self.cgroup):
+                log(f"'{os.path.join(self.cgroup, name)}' doesn't exist, not reading it again.")
+                self.missing.add(name)
+                self.files.pop(name).close()
+            else:
+                log(f"Failed to read from path '{os.path.join(self.cgroup, name)}': {e}")
+        except OSError as e:
+            log(f"Failed to read from path '{os.path.join(self.cgroup, name)}': {e}")
+
+    def read_int(self, name):
+        value = self.read(name)
+        if value is None:
+            return None
+        return int(value.tobytes())
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+        self.missing.clear()
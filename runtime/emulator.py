@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+
+"""Emulated cgroupfs and sysfs backed by a synthetic memory model
+
+The emulator lays out the files the agent and the monitor use (including the
+working set report ones, which only exist on kernels carrying the patch
+series) under a directory, and keeps them up to date from a synthetic model
+of each cgroup's memory. Point the tools at it with --fs_root.
+
+'serve' steps the model in real time (optionally sped up) so that any number
+of processes can run against it. 'agent' runs agent.py unmodified in this
+process on a virtual clock, as fast as the model allows, and reports what the
+agent achieved and what it cost.
+"""
+
+import argparse
+import asyncio
+import datetime
+import math
+import os
+import random
+import runpy
+import select
+import sys
+import time
+
+import numpy as np
+
+import cgroupfs
+
+PAGE_SIZE = 4096
+U64_MAX = (1 << 64) - 1
+# Pages charged at once, the kernel checks memory.high once per batch.
+HIGH_BATCH_PAGES = 64
+
+HOT = 0
+COLD = 1
+
+ZSWAP = 0
+SSD = 1
+
+
+def now():
+    return datetime.datetime.now().strftime("%H-%M-%S-%f")
+
+
+def log(msg):
+    print(f"{now()} -- INFO: [{__name__}] {msg}")
+
+
+class MemoryModel:
+    """Synthetic memory of a cgroup.
+
+    The workload allocates up to its footprint. A fraction of its memory is
+    hot and touched again every hot interval, the rest is cold and only
+    touched at a low rate. Resident memory is kept per node, population and
+    age (bins of one tick), swapped out memory per node, population and tier
+    (zswap or SSD). Reclaim evicts the oldest memory first, as MGLRU would,
+    into zswap within memory.zswap.max and to the SSD past it, unless
+    memory.zswap.writeback is off. Swapped out memory refaults when touched,
+    which stalls the workload and shows up in memory.pressure. Memory above
+    memory.high is reclaimed at every tick. Lowering memory.high reclaims down
+    to it quietly, as the writer does, past that every charge batch over the
+    limit counts as a high event in memory.events.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.tick = params.tick_seconds
+        self.bins = int(math.ceil(params.max_age_seconds / self.tick)) + 1
+        self.hot_bins = max(1, int(round(params.hot_interval_seconds / self.tick)))
+        nodes = params.nodes
+        self.resident = np.zeros((nodes, 2, self.bins), dtype=np.float64)
+        self.swapped = np.zeros((nodes, 2, 2), dtype=np.float64)
+        self.allocated = 0.0
+        # Anon bytes per tier, the file part of reclaimed memory is dropped.
+        self.swapin = np.zeros(2)
+        self.swapout = np.zeros(2)
+        self.refault = 0.0
+        self.high = math.inf
+        self.high_events = 0
+        self.peak = 0.0
+        self.some_total_us = 0.0
+        self.full_total_us = 0.0
+        self.avg = {10: 0.0, 60: 0.0, 300: 0.0}
+
+    def zswapped(self):
+        return float(self.swapped[:, :, ZSWAP].sum()) * self.params.anon_fraction
+
+    def zswap_current(self):
+        return self.zswapped() / self.params.zswap_compression_ratio
+
+    def current(self):
+        # Compressed memory is charged to the cgroup.
+        return float(self.resident.sum()) + self.zswap_current()
+
+    def swap_current(self):
+        return float(self.swapped.sum()) * self.params.anon_fraction
+
+    def step(self):
+        p, dt = self.params, self.tick
+        nodes = p.nodes
+
+        # Allocation, spread evenly over the nodes.
+        new = min(p.alloc_rate_bytes * dt, p.footprint_bytes - self.allocated)
+        if new > 0:
+            self.allocated += new
+            self.resident[:, HOT, 0] += new * p.hot_fraction / nodes
+            self.resident[:, COLD, 0] += new * (1 - p.hot_fraction) / nodes
+
+        # Aging, the last bin holds everything older than max_age_seconds.
+        oldest = self.resident[:, :, -2:].sum(axis=2)
+        self.resident[:, :, 1:] = self.resident[:, :, :-1].copy()
+        self.resident[:, :, -1] = oldest
+        self.resident[:, :, 0] = 0
+
+        # Hot memory is touched again once it's hot_interval old.
+        touched = self.resident[:, HOT, self.hot_bins :].sum(axis=1)
+        self.resident[:, HOT, self.hot_bins :] = 0
+        self.resident[:, HOT, 0] += touched
+
+        # Cold memory is touched at cold_access_rate.
+        rate = min(1.0, p.cold_access_rate * dt)
+        touched = self.resident[:, COLD].sum(axis=1) * rate
+        self.resident[:, COLD] *= 1 - rate
+        self.resident[:, COLD, 0] += touched
+
+        # Swapped out memory refaults when touched.
+        rates = np.array([min(1.0, dt / p.hot_interval_seconds), rate])
+        refault = self.swapped * rates[None, :, None]
+        self.swapped -= refault
+        self.resident[:, :, 0] += refault.sum(axis=2)
+        by_tier = refault.sum(axis=(0, 1))
+        self.refault += float(by_tier.sum())
+        self.swapin += by_tier * p.anon_fraction
+
+        # Every refaulted page stalls the workload, for less if it was only
+        # compressed. Page cache is read back from the disk.
+        stall = (
+            by_tier[ZSWAP] * p.anon_fraction * p.zswap_latency_us
+            + (by_tier[SSD] * p.anon_fraction + by_tier.sum() * (1 - p.anon_fraction))
+            * p.swapin_latency_us
+        ) / PAGE_SIZE / 1e6
+        stall = min(dt, stall)
+        self.some_total_us += stall * 1e6
+        self.full_total_us += stall * p.full_stall_fraction * 1e6
+        for window in self.avg:
+            decay = math.exp(-dt / window)
+            self.avg[window] = self.avg[window] * decay + 100 * stall / dt * (1 - decay)
+
+        self.peak = max(self.peak, self.current())
+
+    def reclaim(self, nbytes, nodes=None, zswap_max=0, zswap_writeback=True):
+        """Evicts up to nbytes of the oldest memory, returns how much was evicted."""
+        p = self.params
+        nodes = list(range(p.nodes)) if nodes is None else nodes
+        resident = self.resident[nodes]
+        # Bytes older than each bin, oldest first.
+        by_age = resident.sum(axis=(0, 1))[::-1].cumsum()
+        cut = int(np.searchsorted(by_age, nbytes))
+        if cut >= self.bins:
+            evicted = resident.copy()
+        else:
+            # Bins older than the cut go entirely, the cut bin partially.
+            older = by_age[cut - 1] if cut > 0 else 0.0
+            in_cut = by_age[cut] - older
+            fraction = (nbytes - older) / in_cut if in_cut > 0 else 0.0
+            evicted = np.zeros_like(resident)
+            first = self.bins - cut
+            evicted[:, :, first:] = resident[:, :, first:]
+            evicted[:, :, first - 1] = resident[:, :, first - 1] * fraction
+
+        # Room left in zswap, in uncompressed anon bytes.
+        total = float(evicted.sum())
+        anon = total * p.anon_fraction
+        room = max(0.0, (zswap_max - self.zswap_current()) * p.zswap_compression_ratio)
+        to_zswap = min(1.0, room / anon) if anon else 1.0
+        if to_zswap < 1 and not zswap_writeback:
+            # Past memory.zswap.max, anon memory can't go anywhere.
+            scale = (room + total * (1 - p.anon_fraction)) / total
+            evicted *= scale
+            total *= scale
+            to_zswap = 1.0
+
+        self.resident[nodes] -= evicted
+        evicted = evicted.sum(axis=2)
+        self.swapped[nodes, :, ZSWAP] += evicted * to_zswap
+        self.swapped[nodes, :, SSD] += evicted * (1 - to_zswap)
+        self.swapout += np.array([to_zswap, 1 - to_zswap]) * total * p.anon_fraction
+        return total
+
+    def enforce_high(self, high, zswap_max, zswap_writeback):
+        lowered, self.high = high < self.high, high
+        excess = self.current() - high
+        if excess <= 0:
+            return
+        if not lowered:
+            self.high_events += int(excess // (HIGH_BATCH_PAGES * PAGE_SIZE)) + 1
+        self.reclaim(excess, zswap_max=zswap_max, zswap_writeback=zswap_writeback)
+
+    def page_age(self, intervals_ms):
+        """Returns the memory.workingset.page_age report for the given bucket edges."""
+        anon, file = self.params.anon_fraction, 1 - self.params.anon_fraction
+        edges = [int(ms) for ms in intervals_ms] + [U64_MAX]
+        ages_ms = np.arange(self.bins) * self.tick * 1000
+        # Index of the bucket of every age bin.
+        bucket = np.searchsorted(np.array(edges[:-1], dtype=np.float64), ages_ms, side="right")
+        lines = []
+        for nid in range(self.params.nodes):
+            by_bucket = np.bincount(
+                bucket, weights=self.resident[nid].sum(axis=0), minlength=len(edges)
+            )
+            lines.append(f"N{nid}")
+            for edge, nbytes in zip(edges, by_bucket.tolist()):
+                lines.append(f"{edge} anon={int(nbytes * anon)} file={int(nbytes * file)}")
+        return "\n".join(lines) + "\n"
+
+    def files(self, intervals_ms):
+        p = self.params
+        per_node = self.resident.sum(axis=(1, 2))
+        anon = per_node * p.anon_fraction
+        file = per_node * (1 - p.anon_fraction)
+        return {
+            "memory.current": f"{int(self.current())}\n",
+            "memory.swap.current": f"{int(self.swap_current())}\n",
+            "memory.zswap.current": f"{int(self.zswap_current())}\n",
+            "memory.peak": f"{int(self.peak)}\n",
+            "memory.stat": (
+                f"anon {int(anon.sum())}\n"
+                f"file {int(file.sum())}\n"
+                f"zswap {int(self.zswap_current())}\n"
+                f"zswapped {int(self.zswapped())}\n"
+                f"pswpin {int(self.swapin[SSD] / PAGE_SIZE)}\n"
+                f"pswpout {int(self.swapout[SSD] / PAGE_SIZE)}\n"
+                f"zswpin {int(self.swapin[ZSWAP] / PAGE_SIZE)}\n"
+                f"zswpout {int(self.swapout[ZSWAP] / PAGE_SIZE)}\n"
+                f"workingset_refault_anon {int(self.refault * p.anon_fraction / PAGE_SIZE)}\n"
+                f"workingset_refault_file {int(self.refault * (1 - p.anon_fraction) / PAGE_SIZE)}\n"
+            ),
+            "memory.numa_stat": (
+                "anon " + " ".join(f"N{n}={int(v)}" for n, v in enumerate(anon)) + "\n"
+                "file " + " ".join(f"N{n}={int(v)}" for n, v in enumerate(file)) + "\n"
+            ),
+            "memory.pressure": (
+                f"some avg10={self.avg[10]:.2f} avg60={self.avg[60]:.2f} avg300={self.avg[300]:.2f} total={int(self.some_total_us)}\n"
+                f"full avg10={self.avg[10] * p.full_stall_fraction:.2f} avg60={self.avg[60] * p.full_stall_fraction:.2f} avg300={self.avg[300] * p.full_stall_fraction:.2f} total={int(self.full_total_us)}\n"
+            ),
+            "memory.workingset.page_age": self.page_age(intervals_ms),
+            "memory.events": f"low 0\nhigh {self.high_events}\nmax 0\noom 0\noom_kill 0\n",
+            "cgroup.events": "populated 1\nfrozen 0\n",
+        }
+
+
+def write_in_place(path, content):
+    # Rewrite the same inode, open descriptors of the probes keep seeing it.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        data = content.encode()
+        os.pwrite(fd, data, 0)
+        os.ftruncate(fd, len(data))
+    finally:
+        os.close(fd)
+
+
+class Emulator:
+    """Serves the models of a set of cgroups under a root directory."""
+
+    def __init__(self, root, cgroups, params):
+        self.root = root
+        self.params = params
+        self.clock = 0.0
+        self.next_step = params.tick_seconds
+        self.models = {}
+        self.reclaim_fds = {}
+        self.pending = {}
+
+        for cgroup in cgroups:
+            path = os.path.join(root, os.path.relpath(cgroup, "/"))
+            os.makedirs(path, exist_ok=True)
+            for name, content in [
+                ("cgroup.procs", ""),
+                ("memory.workingset.refresh_interval", ""),
+                ("memory.high", "max\n"),
+                ("memory.max", "max\n"),
+                ("memory.zswap.max", "max\n"),
+                ("memory.zswap.writeback", "1\n"),
+            ]:
+                if not os.path.exists(os.path.join(path, name)):
+                    write_in_place(os.path.join(path, name), content)
+
+            # memory.reclaim is a FIFO, every request written to it is applied
+            # to the model.
+            fifo = os.path.join(path, "memory.reclaim")
+            if not os.path.exists(fifo):
+                os.mkfifo(fifo)
+            self.reclaim_fds[os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)] = path
+            self.models[path] = MemoryModel(params)
+
+        for nid in range(params.nodes):
+            report = os.path.join(
+                root, f"sys/devices/system/node/node{nid}/workingset_report"
+            )
+            os.makedirs(report, exist_ok=True)
+            if not os.path.exists(os.path.join(report, "page_age_intervals")):
+                write_in_place(
+                    os.path.join(report, "page_age_intervals"), params.page_age_intervals
+                )
+            if not os.path.exists(os.path.join(report, "refresh_interval")):
+                write_in_place(os.path.join(report, "refresh_interval"), "0")
+
+        self.sync()
+
+    def page_age_intervals(self):
+        # Nodes share the intervals of node 0, as configured by monitoring.py.
+        path = os.path.join(
+            self.root, "sys/devices/system/node/node0/workingset_report/page_age_intervals"
+        )
+        with open(path, "r") as f:
+            return [int(v) for v in f.read().replace(",", " ").split()]
+
+    def poll_writes(self):
+        """Applies the requests written to memory.reclaim since the last poll."""
+        for fd, path in self.reclaim_fds.items():
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                continue
+            if not data:
+                continue
+            lines = (self.pending.pop(fd, b"") + data).split(b"\n")
+            self.pending[fd] = lines.pop()
+            for line in lines:
+                self.reclaim(path, line.decode())
+
+    def reclaim(self, path, request):
+        nbytes, *args = request.split()
+        nodes = None
+        for arg in args:
+            key, value = arg.split("=")
+            if key == "nodes":
+                nodes = [int(n) for n in value.split(",")]
+        evicted = self.models[path].reclaim(int(nbytes), nodes, *self.zswap_settings(path))
+        if _FLAGS.verbose:
+            log(f"[{path}] Reclaimed {evicted / (1 << 20):.2f} MiB of {int(nbytes) / (1 << 20):.2f} MiB requested.")
+
+    def zswap_settings(self, path):
+        """Returns (memory.zswap.max, memory.zswap.writeback) of a cgroup."""
+        if not self.params.zswap:
+            return 0, True
+        with open(os.path.join(path, "memory.zswap.max"), "r") as f:
+            value = f.read().strip()
+        zswap_max = math.inf if value == "max" else int(value)
+        with open(os.path.join(path, "memory.zswap.writeback"), "r") as f:
+            zswap_writeback = f.read().strip() != "0"
+        return zswap_max, zswap_writeback
+
+    def high(self, path):
+        with open(os.path.join(path, "memory.high"), "r") as f:
+            value = f.read().strip()
+        return math.inf if value == "max" else int(value)
+
+    def advance(self, seconds):
+        """Moves the clock forward, stepping the models at every tick on the way."""
+        self.clock += seconds
+        stepped = False
+        while self.next_step <= self.clock + 1e-9:
+            for path, model in self.models.items():
+                model.step()
+                model.enforce_high(self.high(path), *self.zswap_settings(path))
+            self.next_step += self.params.tick_seconds
+            stepped = True
+        if stepped:
+            self.sync()
+
+    def sync(self):
+        intervals = self.page_age_intervals()
+        for path, model in self.models.items():
+            for name, content in model.files(intervals).items():
+                write_in_place(os.path.join(path, name), content)
+
+    def report(self):
+        for path, model in self.models.items():
+            log(
+                f"[{path}] After {self.clock:.1f} s: memory.current = {model.current() / (1 << 20):.2f} MiB,"
+                f" peak = {model.peak / (1 << 20):.2f} MiB, memory.swap.current = {model.swap_current() / (1 << 20):.2f} MiB"
+                f" ({model.zswapped() / (1 << 20):.2f} MiB in zswap),"
+                f" swapped out {model.swapout.sum() / (1 << 20):.2f} MiB ({model.swapout[ZSWAP] / (1 << 20):.2f} MiB to zswap),"
+                f" swapped in {model.swapin.sum() / (1 << 20):.2f} MiB ({model.swapin[ZSWAP] / (1 << 20):.2f} MiB from zswap),"
+                f" stalled {model.some_total_us / 1e6:.2f} s."
+            )
+
+
+class SimulationDone(Exception):
+    pass
+
+
+class _VirtualSelector:
+    """Jumps the virtual clock forward instead of sleeping until the next timer."""
+
+    def __init__(self, selector, loop):
+        self.selector = selector
+        self.loop = loop
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+    def select(self, timeout=None):
+        events = self.selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            raise SimulationDone("nothing left to wait for")
+        self.loop.advance(timeout)
+        return self.selector.select(0)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop running on the emulator's clock.
+
+    Blocking calls handed to the executor run inline, the emulator then picks
+    up whatever they wrote, so the whole run is deterministic.
+    """
+
+    def __init__(self, emulator, duration):
+        super().__init__()
+        self._selector = _VirtualSelector(self._selector, self)
+        self.emulator = emulator
+        self.duration = duration
+        self.emulator_cpu = 0.0
+
+    def time(self):
+        return self.emulator.clock
+
+    def advance(self, seconds):
+        if self.emulator.clock + seconds > self.duration:
+            raise SimulationDone(f"simulated {self.duration} s")
+        t0 = time.process_time()
+        self.emulator.advance(seconds)
+        self.emulator_cpu += time.process_time() - t0
+
+    def run_in_executor(self, executor, func, *args):
+        future = self.create_future()
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        t0 = time.process_time()
+        self.emulator.poll_writes()
+        self.emulator.sync()
+        self.emulator_cpu += time.process_time() - t0
+        return future
+
+    async def shutdown_default_executor(self, *args):
+        # Nothing ever ran on the executor.
+        pass
+
+
+def run_agent(emulator):
+    loop = VirtualTimeLoop(emulator, _FLAGS.duration_seconds)
+    cgroupfs.monotonic = loop.time
+
+    class VirtualTimePolicy(asyncio.DefaultEventLoopPolicy):
+        def new_event_loop(self):
+            return loop
+
+    asyncio.set_event_loop_policy(VirtualTimePolicy())
+    agent = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.py")
+    sys.argv = [agent, f"--fs_root={emulator.root}"] + _FLAGS.agent_args
+    # The agent jitters its schedule, seed it so that runs can be compared.
+    random.seed(_FLAGS.seed)
+    t0, cpu0 = time.monotonic(), time.process_time()
+    try:
+        runpy.run_path(agent, run_name="__main__")
+    except SimulationDone as e:
+        log(f"Simulation done: {e}.")
+
+    wall, cpu = time.monotonic() - t0, time.process_time() - cpu0
+    emulator.report()
+    agent_cpu = cpu - loop.emulator_cpu
+    log(
+        f"Simulated {emulator.clock:.1f} s in {wall:.2f} s. Agent CPU time = {agent_cpu:.3f} s"
+        f" ({agent_cpu / max(emulator.clock, 1e-9) * 3600:.2f} s per simulated hour), emulator CPU time = {loop.emulator_cpu:.3f} s."
+    )
+
+
+def serve(emulator):
+    log(f"Serving {len(emulator.models)} cgroups under '{emulator.root}' at {_FLAGS.speedup}x.")
+    period = emulator.params.tick_seconds / _FLAGS.speedup
+    next_tick = time.monotonic()
+    try:
+        while True:
+            # Apply reclaim requests as they come in between ticks.
+            timeout = max(0, next_tick - time.monotonic())
+            ready, _, _ = select.select(list(emulator.reclaim_fds), [], [], timeout)
+            emulator.poll_writes()
+            if ready:
+                emulator.sync()
+            if time.monotonic() >= next_tick:
+                emulator.advance(emulator.params.tick_seconds)
+                next_tick += period
+    except KeyboardInterrupt:
+        emulator.report()
+
+
+def own_cgroup():
+    with open(os.path.join("/proc", str(os.getpid()), "cgroup"), "r") as f:
+        return "/sys/fs/cgroup" + f.read().split("::")[1].strip()
+
+
+def splash():
+    cgroups = _FLAGS.cgroups.split(",") if _FLAGS.cgroups else [own_cgroup()]
+    emulator = Emulator(os.path.abspath(_FLAGS.root), cgroups, _FLAGS)
+    if _FLAGS.mode == "serve":
+        serve(emulator)
+    else:
+        run_agent(emulator)
+
+
+def parse_cmdline_flags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "mode",
+        type=str,
+        choices=["serve", "agent"],
+        help="'serve' the emulated files in real time, or run agent.py against them on a virtual clock",
+    )
+    parser.add_argument("root", type=str, help="Directory of the emulated files")
+    parser.add_argument(
+        "--cgroups",
+        type=str,
+        help="Cgroups to emulate, separated by commas. Defaults to the cgroup of this process",
+    )
+    parser.add_argument("--nodes", type=int, default=1, help="Number of numa nodes")
+    parser.add_argument(
+        "--page_age_intervals",
+        type=str,
+        default="1000,2000,3000,4000,5000,6000,7000,8000,9000,10000,11000,12000,13000,14000,15000",
+        help="Initial page age intervals of every node in milliseconds",
+    )
+    parser.add_argument(
+        "--tick_seconds", type=float, default=0.1, help="Time step of the model"
+    )
+    parser.add_argument(
+        "--max_age_seconds",
+        type=float,
+        default=600,
+        help="Age past which the model stops telling memory apart",
+    )
+    parser.add_argument(
+        "--footprint_bytes",
+        type=int,
+        default=4 << 30,
+        help="Amount of memory the workload allocates",
+    )
+    parser.add_argument(
+        "--alloc_rate_bytes",
+        type=int,
+        default=256 << 20,
+        help="Bytes allocated per second until the footprint is reached",
+    )
+    parser.add_argument(
+        "--hot_fraction", type=float, default=0.3, help="Fraction of hot memory"
+    )
+    parser.add_argument(
+        "--hot_interval_seconds",
+        type=float,
+        default=5,
+        help="Interval at which hot memory is touched again",
+    )
+    parser.add_argument(
+        "--cold_access_rate",
+        type=float,
+        default=0.001,
+        help="Fraction of the cold memory touched per second",
+    )
+    parser.add_argument(
+        "--anon_fraction",
+        type=float,
+        default=0.7,
+        help="Fraction of anonymous memory, the rest is page cache",
+    )
+    parser.add_argument(
+        "--swapin_latency_us",
+        type=float,
+        default=100,
+        help="Stall caused by refaulting a page from the SSD",
+    )
+    parser.add_argument(
+        "--zswap",
+        action="store_true",
+        help="Reclaim into zswap within memory.zswap.max before the SSD",
+    )
+    parser.add_argument(
+        "--zswap_compression_ratio",
+        type=float,
+        default=3,
+        help="Uncompressed over compressed size of memory in zswap",
+    )
+    parser.add_argument(
+        "--zswap_latency_us",
+        type=float,
+        default=5,
+        help="Stall caused by refaulting a page from zswap",
+    )
+    parser.add_argument(
+        "--full_stall_fraction",
+        type=float,
+        default=0.5,
+        help="Fraction of the stall time during which all tasks are stalled (PSI full)",
+    )
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        default=1,
+        help="How much faster than real time the model runs in 'serve' mode",
+    )
+    parser.add_argument(
+        "--duration_seconds",
+        type=float,
+        default=3600,
+        help="Simulated duration in 'agent' mode",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the agent's schedule jitter"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Log every reclaim request"
+    )
+    # Everything after '--' is passed on to agent.py in 'agent' mode.
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    flags = parser.parse_args(argv[:split])
+    flags.agent_args = argv[split + 1 :]
+    return flags
+
+
+if __name__ == "__main__":
+    _FLAGS = parse_cmdline_flags()
+    splash()
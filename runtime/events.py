@@ -0,0 +1,110 @@
+"""Epoll based wakeups on PSI triggers, cgroup.events changes and process exits"""
+
+import os
+import select
+
+
+def parse_cgroup_events(buf):
+    """Returns {key: value} from the content of cgroup.events."""
+    return {
+        key.decode(): int(value)
+        for key, value in (line.split() for line in bytes(buf).splitlines())
+    }
+
+
+class EventWatcher:
+    """Dispatches events of many file descriptors from a single epoll set.
+
+    The epoll fd itself becomes readable whenever one of the watched fds has
+    an event, so it can be handed to an asyncio loop with add_reader(), or
+    waited on directly with dispatch(timeout).
+    """
+
+    def __init__(self):
+        self.epoll = select.epoll()
+        self.callbacks = {}
+        self.muted = set()
+
+    def fileno(self):
+        return self.epoll.fileno()
+
+    def watch(self, fd, events, callback):
+        """Takes ownership of fd, which is closed if it can't be polled."""
+        try:
+            self.epoll.register(fd, events)
+        except OSError:
+            os.close(fd)
+            raise
+        self.callbacks[fd] = callback
+
+    def mute(self, fd):
+        """Stops polling fd but keeps it open until unwatch(), so its number isn't reused."""
+        if fd in self.callbacks and fd not in self.muted:
+            self.muted.add(fd)
+            self.epoll.unregister(fd)
+
+    def unwatch(self, fd):
+        if self.callbacks.pop(fd, None) is None:
+            return
+        if fd in self.muted:
+            self.muted.discard(fd)
+        else:
+            self.epoll.unregister(fd)
+        os.close(fd)
+
+    def dispatch(self, timeout=0):
+        for fd, events in self.epoll.poll(timeout):
+            callback = self.callbacks.get(fd)
+            if callback is not None:
+                callback(fd, events)
+
+    def close(self):
+        for fd in list(self.callbacks):
+            self.unwatch(fd)
+        self.epoll.close()
+
+    def watch_psi_trigger(self, path, trigger, callback):
+        """Arms a PSI trigger such as "some 150000 1000000" on a pressure file."""
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+
+        def on_event(fd, events):
+            # EPOLLERR is only raised once the trigger is gone with its cgroup.
+            if events & select.EPOLLERR:
+                self.mute(fd)
+            else:
+                callback()
+
+        self.watch(fd, select.EPOLLPRI, on_event)
+        try:
+            os.write(fd, trigger.encode() + b"\0")
+        except OSError:
+            self.unwatch(fd)
+            raise
+        return fd
+
+    def watch_cgroup_events(self, path, callback):
+        """Calls callback with the content of cgroup.events now and after every change."""
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+
+        def on_event(fd, events):
+            # Reading the file also acknowledges the notification.
+            try:
+                buf = os.pread(fd, 4096, 0)
+            except OSError:
+                self.mute(fd)
+                return
+            callback(parse_cgroup_events(buf))
+
+        self.watch(fd, select.EPOLLPRI, on_event)
+        on_event(fd, 0)
+        return fd
+
+    def watch_process_exit(self, pid, callback):
+        fd = os.pidfd_open(pid)
+
+        def on_event(fd, events):
+            self.mute(fd)
+            callback()
+
+        self.watch(fd, select.EPOLLIN, on_event)
+        return fd
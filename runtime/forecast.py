@@ -0,0 +1,128 @@
+"""Forecast of the cold and hot memory of a cgroup from its page age history"""
+
+import numpy as np
+
+from page_age import edge_index
+
+
+class WorkingSetForecaster:
+    """Forecasts the cold and hot memory of every node at the next cycle.
+
+    Pages age with the clock until they're touched again, so the only pages
+    that can turn cold by the next cycle are the ones less than a period
+    younger than the threshold: the band. The fraction of the band that does
+    turn cold, i.e. isn't touched again meanwhile, is an EWMA over the past
+    cycles, corrected for what the agent reclaimed in between. The demand
+    of each node, its memory plus everything reclaimed from it so far,
+    follows a least squares linear trend over the last `window` cycles, held
+    in fixed size arrays. A change of nodes starts the history over.
+    """
+
+    __slots__ = (
+        "window",
+        "alpha",
+        "times",
+        "demand",
+        "reclaimed_total",
+        "count",
+        "nids",
+        "survival",
+        "last",
+        "reclaimed",
+    )
+
+    def __init__(self, window, alpha=0.5):
+        self.window = window
+        self.alpha = alpha
+        self.times = np.zeros(window)
+        # (window, nodes) bytes.
+        self.demand = None
+        self.reclaimed_total = None
+        self.count = 0
+        self.nids = None
+        # Fraction of the band of every node that turned cold.
+        self.survival = None
+        # (time, horizon, thresholds, band, cold) of the last update.
+        self.last = None
+        # Bytes reclaimed from every node since the last update.
+        self.reclaimed = None
+
+    def on_reclaimed(self, nid, nbytes):
+        """Counts bytes reclaimed from a node, "*" when reclaimed without picking one."""
+        if self.nids is None:
+            return
+        if nid == "*":
+            # Spread over the nodes like the last cold memory.
+            cold = self.last[4] if self.last is not None else np.ones(len(self.nids))
+            self.reclaimed += (nbytes * cold / max(1, cold.sum())).astype(np.int64)
+        elif nid in self.nids:
+            self.reclaimed[self.nids.index(nid)] += nbytes
+
+    def update(self, t, hist, thresholds, horizon):
+        """Records the histogram at time t, to forecast horizon seconds later at the given thresholds per node."""
+        if self.demand is None or hist.nids != self.nids:
+            nodes = len(hist.nids)
+            self.demand = np.zeros((self.window, nodes), dtype=np.int64)
+            self.reclaimed_total = np.zeros(nodes, dtype=np.int64)
+            self.count = 0
+            self.nids = list(hist.nids)
+            self.survival = np.ones(nodes)
+            self.last = None
+            self.reclaimed = np.zeros(nodes, dtype=np.int64)
+
+        if self.last is not None:
+            # What turned cold since the last update: the cold memory now,
+            # less what was already cold then, plus what was reclaimed in
+            # between, band pages reclaimed ahead included. Only refaults of
+            # reclaimed memory can make it negative.
+            last_t, last_horizon, last_thresholds, last_band, last_cold = self.last
+            cold = self._colder_than(hist, last_thresholds)
+            turned_cold = np.maximum(0, cold - last_cold + self.reclaimed)
+            # The band was sized for the horizon, the cycle may have been
+            # longer or shorter.
+            expected = last_band * min(1.0, (t - last_t) / last_horizon)
+            observed = np.clip(turned_cold / np.maximum(1, expected), 0, 1)
+            valid = expected > 0
+            self.survival[valid] += self.alpha * (observed[valid] - self.survival[valid])
+
+        self.reclaimed_total += self.reclaimed
+        i = self.count % self.window
+        self.times[i] = t
+        self.demand[i] = hist.pages.sum(axis=(1, 2)) + self.reclaimed_total
+        self.count += 1
+        cold = self._colder_than(hist, thresholds)
+        # Cold memory starts at the lower edge of the bucket holding the
+        # threshold, the band ends there.
+        edges = hist.edges.tolist()
+        starts = [
+            edges[i - 1] if i > 0 else 0 for i in edge_index(hist.edges, thresholds)
+        ]
+        band = self._colder_than(hist, [max(0, s - horizon * 1000) for s in starts]) - cold
+        self.last = (t, horizon, list(thresholds), band, cold)
+        self.reclaimed[:] = 0
+
+    @staticmethod
+    def _colder_than(hist, thresholds):
+        return np.array(
+            [int(hist.colder_than(th)[n].sum()) for n, th in enumerate(thresholds)], dtype=np.int64
+        )
+
+    def predict(self):
+        """Returns the bytes (turning cold, demand growth) of every node by the horizon of the last update.
+
+        None without enough history for a trend.
+        """
+        n = min(self.count, self.window)
+        if n < 3:
+            return None
+        t, horizon, _, band, _ = self.last
+        times = self.times[:n]
+        demand = self.demand[:n].astype(np.float64)
+        dt = times - times.mean()
+        var = float(dt @ dt)
+        slope = dt @ (demand - demand.mean(axis=0)) / var if var > 0 else np.zeros(len(self.nids))
+        growth = slope * horizon
+        turning_cold = self.survival * band
+        return {
+            nid: (int(turning_cold[i]), int(growth[i])) for i, nid in enumerate(self.nids)
+        }
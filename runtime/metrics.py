@@ -0,0 +1,176 @@
+"""Low overhead instrumentation of the agent, exported in the Prometheus text format"""
+
+import asyncio
+import bisect
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency buckets, from 10 us to 10 s.
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+class Histogram:
+    """Cumulative bucket counts, safe to update from the executor threads."""
+
+    __slots__ = ("bounds", "counts", "sum", "count", "lock")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # The last count is for values above every bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+
+class Timer:
+    """Context manager observing its own duration into a histogram."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    labels = labels + extra
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Metrics:
+    """Counters, gauges and histograms keyed by name and labels."""
+
+    def __init__(self):
+        self.types = {}
+        self.help = {}
+        self.values = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name, type, help):
+        self.types[name] = type
+        self.help[name] = help
+
+    def histogram(self, name, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            return h
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.values[key] = value
+
+    def forget(self, **labels):
+        """Drops the series carrying all the given labels, e.g. of a deleted cgroup."""
+        match = set(labels.items())
+        with self.lock:
+            for series in (self.values, self.histograms):
+                for key in [k for k in series if match <= set(k[1])]:
+                    del series[key]
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described and name in self.types:
+                described.add(name)
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.types[name]}")
+
+        for (name, labels), value in values:
+            header(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), h in histograms:
+            header(name)
+            with h.lock:
+                counts, total, count = list(h.counts), h.sum, h.count
+            cumulative = 0
+            for bound, n in zip(h.bounds + ("+Inf",), counts):
+                cumulative += n
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """Atomically replaces path, e.g. for node_exporter's textfile collector."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    async def handle(self, reader, writer):
+        try:
+            # The request doesn't matter, every path gets the metrics.
+            while (await reader.readline()).strip():
+                pass
+            body = self.render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, address):
+        """Serves the metrics over HTTP on "host:port" or "unix:/path/to/socket"."""
+        if address.startswith("unix:"):
+            path = address[len("unix:") :]
+            if os.path.exists(path):
+                os.unlink(path)
+            return await asyncio.start_unix_server(self.handle, path)
+        host, port = address.rsplit(":", 1)
+        return await asyncio.start_server(self.handle, host, int(port))
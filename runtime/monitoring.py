@@ -3,15 +3,34 @@
 """Monitor various cgroup metrics"""
 
 import os
+import array
 import datetime
+import glob
+import math
 import multiprocessing
+import random
+import signal
 import subprocess
+import sys
 import time
 import argparse
 import re
 import dataclasses
 import typing
 import inspect
+import functools
+import itertools
+import json
+import zlib
+
+import cgroupfs
+from cgroupfs import CgroupProbe, fs_path
+from events import EventWatcher
+from page_age import page_age_change, parse_page_age
+from ring import RingWriter, ring_path
+from samples import SampleStore
+from subtree import SubtreeWalker
+from tracefile import TraceWriter
 
 
 def now():
@@ -39,29 +58,115 @@ def write(path, value, append=False):
         return 0
 
 
-def cg_read(path):
-    return read(os.path.join(_FLAGS.cgroup, path))
-
-
-def cg_write(path, value, append=False):
-    return write(os.path.join(_FLAGS.cgroup, path), value, append=append)
-
-
-def cg_procs():
-    procs = cg_read("cgroup.procs")
-    if procs is None:
-        return []
-    return list(map(int, list(filter(None, procs.split("\n")))))
-
-
 def parse_cmdline_flags():
     parser = argparse.ArgumentParser()
-    parser.add_argument("command", type=str, help="Command to start the workload")
+    parser.add_argument(
+        "command",
+        type=str,
+        nargs="?",
+        help="Command to start the workload. Optional when monitoring a fleet of cgroups, which then stops with the command",
+    )
     parser.add_argument("--output", type=str, help="Path to the output file")
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        choices=["csv", "trace"],
+        default="csv",
+        help="Write samples as CSV, or as compressed binary traces that tracefile.py reads and converts back to CSV",
+    )
+    parser.add_argument(
+        "--cgroup_glob",
+        type=str,
+        action="append",
+        default=[],
+        help="Monitor the cgroups matching this glob instead of the monitor's own, each into its own file in --output_dir. Can be repeated",
+    )
+    parser.add_argument(
+        "--parent_cgroup",
+        type=str,
+        action="append",
+        default=[],
+        help="Monitor the children of this cgroup instead of the monitor's own, each into its own file in --output_dir. Can be repeated",
+    )
+    parser.add_argument(
+        "--publish_dir",
+        type=str,
+        help="Directory, e.g. under /dev/shm, of the shared memory rings the latest page age histogram of every"
+        " cgroup is published into, for the agent's --shared_samples_dir",
+    )
+    parser.add_argument(
+        "--subtree",
+        type=str,
+        action="append",
+        default=[],
+        help="Walk this cgroup hierarchy on every tick and aggregate the memory of its leaves upward, into its own file in --output_dir. Can be repeated",
+    )
+    parser.add_argument(
+        "--subtree_cold_age_threshold_ms",
+        type=float,
+        default=10000,
+        help="Age above which memory counts as cold when ranking the leaves of a subtree",
+    )
+    parser.add_argument(
+        "--subtree_top",
+        type=int,
+        default=5,
+        help="Number of coldest leaves reported for every inner cgroup of a subtree",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        help="Directory of the output files when monitoring a fleet of cgroups",
+    )
+    parser.add_argument(
+        "--probe_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes sharing the fleet of cgroups to probe",
+    )
+    parser.add_argument(
+        "--discovery_freq_seconds",
+        type=float,
+        default=10,
+        help="Frequency of looking for new or removed cgroups in the fleet",
+    )
+    parser.add_argument(
+        "--fs_root",
+        type=str,
+        default="/",
+        help="Directory under which cgroupfs and sysfs are looked up, e.g. the tree served by emulator.py",
+    )
     parser.add_argument(
         "--probing_freq_seconds",
         type=float,
-        help="Frequency of probing cgroup statistics",
+        help="Frequency of probing cgroup statistics, the fastest one with --max_probing_freq_seconds",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default="memory.stat,memory.swap.current,memory.workingset.page_age,memory.current",
+        help="Comma separated cgroup files to probe, among "
+        "memory.current, memory.swap.current, memory.zswap.current, memory.stat, memory.numa_stat,"
+        " memory.pressure, io.stat and memory.workingset.page_age",
+    )
+    parser.add_argument(
+        "--metric_freq_seconds",
+        type=str,
+        default="",
+        help="Comma separated periods of the metrics probed less often than every tick, e.g. memory.stat=5,io.stat=10",
+    )
+    parser.add_argument(
+        "--max_probing_freq_seconds",
+        type=float,
+        help="Adapt the probing frequency of every cgroup between --probing_freq_seconds, while its memory changes,"
+        " and this, while it's stable",
+    )
+    parser.add_argument(
+        "--probing_change_threshold",
+        type=float,
+        default=0.02,
+        help="Fraction of a cgroup's memory that has to change, in memory.current, memory.swap.current"
+        " or between page age buckets, to probe it faster",
     )
     parser.add_argument(
         "--cgroup_refresh_interval",
@@ -85,22 +190,119 @@ def parse_cmdline_flags():
         "e.g. 0,1000;1,2000",
     )
     parser.add_argument("--configure_node_workingset_information", action="store_true")
+    parser.add_argument(
+        "--flush_freq_seconds",
+        type=float,
+        default=5,
+        help="Frequency of flushing the probed statistics to the output file",
+    )
 
-    return parser.parse_args()
+    flags = parser.parse_args()
+    flags.fleet = bool(flags.cgroup_glob or flags.parent_cgroup or flags.subtree)
+    if flags.fleet and not flags.output_dir:
+        parser.error("--output_dir is required with --cgroup_glob, --parent_cgroup or --subtree")
+    flags.metrics = flags.metrics.split(",")
+    unknown = [m for m in flags.metrics if m not in METRIC_PARSERS]
+    if unknown:
+        parser.error(f"unknown metrics {', '.join(unknown)}")
+    try:
+        flags.metric_freq_seconds = {
+            name: float(seconds)
+            for name, seconds in (
+                item.split("=", 1) for item in flags.metric_freq_seconds.split(",") if item
+            )
+        }
+    except ValueError:
+        parser.error("--metric_freq_seconds takes comma separated metric=seconds items")
+    if flags.max_probing_freq_seconds is not None and (
+        flags.max_probing_freq_seconds < flags.probing_freq_seconds
+    ):
+        parser.error("--max_probing_freq_seconds is below --probing_freq_seconds")
+    if not flags.fleet and not flags.command:
+        parser.error("the workload command is required when monitoring the monitor's own cgroup")
+    return flags
 
 
 class KeyValueStream:
-    def __init__(self):
-        self.stream = {}
+    """Streams samples to a CSV file, flushing them every few seconds.
+
+    Labels showing up for the first time mid-run become new trailing columns.
+    The rows already on disk are then rewritten with an empty value for them.
+    """
+
+    def __init__(self, path, flush_freq_seconds):
+        self.path = path
+        self.flush_freq_seconds = flush_freq_seconds
+        self.store = SampleStore()
+        self.columns_on_disk = 0
+        self.last_flush = time.monotonic()
+        self.f = open(path, "w")
 
     def push(self, label, value):
-        self.stream.setdefault(label, []).append(str(value).strip())
+        # Failed reads are left out of the sample and end up as empty values.
+        if value is not None:
+            self.store.push(label, value)
+
+    def end_sample(self):
+        self.store.end_sample()
+        if time.monotonic() - self.last_flush >= self.flush_freq_seconds:
+            self.flush()
+
+    def _rewrite_with_new_labels(self):
+        header = ",".join(self.store.columns.keys())
+        padding = "," * (len(self.store.columns) - self.columns_on_disk)
+        tmp_path = f"{self.path}.tmp"
+
+        self.f.close()
+        with open(self.path, "r") as old, open(tmp_path, "w") as new:
+            new.write(header + "\n")
+            next(old, None)
+            for line in old:
+                new.write(line.rstrip("\n") + padding + "\n")
+        os.replace(tmp_path, self.path)
 
-    def to_csv(self):
-        header = ",".join(self.stream.keys())
-        values = list(zip(*self.stream.values()))
-        values = list(map(lambda x: ",".join(x), values))
-        return header + "\n" + "\n".join(values)
+        self.f = open(self.path, "a")
+        self.columns_on_disk = len(self.store.columns)
+
+    def flush(self):
+        if len(self.store.columns) != self.columns_on_disk:
+            self._rewrite_with_new_labels()
+
+        self.store.write_csv(self.f)
+        self.f.flush()
+
+        self.store.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+class TraceStream(KeyValueStream):
+    """Streams samples to a binary trace, one block per flush."""
+
+    def __init__(self, path, flush_freq_seconds):
+        self.path = path
+        self.flush_freq_seconds = flush_freq_seconds
+        self.store = SampleStore()
+        self.last_flush = time.monotonic()
+        self.writer = TraceWriter(path)
+
+    def flush(self):
+        self.writer.write(self.store)
+        self.store.clear()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def open_stream(path):
+    if _FLAGS.output_format == "trace":
+        return TraceStream(path, _FLAGS.flush_freq_seconds)
+    return KeyValueStream(path, _FLAGS.flush_freq_seconds)
 
 
 def configure_node_workingset_information():
@@ -111,7 +313,9 @@ def configure_node_workingset_information():
     for page_age_intervals in _FLAGS.node_page_age_intervals.split(";"):
         nid, intervals = page_age_intervals.split(",", 1)
         write(
-            f"/sys/devices/system/node/node{nid}/workingset_report/page_age_intervals",
+            fs_path(
+                f"/sys/devices/system/node/node{nid}/workingset_report/page_age_intervals"
+            ),
             intervals,
         )
 
@@ -119,56 +323,468 @@ def configure_node_workingset_information():
     for refresh_interval in _FLAGS.node_refresh_intervals.split(";"):
         nid, interval = refresh_interval.split(",", 1)
         write(
-            f"/sys/devices/system/node/node{nid}/workingset_report/refresh_interval",
+            fs_path(
+                f"/sys/devices/system/node/node{nid}/workingset_report/refresh_interval"
+            ),
             interval,
         )
 
 
-def configure_cg_workingset_information():
+def configure_cg_workingset_information(cgroup):
+    if not _FLAGS.cgroup_refresh_interval:
+        return
     for refresh_interval in _FLAGS.cgroup_refresh_interval.split(";"):
         nid, interval = refresh_interval.split(",", 1)
-        cg_write(
-            "memory.workingset.refresh_interval", f"N{nid}={interval}\n", append=True
+        write(
+            os.path.join(cgroup, "memory.workingset.refresh_interval"),
+            f"N{nid}={interval}\n",
+            append=True,
         )
 
 
-def probe_workingset_information():
-    ret = {}
-    rr = re.compile("(\d+) anon=(\d+) file=(\d+)")
-    wss = cg_read("memory.workingset.page_age")
-    lines = list(filter(None, re.split("N(\d+)\n", wss)))
-    lines.reverse()
-
-    while lines:
-        nid = int(lines.pop())
-        page_age = lines.pop()
-        ret[nid] = []
-        for t, anon, file in rr.findall(page_age):
-            ret[nid].append((t, anon, file))
-    return ret
-
-
-def probe():
-    def push_probed_kv(label, value):
-        _KV_STREAM.push(label=label, value=value)
-
-    push_probed_kv(label="timestamp", value=int(time.time() * 1000))
-
-    for m in _METRICS:
-        if m == "memory.stat":
-            memory_stat_raw = cg_read(m)
-            for label, value in re.compile("(\w+) (\d+)").findall(memory_stat_raw):
-                push_probed_kv(label=f"memory.stat.{label}", value=value)
-        elif m == "memory.workingset.page_age":
-            wss = probe_workingset_information()
-            for nid, info in wss.items():
-                for t, anon, file in info:
-                    push_probed_kv(label=f"cold.node.{nid}.{t}ms.anon", value=anon)
-                    push_probed_kv(label=f"cold.node.{nid}.{t}ms.file", value=file)
-        elif m in ["memory.current", "memory.swap.current"]:
-            push_probed_kv(label=m, value=cg_read(m))
+@functools.lru_cache(maxsize=None)
+def page_age_labels(nid, t):
+    return f"cold.node.{nid}.{t}ms.anon", f"cold.node.{nid}.{t}ms.file"
+
+
+# Parsers of the cgroup files the monitor can probe, by file name. A parser
+# pushes the labels of the file's content and returns what the adaptive
+# schedule needs from it, if anything.
+METRIC_PARSERS = {}
+
+
+def metric_parser(*names):
+    def register(parse):
+        for name in names:
+            METRIC_PARSERS[name] = parse
+        return parse
+
+    return register
+
+
+@metric_parser("memory.current", "memory.swap.current", "memory.zswap.current")
+def parse_single_value(name, buf, push):
+    value = int(buf.tobytes())
+    push(name, value)
+    return value
+
+
+_FLAT_KEYED = re.compile(rb"(\w+) (\d+)")
+
+
+@metric_parser("memory.stat")
+def parse_flat_keyed(name, buf, push):
+    for key, value in _FLAT_KEYED.findall(buf):
+        push(f"{name}.{key.decode()}", int(value))
+
+
+# Only integers: the PSI averages are left out, their totals are exact.
+_NESTED_KEYED = re.compile(rb"(\w+)=(\d+)\b(?!\.)")
+
+
+@metric_parser("memory.numa_stat", "memory.pressure", "io.stat")
+def parse_nested_keyed(name, buf, push):
+    for line in bytes(buf).splitlines():
+        key, _, fields = line.partition(b" ")
+        key = key.decode()
+        for sub_key, value in _NESTED_KEYED.findall(fields):
+            push(f"{name}.{key}.{sub_key.decode()}", int(value))
+
+
+@metric_parser("memory.workingset.page_age")
+def parse_page_age_metric(name, buf, push):
+    hist = parse_page_age(buf)
+    if hist is None:
+        return None
+    edges = hist.edges.tolist()
+    for nid, pages in zip(hist.nids, hist.pages.tolist()):
+        for t, (anon, file) in zip(edges, pages):
+            anon_label, file_label = page_age_labels(nid, t)
+            push(anon_label, anon)
+            push(file_label, file)
+    return hist
+
+
+class AdaptiveSchedule:
+    """Picks the ticks a cgroup is sampled on.
+
+    Every tick, the cheap memory.current and memory.swap.current are compared
+    to the last sample's: when they moved by more than the threshold, the
+    cgroup is sampled right away and then on every tick. Otherwise, the
+    interval between samples doubles every sample that saw little change,
+    page age buckets included, up to the ceiling, and halves on every sample
+    that saw more.
+    """
+
+    __slots__ = ("max_interval", "threshold", "interval", "since_sample", "last", "last_hist")
+
+    def __init__(self, max_interval, threshold):
+        # In ticks.
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self.interval = 1
+        self.since_sample = 0
+        self.last = None
+        self.last_hist = None
+
+    def footprint_change(self, current, swap):
+        if self.last is None:
+            return 1
+        last_current, last_swap = self.last
+        moved = abs(current - last_current) + abs(swap - last_swap)
+        return moved / max(1, last_current + last_swap)
+
+    def due(self, current=None, swap=None):
+        """Whether to sample on this tick, given the cgroup's memory if it was read."""
+        self.since_sample += 1
+        if current is not None and swap is not None:
+            if self.footprint_change(current, swap) > self.threshold:
+                return True
+        return self.since_sample >= self.interval
+
+    def sampled(self, current, swap, hist):
+        """Updates the interval after a sample, hist is None if page age wasn't read."""
+        if self.footprint_change(current, swap) > self.threshold:
+            self.interval = 1
+        elif hist is not None and page_age_change(hist, self.last_hist) > self.threshold:
+            self.interval = max(1, self.interval // 2)
         else:
-            raise ValueError(f"Unrecognized metric '{m}'")
+            self.interval = min(self.max_interval, self.interval * 2)
+        self.since_sample = 0
+        self.last = (current, swap)
+        if hist is not None:
+            self.last_hist = hist
+
+
+def metric_period_ticks(name):
+    period = _FLAGS.metric_freq_seconds.get(name)
+    if period is None:
+        return 1
+    return max(1, round(period / _FLAGS.probing_freq_seconds))
+
+
+def adaptive_schedule():
+    if _FLAGS.max_probing_freq_seconds is None:
+        return None
+    return AdaptiveSchedule(
+        max(1, round(_FLAGS.max_probing_freq_seconds / _FLAGS.probing_freq_seconds)),
+        _FLAGS.probing_change_threshold,
+    )
+
+
+class CgroupMonitor:
+    """Samples the metrics of a cgroup into its own stream."""
+
+    def __init__(self, cgroup, output):
+        self.cgroup = cgroup
+        self.probe = CgroupProbe(cgroup)
+        self.stream = open_stream(output)
+        # Spread the flushes of cgroups discovered together over the interval.
+        self.stream.last_flush -= random.uniform(0, _FLAGS.flush_freq_seconds)
+        self.schedule = adaptive_schedule()
+        self.ticks = 0
+        self.samples = 0
+        # Every metric is read on the first sample, then on the ticks that are
+        # a multiple of its period past the cgroup's phase. Metrics of the
+        # cgroup with the same period are read together, while the phases
+        # spread the slow metrics of the fleet over the ticks.
+        self.metrics = [
+            (name, METRIC_PARSERS[name], metric_period_ticks(name)) for name in _FLAGS.metrics
+        ]
+        self.next_read = dict.fromkeys(_FLAGS.metrics, 0)
+        self.phase = random.randrange(max(period for _, _, period in self.metrics))
+        self.ring = None
+        if _FLAGS.publish_dir:
+            os.makedirs(_FLAGS.publish_dir, exist_ok=True)
+            self.ring = RingWriter(ring_path(_FLAGS.publish_dir, cgroup))
+
+    def sample(self, tick, timestamp_ms):
+        self.ticks += 1
+        footprint = {}
+        if self.schedule is not None:
+            footprint = {m: self.probe.read_int(m) for m in ("memory.current", "memory.swap.current")}
+            if not self.schedule.due(footprint["memory.current"], footprint["memory.swap.current"]):
+                return
+        self.samples += 1
+
+        push = self.stream.push
+        push("timestamp", timestamp_ms)
+        for name, value in footprint.items():
+            push(name, value)
+
+        due = []
+        for name, parse, period in self.metrics:
+            if tick >= self.next_read[name]:
+                self.next_read[name] = tick + period - (tick - self.phase) % period
+                if name not in footprint:
+                    due.append((name, parse))
+        parsed = {}
+        for name, parse in due:
+            buf = self.probe.read(name)
+            if buf is not None:
+                parsed[name] = parse(name, buf, push)
+
+        self.stream.end_sample()
+        hist = parsed.get("memory.workingset.page_age")
+        if self.ring is not None and hist is not None:
+            self.ring.publish(
+                timestamp_ms,
+                footprint.get("memory.current", parsed.get("memory.current")),
+                footprint.get("memory.swap.current", parsed.get("memory.swap.current")),
+                hist,
+            )
+        if self.schedule is not None:
+            self.schedule.sampled(
+                footprint["memory.current"] or 0,
+                footprint["memory.swap.current"] or 0,
+                hist,
+            )
+
+    def close(self):
+        if self.schedule is not None:
+            log(f"Sampled '{self.cgroup}' on {self.samples} of {self.ticks} ticks.")
+        if self.ring is not None:
+            self.ring.close()
+        self.stream.close()
+        self.probe.close()
+
+
+class SubtreeMonitor:
+    """Samples the totals of a cgroup hierarchy into its own stream.
+
+    The stream gets the same columns as a single cgroup's, for the root of
+    the hierarchy. Every flush, a JSON snapshot next to it details every inner
+    cgroup: totals, cold memory by age and coldest leaves.
+    """
+
+    def __init__(self, root, output):
+        self.root = root
+        self.walker = SubtreeWalker(
+            root, _FLAGS.subtree_cold_age_threshold_ms, _FLAGS.subtree_top
+        )
+        self.stream = open_stream(output)
+        self.snapshot_path = os.path.splitext(output)[0] + ".json"
+        self.last_snapshot = time.monotonic()
+        # Only the walk tells whether the hierarchy changed.
+        self.schedule = adaptive_schedule()
+
+    def sample(self, tick, timestamp_ms):
+        if self.schedule is not None and not self.schedule.due():
+            return
+        root = self.walker.walk()
+        if root is None:
+            return
+        if self.schedule is not None:
+            self.schedule.sampled(root.current, root.swap, root.hist)
+        push = self.stream.push
+        push("timestamp", timestamp_ms)
+        push("cgroups", root.leaves)
+        push("unaccounted_cgroups", root.unaccounted)
+        push("memory.current", root.current)
+        push("memory.swap.current", root.swap)
+        push("cold_bytes", root.cold)
+        if root.hist is not None:
+            edges = root.hist.edges.tolist()
+            for nid, pages in zip(root.hist.nids, root.hist.pages.tolist()):
+                for t, (anon, file) in zip(edges, pages):
+                    anon_label, file_label = page_age_labels(nid, t)
+                    push(anon_label, anon)
+                    push(file_label, file)
+        self.stream.end_sample()
+
+        if time.monotonic() - self.last_snapshot >= _FLAGS.flush_freq_seconds:
+            self.write_snapshot(root, timestamp_ms)
+
+    def write_snapshot(self, root, timestamp_ms):
+        cgroups = []
+        for node in root.nodes():
+            by_age = {}
+            if node.hist is not None:
+                by_age = dict(
+                    zip(map(str, node.hist.edges.tolist()), node.hist.pages.sum(axis=(0, 2)).tolist())
+                )
+            cgroups.append(
+                {
+                    "path": node.path,
+                    "cgroups": node.leaves,
+                    "unaccounted_cgroups": node.unaccounted,
+                    "memory.current": node.current,
+                    "memory.swap.current": node.swap,
+                    "cold_bytes": node.cold,
+                    "bytes_by_age_ms": by_age,
+                    "coldest": [{"path": path, "cold_bytes": cold} for cold, path in node.top],
+                }
+            )
+        tmp = f"{self.snapshot_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"timestamp": timestamp_ms, "cgroups": cgroups}, f)
+        os.replace(tmp, self.snapshot_path)
+        self.last_snapshot = time.monotonic()
+
+    def close(self):
+        self.stream.close()
+        self.walker.close()
+
+
+class TickClock:
+    """Schedule of the sampling ticks, shared by all the probe workers.
+
+    Samples are stamped with the wall clock time of the tick they were
+    scheduled for, on the monotonic clock, rather than with the time they
+    were taken at. Timestamps neither drift nor depend on how long the
+    collection took.
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.start = time.monotonic()
+        self.epoch = time.time()
+
+    def tick_time(self, tick):
+        return self.start + tick * self.period
+
+    def timestamp_ms(self, tick):
+        return int((self.epoch + tick * self.period) * 1000)
+
+    def next_tick(self, after):
+        return max(0, math.floor((after - self.start) / self.period) + 1)
+
+
+def run_ticks(clock, collect, wait, name):
+    """Calls collect(tick) on every tick until wait(timeout) returns True.
+
+    Ticks that are already over when the previous collection is done are
+    skipped rather than collected late.
+    """
+    latencies = array.array("d")
+    missed = 0
+    tick = 0
+    try:
+        while not wait(max(0, clock.tick_time(tick) - time.monotonic())):
+            collect(tick)
+            done = time.monotonic()
+            latencies.append(done - clock.tick_time(tick))
+            next_tick = clock.next_tick(done)
+            missed += next_tick - tick - 1
+            tick = next_tick
+    finally:
+        if latencies:
+            latencies = sorted(latencies)
+            log(
+                f"[{name}] {len(latencies)} ticks, {missed} missed. Collection latency p50 = {latencies[len(latencies) // 2] * 1000:.2f} ms,"
+                f" p99 = {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.2f} ms, max = {latencies[-1] * 1000:.2f} ms."
+            )
+
+
+def discover_cgroups():
+    found = set()
+    for pattern in _FLAGS.cgroup_glob:
+        found.update(glob.glob(fs_path(pattern)))
+    for parent in _FLAGS.parent_cgroup:
+        try:
+            with os.scandir(fs_path(parent)) as it:
+                found.update(e.path for e in it if e.is_dir(follow_symlinks=False))
+        except OSError as e:
+            log(f"Failed to list children of '{parent}': {e}")
+    return {cg for cg in found if os.path.exists(os.path.join(cg, "memory.current"))}
+
+
+def stream_path(cgroup, suffix=""):
+    name = os.path.relpath(cgroup, fs_path("/sys/fs/cgroup")).replace("/", ".")
+    return os.path.join(
+        _FLAGS.output_dir, f"{'root' if name == '.' else name}{suffix}.{_FLAGS.output_format}"
+    )
+
+
+def in_shard(path, shard):
+    return zlib.crc32(path.encode()) % _FLAGS.probe_workers == shard
+
+
+def probe_shard(shard, clock, stop):
+    """Probes the cgroups and subtrees of the fleet whose path hashes to shard, until stop is set."""
+    # The parent handles signals and sets stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    monitors = {}
+    # Subtrees track their own cgroups between walks.
+    subtrees = []
+    for root in map(fs_path, _FLAGS.subtree):
+        if in_shard(root, shard):
+            output = stream_path(root, ".subtree")
+            log(f"[shard {shard}] Monitoring the hierarchy under '{root}' into {output}.")
+            subtrees.append(SubtreeMonitor(root, output))
+    next_discovery = 0
+
+    def collect(tick):
+        nonlocal next_discovery
+        if tick >= next_discovery:
+            discovered = {cg for cg in discover_cgroups() if in_shard(cg, shard)}
+            for cgroup in discovered - monitors.keys():
+                log(f"[shard {shard}] Monitoring '{cgroup}' into {stream_path(cgroup)}.")
+                configure_cg_workingset_information(cgroup)
+                monitors[cgroup] = CgroupMonitor(cgroup, stream_path(cgroup))
+            for cgroup in monitors.keys() - discovered:
+                log(f"[shard {shard}] '{cgroup}' is gone, no longer monitoring it.")
+                monitors.pop(cgroup).close()
+            next_discovery = tick + max(1, round(_FLAGS.discovery_freq_seconds / clock.period))
+
+        timestamp_ms = clock.timestamp_ms(tick)
+        for monitor in itertools.chain(monitors.values(), subtrees):
+            monitor.sample(tick, timestamp_ms)
+
+    try:
+        run_ticks(clock, collect, stop.wait, f"shard {shard}")
+    finally:
+        for monitor in itertools.chain(monitors.values(), subtrees):
+            monitor.close()
+
+
+def start_fleet_monitoring():
+    os.makedirs(_FLAGS.output_dir, exist_ok=True)
+    clock = TickClock(_FLAGS.probing_freq_seconds)
+    stop = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(target=probe_shard, args=(shard, clock, stop))
+        for shard in range(_FLAGS.probe_workers)
+    ]
+    for w in workers:
+        w.start()
+
+    stopping = False
+
+    # Setting stop from the handler could deadlock on the lock of the
+    # stop.wait() it interrupted, the loop sets it instead.
+    def on_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    log(f"Monitoring the fleet with {len(workers)} workers, stop with SIGINT or SIGTERM.")
+
+    command = subprocess.Popen(_FLAGS.command, shell=True) if _FLAGS.command else None
+    failed = []
+    try:
+        while not stopping:
+            time.sleep(1)
+            # A shard that died leaves its cgroups unmonitored, stop rather
+            # than carry on with holes in the statistics.
+            failed = [shard for shard, w in enumerate(workers) if not w.is_alive()]
+            if failed:
+                log(f"Shard {', '.join(map(str, failed))} exited early, stopping.")
+                break
+            if command is not None and command.poll() is not None:
+                break
+    finally:
+        stop.set()
+        if command is not None and command.poll() is None:
+            command.terminate()
+            command.wait()
+        for w in workers:
+            w.join()
+        log(f"Statistics flushed to {_FLAGS.output_dir}.")
+    # Workers killed along with the parent by a signal to the group aren't failures.
+    return not failed and all(w.exitcode <= 0 for w in workers)
 
 
 def configure_swap():
@@ -180,22 +796,43 @@ def configure_swap():
 def start_monitoring():
     if _FLAGS.configure_node_workingset_information:
         configure_node_workingset_information()
-    configure_cg_workingset_information()
-    configure_swap()
+    configure_cg_workingset_information(_FLAGS.cgroup)
+    if _FLAGS.fs_root == "/":
+        configure_swap()
+
+        # Drop all cached memory
+        log("Flushing all cached memory...")
+        subprocess.run("echo 3 > /proc/sys/vm/drop_caches", shell=True, check=True)
+    else:
+        log(f"Leaving the host's swap and page cache alone under '{_FLAGS.fs_root}'.")
 
-    # Drop all cached memory
-    log("Flushing all cached memory...")
-    subprocess.run("echo 3 > /proc/sys/vm/drop_caches", shell=True, check=True)
+    # Wait on the workload's pidfd between samples, rather than looking it up
+    # in cgroup.procs after every sample.
+    watcher = EventWatcher()
+    workload_exited = False
 
+    def on_workload_exit():
+        nonlocal workload_exited
+        workload_exited = True
+
+    watcher.watch_process_exit(_FLAGS.workload_pid, on_workload_exit)
+
+    def wait(timeout):
+        watcher.dispatch(timeout)
+        return workload_exited
+
+    monitor = CgroupMonitor(_FLAGS.cgroup, _FLAGS.output)
+    clock = TickClock(_FLAGS.probing_freq_seconds)
     try:
-        while _FLAGS.workload_pid in cg_procs():
-            probe()
-            time.sleep(_FLAGS.probing_freq_seconds)
+        run_ticks(
+            clock, lambda tick: monitor.sample(tick, clock.timestamp_ms(tick)), wait, _FLAGS.cgroup
+        )
     except Exception as e:
         log(f"Exception occured while probing cgroup statistics: {e}")
-
-    log(f"Dumping statistics to {_FLAGS.output}.")
-    write(_FLAGS.output, _KV_STREAM.to_csv())
+    finally:
+        log(f"Flushing statistics to {_FLAGS.output}.")
+        monitor.close()
+        watcher.close()
 
 
 def start_workload_process():
@@ -211,7 +848,13 @@ def start_workload_process():
 
 
 def splash():
-    _FLAGS.cgroup = (
+    cgroupfs.FS_ROOT = _FLAGS.fs_root
+    if _FLAGS.fleet:
+        if not start_fleet_monitoring():
+            sys.exit(1)
+        return
+
+    _FLAGS.cgroup = fs_path(
         f"/sys/fs/cgroup"
         + read(os.path.join("/proc", str(os.getpid()), "cgroup")).split("::")[1].strip()
     )
@@ -223,11 +866,4 @@ def splash():
 
 if __name__ == "__main__":
     _FLAGS = parse_cmdline_flags()
-    _KV_STREAM = KeyValueStream()
-    _METRICS = [
-        "memory.stat",
-        "memory.swap.current",
-        "memory.workingset.page_age",
-        "memory.current",
-    ]
     splash()
@@ -0,0 +1,134 @@
+"""Parser for memory.workingset.page_age"""
+
+import numpy as np
+
+# Everything in the file that isn't a number or whitespace.
+_NON_NUMERIC = b"Nanofile="
+
+ANON = 0
+FILE = 1
+
+
+def edge_index(edges, age_ms):
+    """Returns the index of the first of the sorted uint64 edges at or above age_ms, or len(edges).
+
+    Thresholds scaled by the policies are fractional and may be past the
+    uint64 range: round them up rather than letting the conversion truncate
+    them below an edge, or overflow.
+    """
+    age_ms = np.ceil(np.asarray(age_ms, dtype=np.float64))
+    beyond = age_ms >= 2.0**64
+    index = np.searchsorted(edges, np.where(beyond, 0, np.maximum(age_ms, 0)).astype(np.uint64))
+    index = np.where(beyond, len(edges), index)
+    return int(index) if index.ndim == 0 else index
+
+
+class PageAgeHistogram:
+    """Per node page age histogram.
+
+    pages[n, b] holds the (anon, file) bytes of node nids[n] whose age falls
+    in bucket b, i.e. below edges[b] and at or above edges[b - 1].
+    """
+
+    __slots__ = ("nids", "edges", "pages", "_cold")
+
+    def __init__(self, nids, edges, pages):
+        self.nids = nids
+        self.edges = edges
+        self.pages = pages
+        self._cold = None
+
+    def node_index(self, nid):
+        return self.nids.index(nid) if nid in self.nids else None
+
+    def colder_than(self, age_ms):
+        """Returns the (anon, file) bytes of every node in buckets whose edge is at or above age_ms."""
+        if self._cold is None:
+            # cold[:, b] = pages[:, b:].sum(axis=1), plus a trailing empty bucket.
+            nodes, _, kinds = self.pages.shape
+            self._cold = np.zeros((nodes, len(self.edges) + 1, kinds), dtype=np.int64)
+            np.cumsum(self.pages[:, ::-1], axis=1, out=self._cold[:, -2::-1])
+        return self._cold[:, edge_index(self.edges, age_ms)]
+
+
+def _parse_numbers(data):
+    return np.fromstring(data.translate(None, _NON_NUMERIC), dtype=np.uint64, sep=" ")
+
+
+def _parse_irregular(data):
+    # Nodes can be configured with different page age intervals, lay them out
+    # over the union of all edges.
+    nids, edges, pages = [], [], []
+    for chunk in data.split(b"N")[1:]:
+        nid, body = chunk.split(b"\n", 1)
+        values = _parse_numbers(body).reshape(-1, 3)
+        nids.append(int(nid))
+        edges.append(values[:, 0])
+        pages.append(values[:, 1:].astype(np.int64))
+
+    all_edges = np.unique(np.concatenate(edges))
+    dense = np.zeros((len(nids), len(all_edges), 2), dtype=np.int64)
+    for n, (e, p) in enumerate(zip(edges, pages)):
+        dense[n, np.searchsorted(all_edges, e)] = p
+    return PageAgeHistogram(nids, all_edges, dense)
+
+
+def parse_page_age(buf):
+    """Parses the content of memory.workingset.page_age, or returns None."""
+    if buf is None:
+        return None
+    data = bytes(buf)
+    nodes = data.count(b"N")
+    if nodes == 0:
+        return None
+
+    # Each node is its id followed by one (edge, anon, file) triple per
+    # bucket. When all nodes share the same edges, the whole file is a single
+    # (nodes, 1 + 3 * buckets) matrix.
+    values = _parse_numbers(data)
+    if len(values) % nodes == 0 and (len(values) // nodes - 1) % 3 == 0:
+        rows = values.reshape(nodes, -1)
+        buckets = rows[:, 1:].reshape(nodes, -1, 3)
+        edges = buckets[0, :, 0]
+        if (buckets[:, :, 0] == edges).all():
+            return PageAgeHistogram(
+                rows[:, 0].tolist(), edges.copy(), buckets[:, :, 1:].astype(np.int64)
+            )
+
+    return _parse_irregular(data)
+
+
+def merge_histograms(hists):
+    """Sums histograms over the union of their nodes and edges, or returns None.
+
+    A bucket goes to the union bucket of its own edge, so colder_than() stays
+    exact at the edges of every merged histogram.
+    """
+    hists = [h for h in hists if h is not None]
+    if not hists:
+        return None
+    first = hists[0]
+    if all(
+        h.nids == first.nids and np.array_equal(h.edges, first.edges) for h in hists[1:]
+    ):
+        pages = first.pages.copy()
+        for h in hists[1:]:
+            pages += h.pages
+        return PageAgeHistogram(list(first.nids), first.edges, pages)
+
+    nids = sorted(set().union(*(h.nids for h in hists)))
+    edges = np.unique(np.concatenate([h.edges for h in hists]))
+    pages = np.zeros((len(nids), len(edges), 2), dtype=np.int64)
+    for h in hists:
+        rows = [nids.index(nid) for nid in h.nids]
+        pages[np.ix_(rows, np.searchsorted(edges, h.edges))] += h.pages
+    return PageAgeHistogram(nids, edges, pages)
+
+
+def page_age_change(hist, last):
+    """Returns the fraction of the bytes of last that changed bucket or went away in hist."""
+    if hist is None or last is None:
+        return 0 if hist is last else 1
+    if hist.nids != last.nids or not np.array_equal(hist.edges, last.edges):
+        return 1
+    return float(np.abs(hist.pages - last.pages).sum()) / 2 / max(1, int(last.pages.sum()))
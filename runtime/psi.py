@@ -0,0 +1,70 @@
+"""Memory pressure (PSI) feedback for the reclaim agent"""
+
+
+def parse_pressure(buf):
+    """Returns {"some": {...}, "full": {...}} from the content of memory.pressure."""
+    ret = {}
+    if buf is None:
+        return ret
+    for line in bytes(buf).decode().splitlines():
+        kind, *fields = line.split()
+        ret[kind] = {}
+        for field in fields:
+            key, value = field.split("=")
+            ret[kind][key] = int(value) if key == "total" else float(value)
+    return ret
+
+
+class PsiThresholdController:
+    """Scales the cold age threshold of a cgroup from its memory stall time.
+
+    The stall fraction is the share of wall time some task of the cgroup was
+    stalled on memory since the previous update. Above the budget, reclaim was
+    too aggressive and the threshold grows. Well under the budget, the
+    threshold shrinks back to reclaim more.
+    """
+
+    # Under this fraction of the budget, pressure is considered to be near zero.
+    QUIET_FRACTION = 0.1
+
+    __slots__ = (
+        "stall_budget",
+        "increase",
+        "decrease",
+        "min_scale",
+        "max_scale",
+        "scale",
+        "stall",
+        "last_total",
+        "last_time",
+    )
+
+    def __init__(self, stall_budget, increase, decrease, min_scale, max_scale):
+        self.stall_budget = stall_budget
+        self.increase = increase
+        self.decrease = decrease
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.scale = 1.0
+        self.stall = None
+        self.last_total = None
+        self.last_time = None
+
+    def on_pressure_spike(self):
+        self.scale = min(self.max_scale, self.scale * self.increase)
+
+    def update(self, pressure, now):
+        some = pressure.get("some")
+        if some is None:
+            return
+        total, last_total, last_time = some["total"], self.last_total, self.last_time
+        self.last_total, self.last_time = total, now
+        if last_total is None or now <= last_time:
+            return
+
+        # PSI totals are in microseconds.
+        self.stall = (total - last_total) / 1e6 / (now - last_time)
+        if self.stall > self.stall_budget:
+            self.scale = min(self.max_scale, self.scale * self.increase)
+        elif self.stall < self.stall_budget * self.QUIET_FRACTION:
+            self.scale = max(self.min_scale, self.scale * self.decrease)
@@ -0,0 +1,91 @@
+"""Chunked and paced writes to memory.reclaim"""
+
+import asyncio
+import os
+import time
+
+
+def cg_reclaim(cgroup, request):
+    """Writes to memory.reclaim, returns 0 or the errno of the failed write."""
+    try:
+        fd = os.open(os.path.join(cgroup, "memory.reclaim"), os.O_WRONLY)
+        try:
+            os.write(fd, f"{request}\n".encode())
+        finally:
+            os.close(fd)
+        return 0
+    except OSError as e:
+        return e.errno
+
+
+class ReclaimResult:
+    """Outcome of a paced reclaim request."""
+
+    __slots__ = ("requested", "reclaimed", "chunks", "latencies", "error", "interrupted")
+
+    def __init__(self, requested, chunks):
+        self.requested = requested
+        self.reclaimed = 0
+        self.chunks = chunks
+        self.latencies = []
+        # errno of the write that ended the request early, 0 otherwise.
+        self.error = 0
+        self.interrupted = False
+
+    def latency_summary(self):
+        if not self.latencies:
+            return "no chunk written"
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return (
+            f"{len(latencies)}/{self.chunks} chunks, latency p50 = {p50 * 1000:.2f} ms,"
+            f" p99 = {p99 * 1000:.2f} ms, max = {latencies[-1] * 1000:.2f} ms"
+        )
+
+
+async def paced_reclaim(cgroup, nbytes, args, chunk_bytes, duration_seconds, stop=None, budget=None):
+    """Reclaims nbytes in chunks of at most chunk_bytes spread over duration_seconds.
+
+    args is appended to every request, e.g. " nodes=1". Stops at the first
+    failed write, memory.reclaim fails with EAGAIN once the kernel couldn't
+    reclaim a whole chunk, or as soon as the optional stop event is set.
+    Every chunk waits for the optional swap write budget first.
+    """
+    loop = asyncio.get_running_loop()
+    if chunk_bytes <= 0:
+        chunk_bytes = max(1, nbytes)
+    chunks = max(1, -(-nbytes // chunk_bytes))
+    result = ReclaimResult(nbytes, chunks)
+    gap = duration_seconds / chunks
+    start = loop.time()
+
+    for i in range(chunks):
+        if stop is not None and stop.is_set():
+            result.interrupted = True
+            break
+        size = min(chunk_bytes, nbytes - result.reclaimed)
+        if budget is not None:
+            await budget.acquire(size)
+        t0 = time.perf_counter()
+        err = await loop.run_in_executor(None, cg_reclaim, cgroup, f"{size}{args}")
+        result.latencies.append(time.perf_counter() - t0)
+        if budget is not None:
+            await budget.settle()
+        if err:
+            result.error = err
+            break
+        result.reclaimed += size
+        if result.reclaimed >= nbytes:
+            break
+
+        timeout = max(0, start + (i + 1) * gap - loop.time())
+        if stop is None:
+            await asyncio.sleep(timeout)
+            continue
+        try:
+            await asyncio.wait_for(stop.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    return result
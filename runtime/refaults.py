@@ -0,0 +1,110 @@
+"""Refault feedback for the reclaim agent"""
+
+import collections
+
+
+def parse_memory_stat(buf):
+    """Returns {key: value} from the content of memory.stat."""
+    ret = {}
+    if buf is None:
+        return ret
+    for line in bytes(buf).splitlines():
+        key, value = line.split()
+        ret[key.decode()] = int(value)
+    return ret
+
+
+def refaulted_pages(stat):
+    """Returns the pages refaulted by a cgroup so far, or None if memory.stat doesn't tell.
+
+    Kernels before 5.9 only have a single workingset_refault counter, and
+    without workingset counters swap-ins are the next best thing.
+    """
+    if "workingset_refault_anon" in stat or "workingset_refault_file" in stat:
+        return stat.get("workingset_refault_anon", 0) + stat.get(
+            "workingset_refault_file", 0
+        )
+    for key in ("workingset_refault", "pswpin"):
+        if key in stat:
+            return stat[key]
+    return None
+
+
+class RefaultBackoff:
+    """Backs off reclaim of a cgroup whose reclaimed memory comes straight back.
+
+    Over a sliding window of cycles, the refault ratio is the refaulted
+    bytes over the bytes reclaimed. Above the budget, the memory reclaimed
+    wasn't actually cold: the threshold grows, and once it's as long as it
+    gets, cycles are skipped, for twice as many cycles every time. Well under
+    the budget, the threshold shrinks back.
+    """
+
+    # Under this fraction of the budget, refaults are considered to be noise.
+    QUIET_FRACTION = 0.25
+
+    __slots__ = (
+        "budget",
+        "increase",
+        "decrease",
+        "max_scale",
+        "max_skip",
+        "history",
+        "pending",
+        "last_refaulted",
+        "ratio",
+        "scale",
+        "skip",
+        "skip_len",
+    )
+
+    def __init__(self, budget, window, increase, decrease, max_scale, max_skip):
+        self.budget = budget
+        self.increase = increase
+        self.decrease = decrease
+        self.max_scale = max_scale
+        self.max_skip = max_skip
+        # (reclaimed, refaulted) bytes of the last cycles.
+        self.history = collections.deque(maxlen=window)
+        self.pending = 0
+        self.last_refaulted = None
+        self.ratio = None
+        self.scale = 1.0
+        self.skip = 0
+        self.skip_len = 0
+
+    def window(self):
+        """Returns the (reclaimed, refaulted) bytes over the window."""
+        return sum(r for r, _ in self.history), sum(f for _, f in self.history)
+
+    def on_reclaimed(self, nbytes):
+        self.pending += nbytes
+
+    def update(self, refaulted):
+        """Closes the previous cycle given the bytes refaulted so far, at the start of a cycle."""
+        last, self.last_refaulted = self.last_refaulted, refaulted
+        if last is None:
+            return
+        # The counters start over if the cgroup was recreated.
+        self.history.append((self.pending, max(0, refaulted - last)))
+        self.pending = 0
+
+        reclaimed, refaulted = self.window()
+        self.ratio = refaulted / reclaimed if reclaimed else None
+        if self.ratio is None or self.skip:
+            return
+        if self.ratio > self.budget:
+            if self.scale < self.max_scale:
+                self.scale = min(self.max_scale, self.scale * self.increase)
+            else:
+                self.skip_len = min(self.max_skip, max(1, 2 * self.skip_len))
+                self.skip = self.skip_len
+        elif self.ratio < self.budget * self.QUIET_FRACTION:
+            self.scale = max(1.0, self.scale * self.decrease)
+            self.skip_len = 0
+
+    def should_skip(self):
+        if self.skip:
+            self.skip -= 1
+            return True
+        return False
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+"""Offline replay of reclaim policies against recorded monitoring traces"""
+
+import argparse
+import datetime
+import io
+import itertools
+import re
+import warnings
+
+import numpy as np
+
+from page_age import edge_index
+
+
+def now():
+    return datetime.datetime.now().strftime("%H-%M-%S-%f")
+
+
+def log(msg):
+    print(f"{now()} -- INFO: [{__name__}] {msg}")
+
+
+# Page age columns of monitoring.py traces (cold.node.*) as well as of the old
+# runner traces (memory.workingset.node.*, sometimes misspelled).
+_PAGE_AGE_COLUMN = re.compile(
+    r"(?:cold|memory\.working\w*)\.node\.(\d+)\.(\d+)ms\.(?:anon|file)$"
+)
+
+
+def parse_timestamps(values):
+    """Returns seconds since the first sample.
+
+    monitoring.py records milliseconds since the epoch, the old runner
+    recorded the wall clock time as %H-%M-%S-%f.
+    """
+    if values.dtype.kind == "i":
+        t = values / 1000
+    else:
+        h, m, s, us = np.array(np.char.split(values, "-").tolist(), dtype=np.int64).T
+        t = (h * 3600 + m * 60 + s + us / 1e6).astype(np.float64)
+        # The wall clock wraps around at midnight.
+        t += 86400 * np.cumsum(np.concatenate([[0], np.diff(t) < 0]))
+    return t - t[0]
+
+
+class Trace:
+    """A recorded run, with the page age buckets of all nodes summed up.
+
+    pages[i, b] holds the anon + file bytes of sample i whose age falls in
+    bucket b, i.e. below edges[b].
+    """
+
+    __slots__ = ("path", "t", "current", "swap", "edges", "pages", "_cold")
+
+    def __init__(self, path, t, current, swap, edges, pages):
+        self.path = path
+        self.t = t
+        self.current = current
+        self.swap = swap
+        self.edges = edges
+        self.pages = pages
+        self._cold = None
+
+    def colder_than(self, age_ms):
+        """Returns the bytes of every sample in buckets whose edge is at or above age_ms."""
+        if self._cold is None:
+            self._cold = np.zeros((len(self.t), len(self.edges) + 1), dtype=np.int64)
+            np.cumsum(self.pages[:, ::-1], axis=1, out=self._cold[:, -2::-1])
+        return self._cold[:, edge_index(self.edges, age_ms)]
+
+
+def _load_columns(body, columns, dtype):
+    with warnings.catch_warnings():
+        # The monitor ends traces with an empty line.
+        warnings.simplefilter("ignore", UserWarning)
+        return np.loadtxt(io.StringIO(body), dtype=dtype, delimiter=",", usecols=columns, ndmin=2)
+
+
+def load_trace(path):
+    with open(path, "r") as f:
+        header = f.readline().rstrip("\n").split(",")
+        body = f.read()
+    index = {label: i for i, label in enumerate(header)}
+    buckets = {}
+    for i, label in enumerate(header):
+        m = _PAGE_AGE_COLUMN.match(label)
+        if m:
+            buckets.setdefault(int(m.group(2)), []).append(i)
+    edges = sorted(buckets)
+
+    # Samples written by the streaming monitor can miss some labels: mark
+    # the empty cells -1, then carry the last known value forward.
+    for _ in range(2):
+        body = body.replace(",,", ",-1,")
+    body = body.replace(",\n", ",-1\n")
+    if body.endswith(","):
+        body += "-1"
+    columns = sorted(
+        {index[label] for label in ("memory.current", "memory.swap.current") if label in index}
+        | {i for columns in buckets.values() for i in columns}
+    )
+    values = _load_columns(body, columns, np.int64)
+    rows = np.where(values != -1, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    values = np.maximum(0, values[rows, np.arange(len(columns))])
+    position = {i: c for c, i in enumerate(columns)}
+    try:
+        timestamps = _load_columns(body, [index["timestamp"]], np.int64)[:, 0]
+    except ValueError:
+        timestamps = _load_columns(body, [index["timestamp"]], str)[:, 0]
+
+    def column(label):
+        if label not in index:
+            return np.zeros(len(values), dtype=np.int64)
+        return values[:, position[index[label]]]
+
+    pages = np.zeros((len(values), len(edges)), dtype=np.int64)
+    for b, edge in enumerate(edges):
+        for i in buckets[edge]:
+            pages[:, b] += values[:, position[i]]
+
+    return Trace(
+        path,
+        parse_timestamps(timestamps),
+        column("memory.current"),
+        column("memory.swap.current"),
+        np.array(edges, dtype=np.uint64),
+        pages,
+    )
+
+
+class ReplayResult:
+    __slots__ = ("reclaimed", "refaulted", "peak", "average", "average_swap")
+
+
+def cycle_starts(t, period, offset=0.0):
+    """Returns the indices of the samples at which reclaim cycles start."""
+    times = np.arange(offset, t[-1], period)
+    return np.unique(np.searchsorted(t, times))
+
+
+def swapped_after_reclaim(cold, starts):
+    """Bytes still swapped out at every sample when reclaiming everything cold at starts.
+
+    Reclaimed pages stay out as long as that much memory remains at least as
+    cold as the threshold. Any decrease is assumed to be refaulted back in.
+    """
+    swapped = np.zeros(len(cold), dtype=np.int64)
+    bounds = np.append(starts, len(cold))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        swapped[start:end] = np.minimum.accumulate(cold[start:end])
+    return swapped
+
+
+def replay_agent(trace, threshold_ms, period, **options):
+    # runtime/agent.py sleeps for about a period before its first cycle.
+    cold = trace.colder_than(threshold_ms)
+    return swapped_after_reclaim(cold, cycle_starts(trace.t, period, offset=period))
+
+
+def replay_periodic(trace, threshold_ms, period, **options):
+    # PeriodicPolicy in old/agent.py reclaims right away, then every period.
+    cold = trace.colder_than(threshold_ms)
+    return swapped_after_reclaim(cold, cycle_starts(trace.t, period))
+
+
+def replay_memory_high(trace, threshold_ms, period, throttle_duration_seconds, **options):
+    # MemoryDotHighPolicy in old/agent.py sets memory.high to the memory
+    # without its cold part for the throttle duration, then restores it. Any
+    # growth during the throttle window is pushed out and refaults after it.
+    throttle = throttle_duration_seconds
+    cold = trace.colder_than(threshold_ms)
+    starts = cycle_starts(trace.t, period + throttle)
+    swapped = swapped_after_reclaim(cold, starts)
+    for start in starts:
+        end = np.searchsorted(trace.t, trace.t[start] + throttle)
+        high = trace.current[start] - cold[start]
+        window = slice(start, end)
+        swapped[window] += np.maximum(
+            0, trace.current[window] - swapped[window] - high
+        )
+    return swapped
+
+
+# Every policy is called with the trace, the threshold, the period and the
+# keyword options of all policies, and takes the ones it needs.
+POLICIES = {
+    "agent": replay_agent,
+    "periodic": replay_periodic,
+    "memory.high": replay_memory_high,
+}
+
+
+def replay(trace, policy, threshold_ms, period, **options):
+    """Replays policy on trace, options are the keyword parameters of all the policies."""
+    swapped = POLICIES[policy](trace, threshold_ms, period, **options)
+    resident = np.maximum(0, trace.current - swapped)
+    delta = np.diff(swapped, prepend=0)
+    dt = np.diff(trace.t, append=trace.t[-1])
+    weights = dt if dt.sum() > 0 else None
+
+    result = ReplayResult()
+    result.reclaimed = int(delta[delta > 0].sum())
+    result.refaulted = int(-delta[delta < 0].sum())
+    result.peak = int(resident.max())
+    result.average = float(np.average(resident, weights=weights))
+    result.average_swap = float(np.average(trace.swap + swapped, weights=weights))
+    return result
+
+
+def parse_list(value, type):
+    return [type(v) for v in value.split(",")]
+
+
+def splash():
+    header = "trace,policy,cold_age_threshold_ms,reclaim_freq_seconds,reclaimed_mib,refaulted_mib,peak_mib,average_mib,average_swap_mib,peak_reduction"
+    rows = [header]
+    for path in _FLAGS.traces:
+        trace = load_trace(path)
+        control_peak = int(trace.current.max())
+        log(
+            f"Loaded {len(trace.t)} samples spanning {trace.t[-1]:.0f} s from '{path}', peak memory.current = {control_peak / (1 << 20):.2f} MiB."
+        )
+        for policy, threshold, period in itertools.product(
+            parse_list(_FLAGS.policies, str),
+            parse_list(_FLAGS.cold_age_thresholds_ms, float),
+            parse_list(_FLAGS.reclaim_freqs_seconds, float),
+        ):
+            r = replay(trace, policy, threshold, period, throttle_duration_seconds=_FLAGS.throttle_duration_seconds)
+            reduction = 1 - r.peak / control_peak if control_peak else 0
+            rows.append(
+                f"{path},{policy},{threshold:g},{period:g},{r.reclaimed / (1 << 20):.2f},{r.refaulted / (1 << 20):.2f},"
+                f"{r.peak / (1 << 20):.2f},{r.average / (1 << 20):.2f},{r.average_swap / (1 << 20):.2f},{reduction:.3f}"
+            )
+
+    report = "\n".join(rows) + "\n"
+    if _FLAGS.output:
+        log(f"Writing {len(rows) - 1} results to {_FLAGS.output}.")
+        with open(_FLAGS.output, "w") as f:
+            f.write(report)
+    else:
+        print(report, end="")
+
+
+def parse_cmdline_flags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "traces", type=str, nargs="+", help="Traces recorded by monitoring.py"
+    )
+    parser.add_argument(
+        "--policies",
+        type=str,
+        default="agent",
+        help=f"Policies to replay, separated by commas. One of {', '.join(POLICIES)}",
+    )
+    parser.add_argument(
+        "--cold_age_thresholds_ms",
+        type=str,
+        default="10000",
+        help="Cold age thresholds to replay, separated by commas",
+    )
+    parser.add_argument(
+        "--reclaim_freqs_seconds",
+        type=str,
+        default="40",
+        help="Reclaim frequencies to replay, separated by commas",
+    )
+    parser.add_argument(
+        "--throttle_duration_seconds",
+        type=float,
+        default=1,
+        help="Throttle duration of the memory.high policy",
+    )
+    parser.add_argument("--output", type=str, help="Path to the output CSV file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    _FLAGS = parse_cmdline_flags()
+    splash()
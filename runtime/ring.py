@@ -0,0 +1,241 @@
+"""Shared-memory ring of the samples the monitor publishes for local consumers
+
+A ring is a file, normally under /dev/shm, mapped by a single writer and any
+number of readers. It is a 64 byte header followed by nslots fixed size
+slots, all little endian:
+
+  header: magic, u32 version, u32 nslots, u32 max_nodes, u32 max_buckets,
+          u64 published, the number of samples written so far, u32 closed,
+          set when the writer is done with the ring.
+  slot:   u64 seq, i64 timestamp_ms, i64 memory.current, i64
+          memory.swap.current, u32 nnodes, u32 nbuckets, u32 nids[max_nodes],
+          u64 edges[max_buckets], i64 pages[max_nodes][max_buckets][2].
+
+Sample k goes to slot k % nslots. The writer makes the slot's seq odd before
+writing it, sets it to 2 * (k + 1) once done, then bumps published. Readers
+never lock: they use the slot in place and check afterwards that its seq
+didn't change, i.e. that the writer didn't lap the ring meanwhile. This
+relies on the stores reaching the other processes in program order, as on
+x86.
+"""
+
+import datetime
+import os
+import mmap
+import time
+
+import numpy as np
+
+from cgroupfs import fs_path
+from page_age import PageAgeHistogram
+from samples import MISSING
+
+MAGIC = b"WMORING1"
+VERSION = 1
+MAX_NODES = 16
+MAX_BUCKETS = 32
+
+_HEADER = np.dtype(
+    {
+        "names": ["magic", "version", "nslots", "max_nodes", "max_buckets", "published", "closed"],
+        "formats": ["S8", "<u4", "<u4", "<u4", "<u4", "<u8", "<u4"],
+        "offsets": [0, 8, 12, 16, 20, 24, 32],
+        "itemsize": 64,
+    }
+)
+
+
+def now():
+    return datetime.datetime.now().strftime("%H-%M-%S-%f")
+
+
+def log(msg):
+    print(f"{now()} -- INFO: [{__name__}] {msg}")
+
+
+def _slot_dtype(max_nodes, max_buckets):
+    return np.dtype(
+        [
+            ("seq", "<u8"),
+            ("timestamp_ms", "<i8"),
+            ("current", "<i8"),
+            ("swap", "<i8"),
+            ("nnodes", "<u4"),
+            ("nbuckets", "<u4"),
+            ("nids", "<u4", (max_nodes,)),
+            ("edges", "<u8", (max_buckets,)),
+            ("pages", "<i8", (max_nodes, max_buckets, 2)),
+        ],
+        align=True,
+    )
+
+
+def ring_path(directory, cgroup):
+    """Returns the ring of a cgroup, named like the monitor's output files."""
+    name = os.path.relpath(cgroup, fs_path("/sys/fs/cgroup")).replace("/", ".")
+    return os.path.join(directory, f"{'root' if name == '.' else name}.ring")
+
+
+class _Mapping:
+    def __init__(self, f, access):
+        self.mm = mmap.mmap(f.fileno(), 0, access=access)
+        self.header = np.ndarray((), dtype=_HEADER, buffer=self.mm)
+        if self.header["magic"] != MAGIC or self.header["version"] != VERSION:
+            raise ValueError("not a sample ring")
+        nslots = int(self.header["nslots"])
+        dtype = _slot_dtype(int(self.header["max_nodes"]), int(self.header["max_buckets"]))
+        slots = np.ndarray((nslots,), dtype=dtype, buffer=self.mm, offset=_HEADER.itemsize)
+        self.nslots = nslots
+        # Per field views over all the slots.
+        self.fields = {name: slots[name] for name in dtype.names}
+        self.max_nodes = int(self.header["max_nodes"])
+        self.max_buckets = int(self.header["max_buckets"])
+
+    def close(self):
+        self.header = self.fields = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # A reader still holds a sample, the mapping goes away with it.
+            pass
+
+
+class RingWriter:
+    """Publishes the samples of a cgroup into a new ring at path."""
+
+    def __init__(self, path, nslots=16, max_nodes=MAX_NODES, max_buckets=MAX_BUCKETS):
+        self.path = path
+        size = _HEADER.itemsize + nslots * _slot_dtype(max_nodes, max_buckets).itemsize
+        # Readers only ever see a fully initialized ring.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        header = np.zeros((), dtype=_HEADER)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["nslots"] = nslots
+        header["max_nodes"] = max_nodes
+        header["max_buckets"] = max_buckets
+        with open(tmp, "w+b") as f:
+            f.write(header.tobytes())
+            f.truncate(size)
+            os.replace(tmp, path)
+            self.ino = os.fstat(f.fileno()).st_ino
+            self.mapping = _Mapping(f, mmap.ACCESS_WRITE)
+        self.warned = False
+
+    def publish(self, timestamp_ms, current, swap, hist):
+        m = self.mapping
+        nnodes, nbuckets = len(hist.nids), len(hist.edges)
+        if nnodes > m.max_nodes or nbuckets > m.max_buckets:
+            if not self.warned:
+                log(f"'{self.path}' only holds {m.max_nodes} nodes of {m.max_buckets} buckets, not publishing {nnodes} of {nbuckets}.")
+                self.warned = True
+            return
+        k = int(m.header["published"])
+        i = k % m.nslots
+        f = m.fields
+        f["seq"][i] = 2 * k + 1
+        f["timestamp_ms"][i] = timestamp_ms
+        f["current"][i] = MISSING if current is None else current
+        f["swap"][i] = MISSING if swap is None else swap
+        f["nnodes"][i] = nnodes
+        f["nbuckets"][i] = nbuckets
+        f["nids"][i, :nnodes] = hist.nids
+        f["edges"][i, :nbuckets] = hist.edges
+        f["pages"][i, :nnodes, :nbuckets] = hist.pages
+        f["seq"][i] = 2 * (k + 1)
+        m.header["published"] = k + 1
+
+    def close(self):
+        self.mapping.header["closed"] = 1
+        self.mapping.close()
+        # Leave a ring that replaced this one alone.
+        try:
+            if os.stat(self.path).st_ino == self.ino:
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SharedSample:
+    """The newest sample of a ring, in place.
+
+    Its histogram is a view over the ring, check intact() once done with it:
+    when False, the writer reused the slot meanwhile and what was read from
+    it can't be trusted.
+    """
+
+    __slots__ = ("seq_view", "slot", "seq", "timestamp_ms", "current", "swap", "hist")
+
+    def __init__(self, seq_view, slot, seq, timestamp_ms, current, swap, hist):
+        self.seq_view = seq_view
+        self.slot = slot
+        self.seq = seq
+        self.timestamp_ms = timestamp_ms
+        self.current = current
+        self.swap = swap
+        self.hist = hist
+
+    def intact(self):
+        return int(self.seq_view[self.slot]) == self.seq
+
+
+class RingReader:
+    """Reads the newest samples of the ring at path, whenever it exists."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mapping = None
+
+    def _open(self):
+        try:
+            with open(self.path, "rb") as f:
+                self.mapping = _Mapping(f, mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.mapping = None
+
+    def latest(self, max_age_seconds):
+        """Returns the newest sample if it's at most max_age_seconds old, or None."""
+        if self.mapping is None:
+            self._open()
+            if self.mapping is None:
+                return None
+        m = self.mapping
+        f = m.fields
+        for _ in range(3):
+            k = int(m.header["published"])
+            if k == 0 or m.header["closed"]:
+                break
+            i = (k - 1) % m.nslots
+            seq = int(f["seq"][i])
+            if seq != 2 * k:
+                # Lapped while looking, try the newer sample.
+                continue
+            timestamp_ms = int(f["timestamp_ms"][i])
+            if time.time() * 1000 - timestamp_ms > max_age_seconds * 1000:
+                break
+            nnodes, nbuckets = int(f["nnodes"][i]), int(f["nbuckets"][i])
+            current, swap = int(f["current"][i]), int(f["swap"][i])
+            sample = SharedSample(
+                f["seq"],
+                i,
+                seq,
+                timestamp_ms,
+                None if current == MISSING else current,
+                None if swap == MISSING else swap,
+                PageAgeHistogram(
+                    f["nids"][i, :nnodes].tolist(),
+                    f["edges"][i, :nbuckets],
+                    f["pages"][i, :nnodes, :nbuckets],
+                ),
+            )
+            if sample.intact():
+                return sample
+        # Nothing fresh: the monitor is gone or stalled, or another one
+        # replaced the ring. Map it again next time.
+        self.close()
+        return None
+
+    def close(self):
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
@@ -0,0 +1,52 @@
+"""Columnar int64 storage for probed samples"""
+
+import array
+
+# Marks a label that was not reported in a sample.
+MISSING = -(1 << 63)
+
+
+class SampleStore:
+    """Stores samples as one int64 array per label.
+
+    Every column holds exactly one value per sample, labels missing from a
+    sample hold MISSING, so columns always stay aligned.
+    """
+
+    __slots__ = ("columns", "nrows")
+
+    def __init__(self):
+        self.columns = {}
+        self.nrows = 0
+
+    def push(self, label, value):
+        column = self.columns.get(label)
+        if column is None:
+            column = self.columns[label] = array.array("q", [MISSING]) * self.nrows
+        if len(column) > self.nrows:
+            column[-1] = value
+        else:
+            column.append(value)
+
+    def end_sample(self):
+        self.nrows += 1
+        for column in self.columns.values():
+            if len(column) < self.nrows:
+                column.append(MISSING)
+
+    def clear(self):
+        for column in self.columns.values():
+            del column[:]
+        self.nrows = 0
+
+    def to_numpy(self, label):
+        """Returns a view over the column, release it before pushing more samples."""
+        import numpy as np
+
+        return np.frombuffer(self.columns[label], dtype=np.int64)
+
+    def write_csv(self, f, header=False):
+        if header:
+            f.write(",".join(self.columns.keys()) + "\n")
+        for row in zip(*self.columns.values()):
+            f.write(",".join("" if v == MISSING else str(v) for v in row) + "\n")
@@ -0,0 +1,163 @@
+"""Aggregation of the working set of a whole cgroup hierarchy"""
+
+import heapq
+import os
+
+from cgroupfs import CgroupFile
+from page_age import merge_histograms, parse_page_age
+
+_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+
+
+class CgroupNode:
+    """A cgroup of the walked hierarchy, with the totals of its subtree.
+
+    Leaves report their own memory. Inner cgroups report their own
+    hierarchical memory.current and memory.swap.current, which also count
+    the memory charged to them directly and to children without the memory
+    controller, or the sum of their children when they don't have these
+    files, e.g. the root cgroup. Their histograms and cold bytes are the
+    sums of their children's. unaccounted counts the cgroups underneath
+    whose memory couldn't be read and isn't in current, top holds the (cold
+    bytes, path) of the coldest leaves underneath.
+    """
+
+    __slots__ = (
+        "path",
+        "fd",
+        "files",
+        "children",
+        "current",
+        "swap",
+        "hist",
+        "cold",
+        "leaves",
+        "unaccounted",
+        "top",
+    )
+
+    def __init__(self, path, fd):
+        self.path = path
+        self.fd = fd
+        self.files = {}
+        self.children = {}
+        self.current = 0
+        self.swap = 0
+        self.hist = None
+        self.cold = 0
+        self.leaves = 0
+        self.unaccounted = 0
+        self.top = []
+
+    def read(self, name):
+        """Returns the content of one of the cgroup's files, or None if it's gone."""
+        f = self.files.get(name)
+        if f is None:
+            f = self.files[name] = CgroupFile(name, dir_fd=self.fd)
+        try:
+            return f.read()
+        except OSError:
+            return None
+
+    def read_int(self, name):
+        value = self.read(name)
+        return None if value is None else int(value.tobytes())
+
+    def close(self):
+        for child in self.children.values():
+            child.close()
+        for f in self.files.values():
+            f.close()
+        os.close(self.fd)
+
+    def nodes(self):
+        """Yields the inner cgroups of the subtree, parents first."""
+        if not self.children:
+            return
+        yield self
+        for child in self.children.values():
+            yield from child.nodes()
+
+
+class SubtreeWalker:
+    """Walks a cgroup hierarchy, keeping every directory and file open across walks.
+
+    Cgroups created between walks are picked up, cgroups removed are dropped,
+    and a cgroup removed during a walk simply counts for nothing in it.
+    """
+
+    def __init__(self, root, cold_age_threshold_ms, top):
+        self.root_path = root
+        self.root = None
+        self.cold_age_threshold_ms = cold_age_threshold_ms
+        self.top = top
+
+    def walk(self):
+        """Refreshes the totals of the whole hierarchy, returns its root or None if it's gone."""
+        if self.root is None:
+            try:
+                self.root = CgroupNode(self.root_path, os.open(self.root_path, _DIR_FLAGS))
+            except OSError:
+                return None
+        try:
+            self._walk(self.root)
+        except OSError:
+            # The root itself is gone, look it up again next time.
+            self.close()
+            return None
+        return self.root
+
+    def _walk(self, node):
+        names = set()
+        with os.scandir(node.fd) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    names.add(entry.name)
+        for name in node.children.keys() - names:
+            node.children.pop(name).close()
+        for name in names - node.children.keys():
+            try:
+                fd = os.open(name, _DIR_FLAGS, dir_fd=node.fd)
+            except OSError:
+                # Gone already.
+                continue
+            node.children[name] = CgroupNode(os.path.join(node.path, name), fd)
+
+        for name, child in list(node.children.items()):
+            try:
+                self._walk(child)
+            except OSError:
+                node.children.pop(name).close()
+
+        current = node.read_int("memory.current")
+        swap = node.read_int("memory.swap.current")
+        if node.children:
+            children = node.children.values()
+            if current is None:
+                node.current = sum(c.current for c in children)
+                node.unaccounted = sum(c.unaccounted for c in children)
+            else:
+                node.current = current
+                node.unaccounted = 0
+            node.swap = sum(c.swap for c in children) if swap is None else swap
+            node.hist = merge_histograms([c.hist for c in children])
+            node.cold = sum(c.cold for c in children)
+            node.leaves = sum(c.leaves for c in children)
+            node.top = heapq.nlargest(
+                self.top, (t for c in children for t in c.top)
+            )
+        else:
+            node.current = current or 0
+            node.unaccounted = int(current is None)
+            node.swap = swap or 0
+            node.hist = parse_page_age(node.read("memory.workingset.page_age"))
+            node.cold = 0
+            if node.hist is not None:
+                node.cold = int(node.hist.colder_than(self.cold_age_threshold_ms).sum())
+            node.leaves = 1
+            node.top = [(node.cold, node.path)] if node.cold else []
+
+    def close(self):
+        if self.root is not None:
+            self.root.close()
+            self.root = None
@@ -0,0 +1,193 @@
+"""Host-wide budget of the bytes reclaim writes to the swap device"""
+
+import asyncio
+import math
+import os
+
+import cgroupfs
+from cgroupfs import fs_path
+
+
+def parse_io_stat(buf):
+    """Returns {"MAJ:MIN": {key: value}} from the content of io.stat."""
+    ret = {}
+    if buf is None:
+        return ret
+    for line in bytes(buf).splitlines():
+        dev, *fields = line.split()
+        ret[dev.decode()] = {
+            key.decode(): int(value)
+            for key, value in (field.split(b"=") for field in fields)
+        }
+    return ret
+
+
+def _disk(major, minor):
+    """Returns the "MAJ:MIN" of the disk holding a device, io.stat has no partitions."""
+    dev = fs_path(f"/sys/dev/block/{major}:{minor}")
+    if os.path.exists(os.path.join(dev, "partition")):
+        try:
+            with open(os.path.join(dev, "..", "dev"), "r") as f:
+                return f.read().strip()
+        except OSError:
+            pass
+    return f"{major}:{minor}"
+
+
+def swap_devices():
+    """Returns the "MAJ:MIN" of the disks holding the active swap areas, from /proc/swaps."""
+    devices = set()
+    try:
+        with open(fs_path("/proc/swaps"), "r") as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        return devices
+    for line in lines:
+        path, kind, *_ = line.split()
+        # Paths with spaces come escaped as \040.
+        path = path.replace("\\040", " ")
+        try:
+            st = os.stat(fs_path(path))
+        except OSError:
+            continue
+        dev = st.st_rdev if kind == "partition" else st.st_dev
+        devices.add(_disk(os.major(dev), os.minor(dev)))
+    return devices
+
+
+class SwapWriteBudget:
+    """Token bucket of the bytes all managed cgroups may write to the swap device.
+
+    Tokens accrue at rate bytes per second up to burst. Before each
+    memory.reclaim request a cgroup takes its estimate of the bytes the
+    request will write, and once done settles the difference with what it
+    actually wrote. When tokens run short, waiting cgroups are served in
+    order of their recent use of the budget, an exponentially decayed byte
+    count, the least served first: a big reclaim cycle can't starve the
+    others.
+    """
+
+    USAGE_HALF_LIFE_SECONDS = 30
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.last = None
+        # [(account, nbytes, future)] waiting for tokens.
+        self.waiters = []
+        self.timer = None
+
+    def refill(self):
+        t = cgroupfs.monotonic()
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (t - self.last) * self.rate)
+        self.last = t
+        return t
+
+    async def acquire(self, account, nbytes):
+        """Waits until nbytes, at most burst, may be written, returns the seconds waited."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        future = loop.create_future()
+        self.waiters.append((account, nbytes, future))
+        self.dispatch()
+        await future
+        return loop.time() - start
+
+    def charge(self, account, nbytes):
+        """Takes nbytes out of the bucket, or gives them back if negative."""
+        t = self.refill()
+        self.tokens = min(self.burst, self.tokens - nbytes)
+        account.use(t, nbytes)
+        if nbytes < 0:
+            self.dispatch()
+
+    def dispatch(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        t = self.refill()
+        self.waiters = [w for w in self.waiters if not w[2].done()]
+        while self.waiters:
+            waiter = min(self.waiters, key=lambda w: w[0].usage_at(t))
+            account, nbytes, future = waiter
+            # Timers may fire up to a clock resolution early, don't wait
+            # again for a fraction of a byte.
+            if self.tokens < nbytes - 1:
+                self.timer = asyncio.get_running_loop().call_later(
+                    (nbytes - self.tokens) / self.rate, self.dispatch
+                )
+                return
+            self.waiters.remove(waiter)
+            self.tokens -= nbytes
+            account.use(t, nbytes)
+            future.set_result(None)
+
+    def share(self, account):
+        """Returns the fraction of the budget a cgroup recently used."""
+        t = cgroupfs.monotonic()
+        window = self.USAGE_HALF_LIFE_SECONDS / math.log(2)
+        return account.usage_at(t) / (self.rate * window)
+
+
+class SwapWriteAccount:
+    """A cgroup's use of the SwapWriteBudget.
+
+    written() returns the bytes the cgroup wrote to the swap device so far,
+    or None when it can't tell. The estimate of the bytes a request writes is
+    the fraction of the bytes requested that ended up written so far, as
+    pages reclaimed from the page cache or into zswap aren't.
+    """
+
+    def __init__(self, budget, written):
+        self.budget = budget
+        self.written = written
+        self.usage = 0.0
+        self.usage_time = None
+        # Bytes written over bytes requested, EWMA.
+        self.ratio = 1.0
+        self.total = 0
+        self.waited = 0.0
+        self.pending = None
+
+    def usage_at(self, t):
+        if self.usage_time is None:
+            return 0.0
+        return self.usage * 0.5 ** ((t - self.usage_time) / self.budget.USAGE_HALF_LIFE_SECONDS)
+
+    def use(self, t, nbytes):
+        self.usage = max(0.0, self.usage_at(t) + nbytes)
+        self.usage_time = t
+
+    async def acquire(self, nbytes):
+        """Waits for the budget of a request of nbytes."""
+        loop = asyncio.get_running_loop()
+        # A request larger than the bucket waits for a full one, and leaves
+        # it in debt once settled.
+        estimate = min(int(nbytes * self.ratio), self.budget.burst)
+        if estimate > 0:
+            self.waited += await self.budget.acquire(self, estimate)
+        before = await loop.run_in_executor(None, self.written)
+        self.pending = (nbytes, estimate, before)
+
+    async def settle(self):
+        """Charges what the last acquired request actually wrote instead of its estimate."""
+        if self.pending is None:
+            return
+        nbytes, estimate, before = self.pending
+        self.pending = None
+        after = await asyncio.get_running_loop().run_in_executor(None, self.written)
+        if before is None or after is None:
+            # Can't tell, the estimate stands.
+            self.total += estimate
+            return
+        # Counters start over when the cgroup is recreated.
+        written = max(0, after - before)
+        self.budget.charge(self, written - estimate)
+        self.total += written
+        if nbytes > 0:
+            self.ratio += 0.5 * (min(1.0, written / nbytes) - self.ratio)
+            # Keep estimating something, for a cgroup starting to swap again
+            # not to go through the bucket unchecked.
+            self.ratio = max(0.05, self.ratio)
@@ -0,0 +1,275 @@
+"""Reclaim by lowering memory.high step by step, restored from a timer and on exit"""
+
+import asyncio
+import datetime
+import errno
+import json
+import os
+import time
+
+import cgroupfs
+from events import parse_cgroup_events
+from reclaim import ReclaimResult
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def now():
+    return datetime.datetime.now().strftime("%H-%M-%S-%f")
+
+
+def log(msg):
+    print(f"{now()} -- INFO: [{__name__}] {msg}")
+
+
+def read_file(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def write_file(path, value):
+    """Writes value to path, returns 0 or the errno of the failed write."""
+    try:
+        with open(path, "w") as f:
+            f.write(f"{value}\n")
+        return 0
+    except OSError as e:
+        return e.errno
+
+
+def high_events(cgroup):
+    """Returns the high counter of memory.events, or None if it can't be read."""
+    buf = read_file(os.path.join(cgroup, "memory.events"))
+    if buf is None:
+        return None
+    return parse_cgroup_events(buf.encode()).get("high")
+
+
+class HighClamps:
+    """The memory.high values the agent lowered, to put back whatever happens.
+
+    Every cgroup is recorded with its original memory.high, the last limit
+    written and the limit about to be written, in memory and in state_path,
+    rewritten atomically on every change before the write. Either limit is
+    the agent's own: the write may have failed, or the agent died before or
+    after it. An agent killed while holding clamps puts them back with
+    recover() on its next start. A limit changed by someone else meanwhile
+    is left alone.
+    """
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path
+        # {cgroup: [original memory.high, last limit written, limit being written]}
+        self.clamped = {}
+        self.warned = False
+
+    def __len__(self):
+        return len(self.clamped)
+
+    def __contains__(self, cgroup):
+        return cgroup in self.clamped
+
+    def _save(self):
+        if not self.state_path:
+            return
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(self.clamped, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            if not self.warned:
+                log(f"Failed to save the memory.high clamps to '{self.state_path}', they won't be restored after a crash: {e}")
+                self.warned = True
+
+    def clamp(self, cgroup, limit):
+        """Records limit as about to be written to the memory.high of cgroup, returns False if it can't be."""
+        if cgroup not in self.clamped:
+            original = read_file(os.path.join(cgroup, "memory.high"))
+            if original is None:
+                return False
+            self.clamped[cgroup] = [original, None, None]
+        self.clamped[cgroup][2] = str(limit)
+        self._save()
+        return True
+
+    def clamped_to(self, cgroup, written):
+        """Records the outcome of the write announced by clamp()."""
+        entry = self.clamped[cgroup]
+        if written:
+            entry[1] = entry[2]
+        entry[2] = None
+        self._save()
+
+    def release(self, cgroup):
+        """Puts the original memory.high of cgroup back if it's still the agent's limit, returns whether it did."""
+        entry = self.clamped.pop(cgroup, None)
+        if entry is None:
+            return False
+        original, *limits = entry
+        path = os.path.join(cgroup, "memory.high")
+        current = read_file(path)
+        restored = False
+        if current is None or current == original:
+            pass
+        elif current not in limits:
+            log(f"[{cgroup}] memory.high was changed to {current} meanwhile, leaving it alone.")
+        else:
+            err = write_file(path, original)
+            if err:
+                log(f"[{cgroup}] Failed to restore memory.high to {original}: {os.strerror(err)}.")
+            restored = not err
+        self._save()
+        return restored
+
+    def release_all(self):
+        for cgroup in list(self.clamped):
+            self.release(cgroup)
+
+    def recover(self):
+        """Releases the clamps left behind by a previous agent."""
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, "r") as f:
+                self.clamped.update(json.load(f))
+        except (OSError, ValueError):
+            return
+        for cgroup, (original, *limits) in list(self.clamped.items()):
+            limits = " or ".join(limit for limit in limits if limit is not None)
+            log(f"[{cgroup}] Restoring memory.high to {original}, left at {limits} by a previous run.")
+            self.release(cgroup)
+
+
+class MemoryHighThrottle:
+    """Reclaims from a cgroup by lowering its memory.high, like old/agent.py's memory.high policy.
+
+    The limit goes down from memory.current to memory.current minus the cold
+    memory in `steps` writes, `step_seconds` apart, is held `hold_seconds`
+    and then restored from a loop timer, so nothing waits on the throttle.
+    In the meantime the high counter of memory.events is checked every
+    `step_seconds`: when allocations run into the limit more often than
+    `max_events_per_second`, it's restored at once rather than letting the
+    throttle turn into a stall storm.
+    """
+
+    def __init__(self, cgroup, clamps, steps, step_seconds, hold_seconds, max_events_per_second):
+        self.cgroup = cgroup
+        self.clamps = clamps
+        self.steps = max(1, steps)
+        self.step_seconds = step_seconds
+        self.hold_seconds = hold_seconds
+        self.max_events_per_second = max_events_per_second
+        self.timer = None
+        self.deadline = None
+        self.events = None
+        self.events_time = None
+        # Why the last throttle ended, for the cycle's report.
+        self.outcome = None
+
+    def throttled(self):
+        """Returns the rate of high events since the last check if it's over the limit, or None."""
+        events = high_events(self.cgroup)
+        t = cgroupfs.monotonic()
+        if events is None or self.events is None:
+            self.events, self.events_time = events, t
+            return None
+        rate = (events - self.events) / max(1e-3, t - self.events_time)
+        self.events, self.events_time = events, t
+        return rate if rate > self.max_events_per_second else None
+
+    async def ramp(self, nbytes, stop=None, budget=None):
+        """Lowers memory.high by nbytes in steps and schedules its restore, returns a ReclaimResult.
+
+        Every step waits for the optional swap write budget first.
+        """
+        loop = asyncio.get_running_loop()
+        self.restore("superseded")
+        result = ReclaimResult(nbytes, self.steps)
+        current = read_file(os.path.join(self.cgroup, "memory.current"))
+        if current is None:
+            result.error = errno.ENOENT
+            return result
+        start = int(current)
+        self.throttled()
+        self.outcome = None
+        for i in range(1, self.steps + 1):
+            if stop is not None and stop.is_set():
+                result.interrupted = True
+                self.outcome = "memory pressure"
+                break
+            # memory.high reads back in pages.
+            limit = max(_PAGE_SIZE, start - nbytes * i // self.steps)
+            limit -= limit % _PAGE_SIZE
+            if not self.clamps.clamp(self.cgroup, limit):
+                result.error = errno.ENOENT
+                break
+            if budget is not None:
+                await budget.acquire(nbytes // self.steps)
+            # The kernel reclaims down to the new limit before the write
+            # returns.
+            t0 = time.perf_counter()
+            err = await loop.run_in_executor(
+                None, write_file, os.path.join(self.cgroup, "memory.high"), limit
+            )
+            result.latencies.append(time.perf_counter() - t0)
+            self.clamps.clamped_to(self.cgroup, not err)
+            if err:
+                if budget is not None:
+                    await budget.settle()
+                result.error = err
+                break
+
+            if stop is None:
+                await asyncio.sleep(self.step_seconds)
+            else:
+                try:
+                    await asyncio.wait_for(stop.wait(), self.step_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            # Allocations over the limit keep reclaiming after the write.
+            if budget is not None:
+                await budget.settle()
+            rate = self.throttled()
+            if rate is not None:
+                result.interrupted = True
+                self.outcome = f"{rate:.0f} high events/s"
+                break
+
+        current = read_file(os.path.join(self.cgroup, "memory.current"))
+        if current is not None:
+            result.reclaimed = max(0, start - int(current))
+        if result.error or result.interrupted:
+            self.restore(self.outcome or os.strerror(result.error))
+            return result
+        self.deadline = loop.time() + self.hold_seconds
+        self.timer = loop.call_later(min(self.step_seconds, self.hold_seconds), self.check)
+        return result
+
+    def check(self):
+        """Timer callback while the limit is held."""
+        self.timer = None
+        loop = asyncio.get_running_loop()
+        rate = self.throttled()
+        if rate is not None:
+            self.restore(f"{rate:.0f} high events/s")
+        elif loop.time() >= self.deadline:
+            self.restore("held")
+        else:
+            self.timer = loop.call_later(
+                min(self.step_seconds, self.deadline - loop.time()), self.check
+            )
+
+    def restore(self, reason):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.cgroup not in self.clamps:
+            return
+        self.outcome = reason
+        if self.clamps.release(self.cgroup):
+            log(f"[{self.cgroup}] memory.high restored ({reason}).")
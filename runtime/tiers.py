@@ -0,0 +1,70 @@
+"""Tiered reclaim into zswap and the SSD by page age"""
+
+import collections
+
+# Tiers in the order they're reclaimed in: the coldest memory first, since
+# memory.reclaim evicts the oldest pages first.
+TIERS = ("ssd", "zswap")
+
+
+def tier_bytes(stat, swap_current):
+    """Returns the uncompressed bytes held in each tier.
+
+    Memory in zswap keeps its swap slot, memory.swap.current counts both.
+    """
+    zswapped = stat.get("zswapped", 0)
+    return {"ssd": max(0, swap_current - zswapped), "zswap": zswapped}
+
+
+class SwapInLatencyEstimator:
+    """Estimates the stall caused by a page swapped in from each tier.
+
+    Over a window of cycles, the memory stall time (PSI some total) is
+    regressed on the pages swapped in from zswap (zswpin) and from the SSD
+    (pswpin). Stalls with other causes, e.g. page cache refaults, end up
+    attributed to the tiers, so the estimates are upper bounds.
+    """
+
+    __slots__ = ("history", "last", "latency")
+
+    def __init__(self, window):
+        # (stall us, zswpin, pswpin) deltas of the last cycles.
+        self.history = collections.deque(maxlen=window)
+        self.last = None
+        self.latency = {"ssd": None, "zswap": None}
+
+    def update(self, stall_us, zswpin, pswpin):
+        last, self.last = self.last, (stall_us, zswpin, pswpin)
+        if last is None:
+            return
+        # The counters start over if the cgroup was recreated.
+        self.history.append(tuple(max(0, c - l) for c, l in zip(self.last, last)))
+
+        s_zz = sum(z * z for _, z, _ in self.history)
+        s_pp = sum(p * p for _, _, p in self.history)
+        s_zp = sum(z * p for _, z, p in self.history)
+        s_zy = sum(z * y for y, z, _ in self.history)
+        s_py = sum(p * y for y, _, p in self.history)
+
+        # Without swap-ins from both tiers, or with both always moving
+        # together, each tier gets the whole blame.
+        zswap = s_zy / s_zz if s_zz else None
+        ssd = s_py / s_pp if s_pp else None
+        det = s_zz * s_pp - s_zp * s_zp
+        if det > 0:
+            # Least squares without intercept, falling back to a single tier
+            # when the other one doesn't explain anything more.
+            a = (s_pp * s_zy - s_zp * s_py) / det
+            b = (s_zz * s_py - s_zp * s_zy) / det
+            if a >= 0 and b >= 0:
+                zswap, ssd = a, b
+            elif a < 0:
+                zswap, ssd = 0.0, s_py / s_pp
+            else:
+                zswap, ssd = s_zy / s_zz, 0.0
+
+        # Microseconds per page to seconds per page.
+        self.latency = {
+            "ssd": None if ssd is None else ssd / 1e6,
+            "zswap": None if zswap is None else zswap / 1e6,
+        }
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+"""Compressed binary traces of probed samples
+
+A trace is the magic followed by records, each starting with its kind:
+
+  S  schema: u32 count, then count (u16 length, utf-8 label) new columns.
+     Columns are only ever appended, a block uses the first ncolumns.
+  B  block: u32 nrows, u32 ncolumns, i64 first and last timestamp, one u32
+     byte length per column, then every column: a u8 flag, the presence
+     bitmap of its rows if the flag is set, and the zigzag varints of the
+     deltas between its present values, starting from 0.
+  I  index, written on close: the whole schema, u32 count, then one (u64
+     offset, i64 first timestamp, i64 last timestamp, u32 nrows) per block,
+     followed by its u64 offset and the index magic.
+
+Traces that were never closed, e.g. when the monitor was killed, have no
+index and are scanned record by record instead, up to their last whole
+block. All integers are little endian.
+"""
+
+import argparse
+import datetime
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from samples import MISSING
+
+MAGIC = b"WMOTRC\x00\x01"
+INDEX_MAGIC = b"WMOTRIDX"
+
+_BLOCK = struct.Struct("<IIqq")
+_INDEX_ENTRY = struct.Struct("<QqqI")
+_TRAILER = struct.Struct("<Q8s")
+_HAS_MISSING = 1
+
+
+def now():
+    return datetime.datetime.now().strftime("%H-%M-%S-%f")
+
+
+def log(msg):
+    print(f"{now()} -- INFO: [{__name__}] {msg}")
+
+
+def encode_varints(values):
+    """Encodes uint64 values as LEB128 varints."""
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest != 0
+        rest >>= np.uint64(7)
+    ends = np.cumsum(lengths)
+    out = np.empty(ends[-1] if len(ends) else 0, dtype=np.uint8)
+    starts = ends - lengths
+    rest = values.copy()
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        written = lengths > k
+        byte = (rest[written] & np.uint64(0x7F)).astype(np.uint8)
+        byte[lengths[written] > k + 1] |= 0x80
+        out[starts[written] + k] = byte
+        rest >>= np.uint64(7)
+    return out
+
+
+def decode_varints(buf):
+    """Decodes LEB128 varints into uint64 values."""
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        read = lengths > k
+        values[read] |= (buf[starts[read] + k] & 0x7F).astype(np.uint64) << np.uint64(7 * k)
+    return values
+
+
+def encode_column(column):
+    """Returns the payload of an int64 column holding MISSING for absent values."""
+    present = column != MISSING
+    values = column[present]
+    deltas = np.diff(values, prepend=np.int64(0))
+    zigzag = (deltas << 1 ^ deltas >> 63).view(np.uint64)
+    parts = [bytes([0 if present.all() else _HAS_MISSING])]
+    if not present.all():
+        parts.append(np.packbits(present, bitorder="little").tobytes())
+    parts.append(encode_varints(zigzag).tobytes())
+    return b"".join(parts)
+
+
+def decode_column(payload, nrows):
+    payload = np.frombuffer(payload, dtype=np.uint8)
+    flag, payload = payload[0], payload[1:]
+    present = None
+    if flag & _HAS_MISSING:
+        nbytes = (nrows + 7) // 8
+        present = np.unpackbits(payload[:nbytes], count=nrows, bitorder="little").astype(bool)
+        payload = payload[nbytes:]
+    zigzag = decode_varints(payload)
+    deltas = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    values = np.cumsum(deltas, dtype=np.int64)
+    if present is None:
+        return values
+    column = np.full(nrows, MISSING, dtype=np.int64)
+    column[present] = values
+    return column
+
+
+def _encode_labels(labels):
+    parts = [struct.pack("<I", len(labels))]
+    for label in labels:
+        encoded = label.encode()
+        parts.append(struct.pack("<H", len(encoded)) + encoded)
+    return b"".join(parts)
+
+
+def _decode_labels(buf, offset):
+    (count,) = struct.unpack_from("<I", buf, offset)
+    offset += 4
+    labels = []
+    for _ in range(count):
+        (length,) = struct.unpack_from("<H", buf, offset)
+        offset += 2
+        labels.append(bytes(buf[offset : offset + length]).decode())
+        offset += length
+    return labels, offset
+
+
+class TraceWriter:
+    """Appends the samples of a SampleStore to a trace, one block per write."""
+
+    def __init__(self, path):
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.labels = []
+        self.index = []
+
+    def write(self, store):
+        if store.nrows == 0:
+            return
+        labels = list(store.columns)
+        if len(labels) > len(self.labels):
+            self.f.write(b"S" + _encode_labels(labels[len(self.labels) :]))
+            self.labels = labels
+
+        payloads = [
+            encode_column(np.frombuffer(column, dtype=np.int64))
+            for column in store.columns.values()
+        ]
+        timestamps = store.columns.get("timestamp")
+        first, last = (timestamps[0], timestamps[-1]) if timestamps else (0, 0)
+        self.index.append((self.f.tell(), first, last, store.nrows))
+        self.f.write(b"B" + _BLOCK.pack(store.nrows, len(payloads), first, last))
+        self.f.write(struct.pack(f"<{len(payloads)}I", *map(len, payloads)))
+        for payload in payloads:
+            self.f.write(payload)
+        self.f.flush()
+
+    def close(self):
+        offset = self.f.tell()
+        self.f.write(b"I" + _encode_labels(self.labels) + struct.pack("<I", len(self.index)))
+        for entry in self.index:
+            self.f.write(_INDEX_ENTRY.pack(*entry))
+        self.f.write(_TRAILER.pack(offset, INDEX_MAGIC))
+        self.f.close()
+
+
+class TraceReader:
+    """Reads a trace through a memory map, decoding only the blocks asked for.
+
+    Columns come back as int64 arrays holding MISSING where a sample didn't
+    report the label.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[: len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError(f"'{path}' is not a trace")
+        self.labels = []
+        # (offset, first timestamp, last timestamp, nrows) of every block.
+        self.blocks = []
+        if not self._read_index():
+            self._scan()
+        self.nrows = sum(b[3] for b in self.blocks)
+
+    def _read_index(self):
+        if len(self.mm) < len(MAGIC) + _TRAILER.size:
+            return False
+        offset, magic = _TRAILER.unpack_from(self.mm, len(self.mm) - _TRAILER.size)
+        if magic != INDEX_MAGIC:
+            return False
+        self.labels, offset = _decode_labels(self.mm, offset + 1)
+        (count,) = struct.unpack_from("<I", self.mm, offset)
+        offset += 4
+        for _ in range(count):
+            self.blocks.append(_INDEX_ENTRY.unpack_from(self.mm, offset))
+            offset += _INDEX_ENTRY.size
+        return True
+
+    def _scan(self):
+        offset = len(MAGIC)
+        try:
+            while offset < len(self.mm):
+                kind = self.mm[offset : offset + 1]
+                if kind == b"S":
+                    labels, offset = _decode_labels(self.mm, offset + 1)
+                    self.labels += labels
+                elif kind == b"B":
+                    nrows, ncolumns, first, last = _BLOCK.unpack_from(self.mm, offset + 1)
+                    lengths = struct.unpack_from(f"<{ncolumns}I", self.mm, offset + 1 + _BLOCK.size)
+                    end = offset + 1 + _BLOCK.size + 4 * ncolumns + sum(lengths)
+                    if end > len(self.mm):
+                        break
+                    self.blocks.append((offset, first, last, nrows))
+                    offset = end
+                else:
+                    break
+        except struct.error:
+            # Cut short in the middle of a record.
+            pass
+
+    def block_range(self, start_ms=None, end_ms=None):
+        """Returns the indices of the blocks that can hold samples in [start_ms, end_ms]."""
+        return [
+            i
+            for i, (_, first, last, _) in enumerate(self.blocks)
+            if (start_ms is None or last >= start_ms) and (end_ms is None or first <= end_ms)
+        ]
+
+    def read_block(self, i, labels=None):
+        """Returns {label: column} of a block, for all or the given labels."""
+        offset, _, _, _ = self.blocks[i]
+        nrows, ncolumns, _, _ = _BLOCK.unpack_from(self.mm, offset + 1)
+        offset += 1 + _BLOCK.size
+        lengths = struct.unpack_from(f"<{ncolumns}I", self.mm, offset)
+        offset += 4 * ncolumns
+        wanted = set(self.labels if labels is None else labels)
+        columns = {}
+        for label, length in zip(self.labels, lengths):
+            if label in wanted:
+                columns[label] = decode_column(
+                    memoryview(self.mm)[offset : offset + length], nrows
+                )
+            offset += length
+        # Labels that showed up after this block was written.
+        for label in wanted - columns.keys():
+            columns[label] = np.full(nrows, MISSING, dtype=np.int64)
+        return columns
+
+    def read(self, labels=None, start_ms=None, end_ms=None):
+        """Returns {label: column} of the samples in [start_ms, end_ms]."""
+        labels = list(self.labels if labels is None else labels)
+        window = start_ms is not None or end_ms is not None
+        decoded = labels + ["timestamp"] if window and "timestamp" not in labels else labels
+        blocks = [self.read_block(i, decoded) for i in self.block_range(start_ms, end_ms)]
+        columns = {
+            label: np.concatenate([b[label] for b in blocks]) if blocks else np.empty(0, dtype=np.int64)
+            for label in decoded
+        }
+        if window:
+            # Blocks straddling the window's edges hold samples outside of it.
+            t = columns["timestamp"]
+            keep = np.ones(len(t), dtype=bool)
+            if start_ms is not None:
+                keep &= t >= start_ms
+            if end_ms is not None:
+                keep &= t <= end_ms
+            columns = {label: columns[label][keep] for label in labels}
+        return columns
+
+    def close(self):
+        self.mm.close()
+
+
+def write_csv(reader, f):
+    """Streams a trace out with the layout of the monitor's CSV files."""
+    f.write(",".join(reader.labels) + "\n")
+    for i in range(len(reader.blocks)):
+        columns = reader.read_block(i).values()
+        for row in zip(*(c.tolist() for c in columns)):
+            f.write(",".join("" if v == MISSING else str(v) for v in row) + "\n")
+
+
+def splash():
+    reader = TraceReader(_FLAGS.trace)
+    try:
+        if _FLAGS.command == "info":
+            first = reader.blocks[0][1] if reader.blocks else None
+            last = reader.blocks[-1][2] if reader.blocks else None
+            print(
+                f"{reader.nrows} samples of {len(reader.labels)} labels in {len(reader.blocks)} blocks,"
+                f" from {first} to {last}, {os.path.getsize(_FLAGS.trace)} bytes"
+            )
+        elif _FLAGS.output:
+            with open(_FLAGS.output, "w") as f:
+                write_csv(reader, f)
+            log(f"Converted {reader.nrows} samples to {_FLAGS.output}.")
+        else:
+            write_csv(reader, sys.stdout)
+    finally:
+        reader.close()
+
+
+def parse_cmdline_flags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command",
+        type=str,
+        choices=["csv", "info"],
+        help="Convert the trace back to 'csv', or print 'info' about it",
+    )
+    parser.add_argument("trace", type=str, help="Path to the trace")
+    parser.add_argument(
+        "--output", type=str, help="Path to the CSV file, standard output by default"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    _FLAGS = parse_cmdline_flags()
+    splash()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The runtime scripts import each other as top-level modules.
+RUNTIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "runtime")
+sys.path.insert(0, RUNTIME)
@@ -0,0 +1,63 @@
+"""Agent runs against the emulated cgroupfs, on its virtual clock"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+RUNTIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "runtime")
+FOOTPRINT = 4 << 30
+CGROUP = "/sys/fs/cgroup/w/a"
+
+
+def run_agent(root, *agent_args):
+    """Runs the agent for 300 simulated seconds, returns the cgroup's files and the agent's metrics."""
+    subprocess.run(
+        [
+            sys.executable, os.path.join(RUNTIME, "emulator.py"), "agent", str(root),
+            "--cgroups", CGROUP, "--footprint_bytes", str(FOOTPRINT), "--duration_seconds", "300",
+            "--",
+            "--parent_cgroup", os.path.dirname(CGROUP), "--psi_trigger=",
+            "--memory_high_state_file", str(root / "memory_high.json"),
+            "--metrics_file", str(root / "metrics.prom"),
+            *agent_args,
+        ],
+        check=True,
+        capture_output=True,
+        timeout=120,
+    )
+    cgroup = root / os.path.relpath(CGROUP, "/")
+    files = {name: (cgroup / name).read_text().strip() for name in ("memory.current", "memory.swap.current", "memory.high")}
+    metrics = {}
+    with open(root / "metrics.prom") as f:
+        for line in f:
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                metrics[name.split("{")[0]] = float(value)
+    return files, metrics
+
+
+def test_no_cycle_no_reclaim(tmp_path):
+    files, metrics = run_agent(tmp_path, "--reclaim_freq_seconds", "1000")
+    assert int(files["memory.current"]) == FOOTPRINT
+    assert int(files["memory.swap.current"]) == 0
+    assert metrics.get("wmo_agent_reclaimed_bytes_total", 0) == 0
+
+
+@pytest.mark.parametrize("interface", ["memory.reclaim", "memory.high"])
+def test_reclaims_cold_memory(tmp_path, interface):
+    files, metrics = run_agent(
+        tmp_path,
+        "--reclaim_interface", interface,
+        "--reclaim_freq_seconds", "20",
+        "--cold_age_threshold_ms", "30000",
+    )
+    # 70% of the footprint is cold, most of it ends up swapped out while the
+    # hot memory stays.
+    assert int(files["memory.swap.current"]) > FOOTPRINT // 2 - (256 << 20)
+    assert FOOTPRINT * 0.25 < int(files["memory.current"]) < FOOTPRINT // 2
+    assert metrics["wmo_agent_reclaimed_bytes_total"] > FOOTPRINT // 2
+    # memory.high is back to what it was once the agent is done.
+    assert files["memory.high"] == "max"
+    assert not os.path.exists(tmp_path / "memory_high.json") or (tmp_path / "memory_high.json").read_text() == "{}"
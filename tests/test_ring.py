@@ -0,0 +1,72 @@
+"""The monitor's shared memory ring, read without locking by the agent"""
+
+import time
+
+import numpy as np
+import pytest
+
+from page_age import PageAgeHistogram
+from ring import RingReader, RingWriter
+
+EDGES = np.array([1000, 5000, (1 << 64) - 1], dtype=np.uint64)
+
+
+def histogram(value):
+    return PageAgeHistogram([0, 1], EDGES, np.full((2, 3, 2), value, dtype=np.int64))
+
+
+@pytest.fixture
+def ring(tmp_path):
+    writer = RingWriter(str(tmp_path / "cg.ring"), nslots=2)
+    yield writer
+    writer.close()
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def test_latest_sample(ring):
+    reader = RingReader(ring.path)
+    assert reader.latest(10) is None
+    for value in range(3):
+        ring.publish(now_ms(), value << 20, None, histogram(value))
+    sample = reader.latest(10)
+    assert sample.current == 2 << 20
+    assert sample.swap is None
+    assert sample.hist.nids == [0, 1]
+    np.testing.assert_array_equal(sample.hist.edges, EDGES)
+    assert sample.hist.colder_than(5000).tolist() == [[4, 4], [4, 4]]
+    assert sample.intact()
+
+
+def test_lapped_sample_is_not_intact(ring):
+    reader = RingReader(ring.path)
+    ring.publish(now_ms(), 1, 0, histogram(1))
+    sample = reader.latest(10)
+    copy = sample.hist.pages.copy()
+    # Two more samples reuse the slot of a ring of two.
+    ring.publish(now_ms(), 2, 0, histogram(2))
+    ring.publish(now_ms(), 3, 0, histogram(3))
+    assert not sample.intact()
+    assert not np.array_equal(sample.hist.pages, copy)
+    assert reader.latest(10).current == 3
+
+
+def test_sample_being_written_is_skipped(ring):
+    reader = RingReader(ring.path)
+    ring.publish(now_ms(), 1, 0, histogram(1))
+    # The writer made the seq of the newest slot odd and didn't finish.
+    fields = ring.mapping.fields
+    fields["seq"][0] += 1
+    assert reader.latest(10) is None
+
+
+def test_stale_or_closed_ring(ring):
+    reader = RingReader(ring.path)
+    ring.publish(now_ms() - 60_000, 1, 0, histogram(1))
+    assert reader.latest(10) is None
+    ring.publish(now_ms(), 2, 0, histogram(2))
+    assert reader.latest(10).current == 2
+    ring.mapping.header["closed"] = 1
+    assert reader.latest(10) is None
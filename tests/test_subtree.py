@@ -0,0 +1,39 @@
+"""Totals of a cgroup hierarchy walked by the monitor"""
+
+from subtree import SubtreeWalker
+
+PAGE_AGE = "N0\n1000 {} 0\n5000 {} 0\n"
+
+
+def cgroup(path, current=None, swap=None, page_age=None):
+    path.mkdir(parents=True)
+    if current is not None:
+        (path / "memory.current").write_text(f"{current}\n")
+        (path / "memory.swap.current").write_text(f"{swap}\n")
+    if page_age is not None:
+        (path / "memory.workingset.page_age").write_text(PAGE_AGE.format(*page_age))
+    return path
+
+
+def test_inner_totals(tmp_path):
+    # The root cgroup has no memory.current of its own.
+    root = cgroup(tmp_path / "root")
+    # 50 bytes of "a" are charged to it directly, e.g. page cache left by a
+    # removed child, 30 to "a/nomem" which has no memory controller.
+    cgroup(root / "a", current=300, swap=7)
+    cgroup(root / "a" / "leaf", current=220, swap=5, page_age=(120, 100))
+    cgroup(root / "a" / "nomem")
+    cgroup(root / "b", current=40, swap=1, page_age=(40, 0))
+    cgroup(root / "c")
+
+    walker = SubtreeWalker(str(root), cold_age_threshold_ms=5000, top=2)
+    try:
+        top = walker.walk()
+        a = top.children["a"]
+        assert (a.current, a.swap, a.unaccounted, a.leaves) == (300, 7, 0, 2)
+        assert a.cold == 100
+        assert (top.current, top.swap, top.unaccounted, top.leaves) == (340, 8, 1, 4)
+        assert top.top == [(100, str(root / "a" / "leaf"))]
+        assert [n.path for n in top.nodes()] == [str(root), str(root / "a")]
+    finally:
+        walker.close()
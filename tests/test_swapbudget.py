@@ -0,0 +1,78 @@
+"""The host-wide token bucket of swap writes"""
+
+import asyncio
+
+import pytest
+
+from swapbudget import SwapWriteAccount, SwapWriteBudget, parse_io_stat
+
+RATE = 1 << 20
+
+
+def account(budget, written=lambda: None):
+    return SwapWriteAccount(budget, written)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_parse_io_stat():
+    stats = parse_io_stat(b"8:0 rbytes=4096 wbytes=8192 rios=1 wios=2\n259:0 rbytes=0 wbytes=0 rios=0 wios=0\n")
+    assert stats["8:0"]["wbytes"] == 8192
+    assert stats["259:0"]["rios"] == 0
+    assert parse_io_stat(None) == {}
+
+
+def test_waits_for_tokens():
+    async def main():
+        budget = SwapWriteBudget(RATE, RATE // 4)
+        a = account(budget)
+        # A full bucket serves the first request at once, the second one
+        # waits for it to refill.
+        assert await budget.acquire(a, RATE // 4) < 0.05
+        assert await budget.acquire(a, RATE // 8) == pytest.approx(0.125, abs=0.05)
+
+    run(main())
+
+
+def test_least_served_first():
+    async def main():
+        budget = SwapWriteBudget(RATE, RATE // 4)
+        greedy, idle = account(budget), account(budget)
+        await budget.acquire(greedy, RATE // 4)
+        served = []
+
+        async def request(name, acc):
+            await budget.acquire(acc, RATE // 8)
+            served.append(name)
+
+        # The greedy cgroup asks first but has used the budget lately.
+        first = asyncio.create_task(request("greedy", greedy))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(request("idle", idle))
+        await asyncio.gather(first, second)
+        assert served == ["idle", "greedy"]
+        assert budget.share(greedy) > budget.share(idle)
+
+    run(main())
+
+
+def test_settle_charges_what_was_written():
+    async def main():
+        budget = SwapWriteBudget(RATE, RATE)
+        written = [0]
+        acc = account(budget, lambda: written[0])
+        await acc.acquire(RATE // 2)
+        assert budget.tokens == pytest.approx(RATE // 2, rel=0.01)
+        # Half of the request came from the page cache and wasn't written.
+        written[0] += RATE // 4
+        await acc.settle()
+        assert budget.tokens == pytest.approx(3 * RATE // 4, rel=0.01)
+        assert acc.total == RATE // 4
+        assert acc.ratio == pytest.approx(0.75)
+        # The next request is estimated from what the last ones wrote.
+        await acc.acquire(RATE // 2)
+        assert acc.pending[1] == int(RATE // 2 * 0.75)
+
+    run(main())
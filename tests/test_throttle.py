@@ -0,0 +1,75 @@
+"""The memory.high clamps the agent puts back, even after a crash"""
+
+import json
+import os
+
+import pytest
+
+from throttle import HighClamps, write_file
+
+
+@pytest.fixture
+def cgroup(tmp_path):
+    path = tmp_path / "cg"
+    path.mkdir()
+    (path / "memory.high").write_text("max\n")
+    return str(path)
+
+
+def memory_high(cgroup):
+    with open(os.path.join(cgroup, "memory.high")) as f:
+        return f.read().strip()
+
+
+def clamp(clamps, cgroup, limit):
+    assert clamps.clamp(cgroup, limit)
+    clamps.clamped_to(cgroup, not write_file(os.path.join(cgroup, "memory.high"), limit))
+
+
+def test_release(cgroup, tmp_path):
+    clamps = HighClamps(str(tmp_path / "state.json"))
+    clamp(clamps, cgroup, 1 << 30)
+    clamp(clamps, cgroup, 1 << 29)
+    assert memory_high(cgroup) == str(1 << 29)
+    assert cgroup in clamps
+    assert clamps.release(cgroup)
+    assert memory_high(cgroup) == "max"
+    assert len(clamps) == 0
+    with open(tmp_path / "state.json") as f:
+        assert json.load(f) == {}
+
+
+@pytest.mark.parametrize("written", [False, True])
+def test_recover_after_crash(cgroup, tmp_path, written):
+    state = str(tmp_path / "state.json")
+    clamps = HighClamps(state)
+    clamp(clamps, cgroup, 1 << 30)
+    # Killed right before or after the write of the next step.
+    assert clamps.clamp(cgroup, 1 << 29)
+    if written:
+        write_file(os.path.join(cgroup, "memory.high"), 1 << 29)
+
+    recovered = HighClamps(state)
+    recovered.recover()
+    assert memory_high(cgroup) == "max"
+    assert len(recovered) == 0
+
+
+def test_recover_leaves_foreign_limits(cgroup, tmp_path):
+    state = str(tmp_path / "state.json")
+    clamp(HighClamps(state), cgroup, 1 << 30)
+    # Someone else set a limit of their own since.
+    write_file(os.path.join(cgroup, "memory.high"), 3 << 30)
+
+    recovered = HighClamps(state)
+    recovered.recover()
+    assert memory_high(cgroup) == str(3 << 30)
+    with open(state) as f:
+        assert json.load(f) == {}
+
+
+def test_recover_without_state(cgroup, tmp_path):
+    clamps = HighClamps(str(tmp_path / "missing.json"))
+    clamps.recover()
+    assert len(clamps) == 0
+    assert memory_high(cgroup) == "max"
@@ -0,0 +1,114 @@
+"""Round trips of the binary trace codec and of the monitor's CSV streams"""
+
+import csv
+
+import numpy as np
+
+from monitoring import KeyValueStream
+from samples import MISSING, SampleStore
+from tracefile import TraceReader, TraceWriter, decode_column, decode_varints, encode_column, encode_varints
+
+
+def test_varints_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 1 << 35, (1 << 64) - 1], dtype=np.uint64)
+    buf = encode_varints(values)
+    assert len(buf) == 1 + 1 + 1 + 2 + 2 + 6 + 10
+    np.testing.assert_array_equal(decode_varints(buf), values)
+
+
+def test_column_round_trip():
+    full = np.array([5, 3, 3, -(1 << 40), 1 << 62, 0], dtype=np.int64)
+    np.testing.assert_array_equal(decode_column(encode_column(full), len(full)), full)
+    # Rows without the label are packed as a bitmap, 9 rows need 2 bytes.
+    sparse = np.array([MISSING, 7, MISSING, MISSING, 9, 2, MISSING, 1, MISSING], dtype=np.int64)
+    np.testing.assert_array_equal(decode_column(encode_column(sparse), len(sparse)), sparse)
+    empty = np.full(3, MISSING, dtype=np.int64)
+    np.testing.assert_array_equal(decode_column(encode_column(empty), len(empty)), empty)
+
+
+def write_samples(writer, store, samples):
+    for sample in samples:
+        for label, value in sample.items():
+            store.push(label, value)
+        store.end_sample()
+    writer.write(store)
+    store.clear()
+
+
+# The second block brings a new label, the first block never had it.
+BLOCKS = [
+    [{"timestamp": 1000, "memory.current": 10 << 20}, {"timestamp": 1100, "memory.current": 8 << 20}],
+    [
+        {"timestamp": 1200, "memory.current": 9 << 20, "io.stat.wbytes": 4096},
+        {"timestamp": 1300, "io.stat.wbytes": 8192},
+        {"timestamp": 1400, "memory.current": 1},
+    ],
+]
+
+
+def expected(label):
+    return [s.get(label, MISSING) for block in BLOCKS for s in block]
+
+
+def test_trace_round_trip(tmp_path):
+    path = str(tmp_path / "cg.trace")
+    writer, store = TraceWriter(path), SampleStore()
+    for block in BLOCKS:
+        write_samples(writer, store, block)
+    writer.close()
+
+    reader = TraceReader(path)
+    try:
+        assert reader.labels == ["timestamp", "memory.current", "io.stat.wbytes"]
+        assert reader.nrows == 5
+        columns = reader.read()
+        for label in reader.labels:
+            assert columns[label].tolist() == expected(label)
+        # Only the second block can hold samples from 1250 on.
+        assert reader.block_range(start_ms=1250) == [1]
+        window = reader.read(["memory.current"], start_ms=1100, end_ms=1300)
+        assert window["memory.current"].tolist() == [8 << 20, 9 << 20, MISSING]
+    finally:
+        reader.close()
+
+
+def test_unclosed_trace_is_scanned(tmp_path):
+    path = str(tmp_path / "killed.trace")
+    writer, store = TraceWriter(path), SampleStore()
+    for block in BLOCKS:
+        write_samples(writer, store, block)
+    # Killed in the middle of writing a third block: no index, a torn record.
+    writer.f.write(b"B\x05\x00")
+    writer.f.close()
+
+    reader = TraceReader(path)
+    try:
+        assert len(reader.blocks) == 2
+        assert reader.read()["io.stat.wbytes"].tolist() == expected("io.stat.wbytes")
+    finally:
+        reader.close()
+
+
+def test_csv_rewritten_for_new_labels(tmp_path):
+    path = str(tmp_path / "cg.csv")
+    stream = KeyValueStream(path, flush_freq_seconds=3600)
+    for block in BLOCKS:
+        for sample in block:
+            for label, value in sample.items():
+                stream.push(label, value)
+            stream.end_sample()
+        stream.flush()
+    stream.close()
+
+    with open(path, "r") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["timestamp", "memory.current", "io.stat.wbytes"]
+    # Rows written before the label showed up were padded, the others hold
+    # an empty value where a sample missed a label.
+    assert rows[1:] == [
+        ["1000", str(10 << 20), ""],
+        ["1100", str(8 << 20), ""],
+        ["1200", str(9 << 20), "4096"],
+        ["1300", "", "8192"],
+        ["1400", "1", ""],
+    ]